@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+
+"""
+The application that the load benchmarks run against, started in its own process by `benchmarks.run_load`:
+
+    python -m benchmarks.bench_app --port 9190 [--coroutine]
+"""
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+from naja_atra import request_map, request_filter, FilterContext, HttpSession, MultipartFile, PathValue, Response
+from naja_atra.http_servers.http_server import HttpServer
+from naja_atra.utils.logger import set_level
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+STATIC_FILE_SIZE = 16 * 1024
+
+GZIP_BODY = ("naja atra benchmark " * 1024).strip()
+
+
+@request_filter("/bench/filtered/**")
+def pass_filter(ctx: FilterContext):
+    ctx.request.headers["X-Filtered"] = "true"
+    ctx.do_chain()
+
+
+@request_filter("/bench/filtered/**")
+async def pass_filter_async(ctx: FilterContext):
+    ctx.do_chain()
+
+
+@request_map("/bench/text")
+def plain_text():
+    return Response(headers={"Content-Type": "text/plain; charset=utf-8"}, body="Hello, World!")
+
+
+@request_map("/bench/json")
+def json_body():
+    return {"message": "Hello, World!", "items": [{"id": i, "name": f"item-{i}"} for i in range(10)]}
+
+
+@request_map("/bench/users/{user_id}/orders/{order_id}")
+def path_values(user_id: PathValue, order_id: PathValue):
+    return {"user": int(user_id), "order": order_id}
+
+
+@request_map("/bench/filtered/text")
+def filtered_text():
+    return "filtered"
+
+
+@request_map("/bench/session")
+def session_counter(session: HttpSession):
+    count = (session.get_attribute("count") or 0) + 1
+    session.set_attribute("count", count)
+    return {"count": count}
+
+
+@request_map("/bench/gzip")
+def gzip_text():
+    return Response(headers={"Content-Type": "text/plain; charset=utf-8"}, body=GZIP_BODY)
+
+
+@request_map("/bench/upload", method="POST")
+def upload(file=MultipartFile("file"), note: str = ""):
+    return {"size": file.size, "note": note}
+
+
+@request_map("/__bench/usage")
+def usage():
+    """ The CPU seconds and the memory of this process, read before and after each scenario. """
+    cpu = time.process_time()
+    max_rss_kb = 0
+    if resource is not None:
+        max_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if sys.platform == "darwin":
+            max_rss_kb //= 1024
+    rss_kb = max_rss_kb
+    try:
+        with open("/proc/self/statm") as f:
+            rss_kb = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") // 1024
+    except (OSError, ValueError, AttributeError):
+        pass
+    return {"cpu_seconds": cpu, "rss_kb": rss_kb, "max_rss_kb": max_rss_kb}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9190)
+    parser.add_argument("--coroutine", action="store_true", help="Use the coroutine server instead of the threading one.")
+    parser.add_argument("--max-workers", type=int, default=None, help="The worker threads of the threading server.")
+    args = parser.parse_args(argv)
+
+    set_level("WARN")
+    static_dir = tempfile.mkdtemp(prefix="naja-bench-")
+    with open(os.path.join(static_dir, "page.txt"), "wb") as f:
+        f.write(os.urandom(STATIC_FILE_SIZE // 2).hex().encode())
+    # `HttpServer` rather than `server.start`, which does not take the worker count.
+    http_server = HttpServer(host=(args.host, args.port),
+                             resources={"/bench/static/*": static_dir},
+                             gzip_content_types={"text/plain"},
+                             max_workers=args.max_workers,
+                             keep_alive_max_request=1000000,
+                             prefer_corountine=args.coroutine)
+    http_server.start()
+
+
+if __name__ == "__main__":
+    main()
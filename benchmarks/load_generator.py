@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+
+"""
+A small HTTP/1.1 load generator on asyncio, so the benchmarks need nothing but the standard library.
+
+Each of the `concurrency` workers sends the requests of a scenario one after another on its own connection,
+reusing the connection when `keep_alive` is set or opening a new one for every request otherwise.
+"""
+
+import time
+import asyncio
+from typing import Dict, List, Tuple
+
+
+class Scenario:
+
+    def __init__(self, name: str, path: str, method: str = "GET", headers: Dict[str, str] = {},
+                 body: bytes = b"", keep_cookies: bool = False) -> None:
+        self.name: str = name
+        self.path: str = path
+        self.method: str = method
+        self.headers: Dict[str, str] = dict(headers)
+        self.body: bytes = body
+        # Send back the cookies that the server sets, e.g. to stay in one session.
+        self.keep_cookies: bool = keep_cookies
+
+    def request_bytes(self, host: str, keep_alive: bool, cookies: Dict[str, str]) -> bytes:
+        lines = [f"{self.method} {self.path} HTTP/1.1", f"Host: {host}",
+                 f"Connection: {'keep-alive' if keep_alive else 'close'}"]
+        lines.extend([f"{k}: {v}" for k, v in self.headers.items()])
+        if cookies:
+            lines.append("Cookie: " + "; ".join([f"{k}={v}" for k, v in cookies.items()]))
+        if self.body or self.method in ("POST", "PUT", "PATCH"):
+            lines.append(f"Content-Length: {len(self.body)}")
+        return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + self.body
+
+
+class LoadResult:
+
+    def __init__(self) -> None:
+        self.latencies: List[float] = []
+        self.status_counts: Dict[int, int] = {}
+        self.errors: int = 0
+        self.connections: int = 0
+        self.received_bytes: int = 0
+        self.elapsed: float = 0
+
+    def merge(self, other: "LoadResult") -> None:
+        self.latencies.extend(other.latencies)
+        for status, count in other.status_counts.items():
+            self.status_counts[status] = self.status_counts.get(status, 0) + count
+        self.errors += other.errors
+        self.connections += other.connections
+        self.received_bytes += other.received_bytes
+        self.elapsed = max(self.elapsed, other.elapsed)
+
+    def percentile(self, p: float) -> float:
+        if not self.latencies:
+            return 0
+        latencies = sorted(self.latencies)
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p / 100))]
+
+    def summary(self) -> Dict[str, float]:
+        requests = len(self.latencies)
+        return {
+            "requests": requests,
+            "errors": self.errors,
+            "non_2xx": sum([c for s, c in self.status_counts.items() if not 200 <= s < 300]),
+            "connections": self.connections,
+            "rps": requests / self.elapsed if self.elapsed else 0,
+            "p50_ms": self.percentile(50) * 1000,
+            "p99_ms": self.percentile(99) * 1000,
+            "max_ms": (max(self.latencies) if self.latencies else 0) * 1000,
+            "received_mb_per_s": self.received_bytes / self.elapsed / 1024 / 1024 if self.elapsed else 0,
+        }
+
+
+async def _read_response(reader: asyncio.StreamReader) -> Tuple[int, Dict[str, str], List[str], int]:
+    head = await reader.readuntil(b"\r\n\r\n")
+    lines = head.decode("latin-1").split("\r\n")
+    status = int(lines[0].split(" ", 2)[1])
+    headers: Dict[str, str] = {}
+    set_cookies: List[str] = []
+    for line in lines[1:]:
+        if not line:
+            continue
+        k, _, v = line.partition(":")
+        k = k.strip().lower()
+        headers[k] = v.strip()
+        if k == "set-cookie":
+            set_cookies.append(v.strip())
+    size = len(head)
+    if "content-length" in headers:
+        length = int(headers["content-length"])
+        if length:
+            await reader.readexactly(length)
+        size += length
+    elif headers.get("transfer-encoding", "").lower() == "chunked":
+        while True:
+            chunk_head = await reader.readuntil(b"\r\n")
+            length = int(chunk_head.split(b";")[0], 16)
+            await reader.readexactly(length + 2)
+            size += len(chunk_head) + length + 2
+            if length == 0:
+                break
+    else:
+        size += len(await reader.read())
+        headers["connection"] = "close"
+    return status, headers, set_cookies, size
+
+
+async def _worker(host: str, port: int, scenario: Scenario, keep_alive: bool, deadline: float,
+                  max_requests: int, result: LoadResult) -> None:
+    reader = writer = None
+    cookies: Dict[str, str] = {}
+    host_header = f"{host}:{port}"
+    sent = 0
+    while time.perf_counter() < deadline and (not max_requests or sent < max_requests):
+        sent += 1
+        begin = time.perf_counter()
+        try:
+            if writer is None:
+                reader, writer = await asyncio.open_connection(host, port)
+                result.connections += 1
+            writer.write(scenario.request_bytes(host_header, keep_alive, cookies))
+            status, headers, set_cookies, size = await _read_response(reader)
+        except (OSError, asyncio.IncompleteReadError, ValueError):
+            result.errors += 1
+            if writer is not None:
+                writer.close()
+            reader = writer = None
+            continue
+        result.latencies.append(time.perf_counter() - begin)
+        result.status_counts[status] = result.status_counts.get(status, 0) + 1
+        result.received_bytes += size
+        if scenario.keep_cookies:
+            for cookie in set_cookies:
+                name, _, value = cookie.split(";", 1)[0].partition("=")
+                cookies[name.strip()] = value.strip()
+        if not keep_alive or headers.get("connection", "").lower() == "close":
+            writer.close()
+            reader = writer = None
+    if writer is not None:
+        writer.close()
+
+
+async def run_load(host: str, port: int, scenario: Scenario, concurrency: int = 32, duration: float = 5,
+                   keep_alive: bool = True, max_requests: int = 0) -> LoadResult:
+    """
+    Send the requests of the scenario with `concurrency` connections for `duration` seconds, or until each
+    connection has sent `max_requests` requests if it is set.
+    """
+    result = LoadResult()
+    begin = time.perf_counter()
+    deadline = begin + duration
+    await asyncio.gather(*[_worker(host, port, scenario, keep_alive, deadline, max_requests, result)
+                           for _ in range(concurrency)])
+    result.elapsed = time.perf_counter() - begin
+    return result
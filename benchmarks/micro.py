@@ -0,0 +1,393 @@
+# -*- coding: utf-8 -*-
+
+"""
+Micro-benchmarks of the functions on the hot path of a request, each measured in isolation:
+
+    python -m benchmarks.micro                          # all of them
+    python -m benchmarks.micro --filter routing         # the ones whose name matches the regular expression
+    python -m benchmarks.micro --output micro.json      # write the results as JSON
+    python -m benchmarks.micro --baseline micro.json    # compare with a former run, exit code 1 on regression
+
+For each benchmark, `ns_per_op` is the best of `--repeat` timed runs. With `tracemalloc`, `peak_bytes_per_op` is
+the memory that one call needs at most beyond what it started with, and `retained_blocks_per_op` is the memory
+blocks that are still allocated after a call, e.g. the objects it returns (`peak_bytes_per_op` needs Python 3.9+).
+`mb_per_s` is reported for the benchmarks that handle a payload.
+"""
+
+import os
+import re
+import sys
+import time
+import asyncio
+import argparse
+import tracemalloc
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, List
+
+if __package__ in (None, ""):
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    __package__ = "benchmarks"
+
+from naja_atra.app_conf import _ControllerFunction
+from naja_atra.http_servers.routing_server import RoutingServer
+from naja_atra.models import HttpHeaders, PathValue
+from naja_atra.request_handlers.http_controller_handler import FilterContextImpl, RequestBodyReaderWrapper, RequestWrapper
+from naja_atra.request_handlers.http_request_handler import HttpRequestHandler, RequestWriter
+from naja_atra.request_handlers.multipart_parser import MultipartParser
+from naja_atra.request_handlers.websocket_controller_handler import WebsocketControllerHandler, FIN, WEBSOCKET_OPCODE_BINARY
+from naja_atra.utils import http_utils
+from naja_atra.utils.logger import set_level
+
+from .report import compare, print_regressions, print_table, write_results
+
+
+class Benchmark:
+
+    def __init__(self, name: str, setup: Callable[[], Callable], payload_bytes: int = 0) -> None:
+        self.name: str = name
+        # Returns the function to measure, a plain or an `async` one without arguments.
+        self.setup: Callable[[], Callable] = setup
+        self.payload_bytes: int = payload_bytes
+
+
+BENCHMARKS: List[Benchmark] = []
+
+
+def benchmark(name: str, payload_bytes: int = 0):
+    def decorator(setup: Callable[[], Callable]) -> Callable[[], Callable]:
+        BENCHMARKS.append(Benchmark(name, setup, payload_bytes))
+        return setup
+    return decorator
+
+
+def _noop(*args, **kwargs) -> None:
+    pass
+
+
+# ---------------------------------------------------------------- request line and headers
+
+_REQUEST_HEAD = (b"GET /api/v1/users/123/orders?page=2&size=20&sort=created HTTP/1.1\r\n"
+                 b"Host: example.com\r\n"
+                 b"User-Agent: Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko)\r\n"
+                 b"Accept: text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8\r\n"
+                 b"Accept-Encoding: gzip, deflate, br\r\n"
+                 b"Accept-Language: en-US,en;q=0.9\r\n"
+                 b"Cookie: sid=0123456789abcdef; theme=dark\r\n"
+                 b"Connection: keep-alive\r\n"
+                 b"\r\n")
+
+
+def _request_handler() -> HttpRequestHandler:
+    return HttpRequestHandler(None, None, request_writer=RequestWriter(None), routing_conf=RoutingServer())
+
+
+@benchmark("parse_request")
+def setup_parse_request():
+    handler = _request_handler()
+
+    async def parse_request():
+        reader = asyncio.StreamReader()
+        reader.feed_data(_REQUEST_HEAD)
+        handler.reader = reader
+        assert await handler.parse_request()
+    return parse_request
+
+
+@benchmark("parse_headers")
+def setup_parse_headers():
+    handler = _request_handler()
+    header_lines = _REQUEST_HEAD.split(b"\r\n", 1)[1]
+
+    async def parse_headers():
+        reader = asyncio.StreamReader()
+        reader.feed_data(header_lines)
+        handler.reader = reader
+        await handler.parse_headers()
+    return parse_headers
+
+
+# ---------------------------------------------------------------- routing
+
+def _routing_server(route_count: int) -> RoutingServer:
+    """ Half of the routes are plain urls, the other half have path values. """
+    server = RoutingServer()
+    for i in range(route_count // 2):
+        server.map_controller(_ControllerFunction(url=f"/api/v1/res{i}/list", method="GET", func=_noop))
+        server.map_controller(_ControllerFunction(url=f"/api/v1/res{i}/{{item_id}}", method="GET", func=_noop))
+    return server
+
+
+def _setup_routing(route_count: int, path: str):
+    def setup():
+        server = _routing_server(route_count)
+
+        def get_url_controller():
+            server.get_url_controller(path, "GET")
+        return get_url_controller
+    return setup
+
+
+for _count in (10, 100, 1000, 10000):
+    _last = _count // 2 - 1
+    benchmark(f"routing/{_count}/url")(_setup_routing(_count, f"api/v1/res{_last}/list"))
+    benchmark(f"routing/{_count}/path_value_first")(_setup_routing(_count, "api/v1/res0/42"))
+    benchmark(f"routing/{_count}/path_value_last")(_setup_routing(_count, f"api/v1/res{_last}/42"))
+    benchmark(f"routing/{_count}/not_found")(_setup_routing(_count, "api/v2/none"))
+
+
+@benchmark("get_matched_filters/20")
+def setup_matched_filters():
+    server = RoutingServer()
+    for i in range(10):
+        server.map_filter({"path": f"/api/v{i}/**", "url_pattern": "", "func": _noop})
+        server.map_filter({"path": "", "url_pattern": f"^/admin{i}/.*", "func": _noop})
+
+    def get_matched_filters():
+        server.get_matched_filters("/api/v3/users/123")
+    return get_matched_filters
+
+
+# ---------------------------------------------------------------- model binding
+
+def _controller(user_id: PathValue, page: int = 1, size: int = 20, sort: str = "id", tags: List[str] = []):
+    return user_id
+
+
+@benchmark("model_binding")
+def setup_model_binding():
+    server = RoutingServer()
+    ctrl = _ControllerFunction(url="/api/v1/users/{user_id}", method="GET", func=_controller)
+    plan = server.get_binding_plan(ctrl)
+    headers = HttpHeaders({"Host": "example.com"})
+
+    async def bind():
+        req = RequestWrapper()
+        req.method = "GET"
+        req.path = "/api/v1/users/123"
+        req.headers = headers
+        req.query_string = "page=2&size=20&sort=created&tags=a&tags=b"
+        req.path_values = {"user_id": "123"}
+        await FilterContextImpl(req, None, ctrl, plan)._run_ctrl_fun()
+    return bind
+
+
+# ---------------------------------------------------------------- query string and multipart
+
+@benchmark("decode_query_string")
+def setup_decode_query_string():
+    query_string = "page=2&size=20&sort=created&q=%E4%B8%AD%E6%96%87+search&tags=a&tags=b&empty=&flag"
+
+    def decode_query_string():
+        http_utils.decode_query_string(query_string)
+    return decode_query_string
+
+
+def _multipart_body(boundary: str, file_size: int) -> bytes:
+    parts = [f"--{boundary}\r\nContent-Disposition: form-data; name=\"field{i}\"\r\n\r\nvalue {i}\r\n".encode()
+             for i in range(5)]
+    if file_size:
+        parts.append(f"--{boundary}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"a.bin\"\r\n"
+                     "Content-Type: application/octet-stream\r\n\r\n".encode() + os.urandom(file_size) + b"\r\n")
+    parts.append(f"--{boundary}--\r\n".encode())
+    return b"".join(parts)
+
+
+def _setup_multipart(file_size: int):
+    def setup():
+        boundary = "----naja-micro-boundary"
+        body = _multipart_body(boundary, file_size)
+
+        async def parse_multipart():
+            reader = asyncio.StreamReader()
+            reader.feed_data(body)
+            reader.feed_eof()
+            await MultipartParser(RequestBodyReaderWrapper(reader, len(body)), boundary).parse()
+        return parse_multipart
+    return setup
+
+
+benchmark("multipart/fields")(_setup_multipart(0))
+benchmark("multipart/file_256k", payload_bytes=256 * 1024)(_setup_multipart(256 * 1024))
+
+
+# ---------------------------------------------------------------- websocket frames
+
+def _websocket_handler(send: Callable[[bytes], Any] = _noop) -> WebsocketControllerHandler:
+    http_request_handler = SimpleNamespace(
+        request_writer=SimpleNamespace(send=send), routing_conf=RoutingServer(), send_response_only=_noop,
+        send_header=_noop, reader=None, headers=HttpHeaders(), request_path="ws", query_string="", query_parameters={})
+    return WebsocketControllerHandler(http_request_handler)
+
+
+def _masked_frame(payload: bytes) -> bytes:
+    mask = os.urandom(4)
+    length = len(payload)
+    if length <= 125:
+        header = bytes([FIN | WEBSOCKET_OPCODE_BINARY, 0x80 | length])
+    elif length <= 65535:
+        header = bytes([FIN | WEBSOCKET_OPCODE_BINARY, 0x80 | 126]) + length.to_bytes(2, "big")
+    else:
+        header = bytes([FIN | WEBSOCKET_OPCODE_BINARY, 0x80 | 127]) + length.to_bytes(8, "big")
+    return header + mask + bytes([b ^ mask[i % 4] for i, b in enumerate(payload)])
+
+
+def _setup_websocket_decode(size: int):
+    def setup():
+        handler = _websocket_handler()
+        frame = _masked_frame(os.urandom(size))
+
+        async def decode_frame():
+            reader = asyncio.StreamReader()
+            reader.feed_data(frame)
+            handler.reader = reader
+            await handler._read_message_content()
+        return decode_frame
+    return setup
+
+
+@benchmark("websocket/decode/10x125b_one_read", payload_bytes=10 * 125)
+def setup_websocket_decode_batch():
+    handler = _websocket_handler()
+    frames = b"".join([_masked_frame(os.urandom(125)) for _ in range(10)])
+
+    async def decode_frames():
+        reader = asyncio.StreamReader()
+        reader.feed_data(frames)
+        handler.reader = reader
+        for _ in range(10):
+            await handler._read_message_content()
+    return decode_frames
+
+
+def _setup_websocket_encode(size: int):
+    def setup():
+        # The frames are written to a buffer like the one of a transport, so the payload is copied once,
+        # server frames are not masked and the writer is given the payload as it is.
+        sink = bytearray()
+        handler = _websocket_handler(sink.extend)
+        payload = os.urandom(size)
+
+        def encode_frame():
+            del sink[:]
+            handler.send_bytes(WEBSOCKET_OPCODE_BINARY, payload)
+        return encode_frame
+    return setup
+
+
+for _size, _label in ((125, "125b"), (64 * 1024, "64k"), (1024 * 1024, "1m")):
+    benchmark(f"websocket/decode/{_label}", payload_bytes=_size)(_setup_websocket_decode(_size))
+    benchmark(f"websocket/encode/{_label}", payload_bytes=_size)(_setup_websocket_encode(_size))
+
+
+# ---------------------------------------------------------------- the runner
+
+def _timer(op: Callable, loop: asyncio.AbstractEventLoop) -> Callable[[int], float]:
+    """ Return a function that calls `op` n times and returns the seconds it takes. """
+    if asyncio.iscoroutinefunction(op):
+        async def run_async(n: int) -> float:
+            begin = time.perf_counter()
+            for _ in range(n):
+                await op()
+            return time.perf_counter() - begin
+        return lambda n: loop.run_until_complete(run_async(n))
+
+    def run(n: int) -> float:
+        begin = time.perf_counter()
+        for _ in range(n):
+            op()
+        return time.perf_counter() - begin
+    return run
+
+
+def _measure_memory(op: Callable, loop: asyncio.AbstractEventLoop, calls: int) -> Dict[str, float]:
+    results: List[Any] = []
+    if asyncio.iscoroutinefunction(op):
+        def call():
+            results.append(loop.run_until_complete(op()))
+    else:
+        def call():
+            results.append(op())
+    call()
+    # `tracemalloc.reset_peak` is added in Python 3.9, the peak of each call cannot be told before it.
+    measure_peak = hasattr(tracemalloc, "reset_peak")
+    tracemalloc.start()
+    try:
+        peak = 0
+        begin_blocks = sum([s.count for s in tracemalloc.take_snapshot().statistics("filename")])
+        for _ in range(calls):
+            if measure_peak:
+                before, _ = tracemalloc.get_traced_memory()
+                tracemalloc.reset_peak()
+            call()
+            if measure_peak:
+                _, call_peak = tracemalloc.get_traced_memory()
+                peak = max(peak, call_peak - before)
+        end_blocks = sum([s.count for s in tracemalloc.take_snapshot().statistics("filename")])
+    finally:
+        tracemalloc.stop()
+    result = {"retained_blocks_per_op": max(0, end_blocks - begin_blocks) / calls}
+    if measure_peak:
+        result["peak_bytes_per_op"] = peak
+    return result
+
+
+def run_benchmark(bench: Benchmark, min_time: float, repeat: int, memory: bool) -> Dict[str, float]:
+    loop = asyncio.new_event_loop()
+    try:
+        op = bench.setup()
+        timer = _timer(op, loop)
+        # Find the count of calls that takes `min_time` / `repeat` seconds, like `timeit.Timer.autorange`.
+        number = 1
+        while True:
+            elapsed = timer(number)
+            if elapsed >= min_time / repeat or number >= 10 ** 7:
+                break
+            number = max(number * 2, int(number * min_time / repeat / max(elapsed, 1e-9) * 0.8))
+        times = sorted([timer(number) / number for _ in range(repeat)])
+        result = {"ns_per_op": times[0] * 1e9, "median_ns_per_op": times[len(times) // 2] * 1e9,
+                  "ops_per_s": 1 / times[0], "calls": number * repeat}
+        if bench.payload_bytes:
+            result["mb_per_s"] = bench.payload_bytes / times[0] / 1024 / 1024
+        if memory:
+            result.update(_measure_memory(op, loop, min(number, 20)))
+        return result
+    finally:
+        loop.close()
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--filter", default="", help="Only run the benchmarks whose name matches this regular expression.")
+    parser.add_argument("--list", action="store_true", help="List the benchmarks.")
+    parser.add_argument("--min-time", type=float, default=0.5, help="Seconds of the timed runs of each benchmark.")
+    parser.add_argument("--repeat", type=int, default=5, help="Timed runs of each benchmark, the best one is reported.")
+    parser.add_argument("--no-memory", action="store_true", help="Do not measure the memory with tracemalloc.")
+    parser.add_argument("--output", default="", help="Write the results as JSON to this file, '-' for stdout.")
+    parser.add_argument("--baseline", default="", help="Compare the results with this JSON file of a former run.")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="Changes to the worse beyond this ratio are regressions.")
+    args = parser.parse_args(argv)
+
+    benches = [b for b in BENCHMARKS if re.search(args.filter, b.name)]
+    if args.list:
+        print("\n".join([b.name for b in benches]))
+        return 0
+    # The debug logs on the hot path would be measured otherwise.
+    set_level("ERROR")
+    results: Dict[str, Dict[str, float]] = {}
+    for bench in benches:
+        results[bench.name] = run_benchmark(bench, args.min_time, args.repeat, not args.no_memory)
+        print(f"{bench.name}: {results[bench.name]['ns_per_op']:.0f} ns/op", file=sys.stderr)
+
+    print_table(results, ["ns_per_op", "ops_per_s", "mb_per_s", "peak_bytes_per_op", "retained_blocks_per_op"])
+    settings = {"min_time": args.min_time, "repeat": args.repeat}
+    if args.output:
+        write_results(args.output, "micro", results, settings)
+    if args.baseline:
+        regressions = compare(args.baseline, results, args.tolerance, settings)
+        print_regressions(regressions, args.tolerance)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
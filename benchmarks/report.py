@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+
+"""
+Write the results of the benchmarks as JSON and compare them with a stored baseline.
+
+A result file looks like:
+
+    {"kind": "load", "python": "3.11.7", "platform": "...", "results": {"<case>": {"<metric>": 1.0, ...}, ...}}
+
+The tables and the messages are printed to stderr, so the JSON written to stdout with `--output -` can be parsed.
+"""
+
+import sys
+import json
+import platform
+from typing import Dict, List, Tuple
+
+# Whether a larger value of the metric is better, the metrics that are absent are not compared.
+LARGER_IS_BETTER: Dict[str, bool] = {
+    "rps": True,
+    "received_mb_per_s": True,
+    "mb_per_s": True,
+    "p50_ms": False,
+    "p99_ms": False,
+    "cpu_ms_per_request": False,
+    "ns_per_op": False,
+    "peak_bytes_per_op": False,
+    "retained_blocks_per_op": False,
+}
+
+
+def write_results(path: str, kind: str, results: Dict[str, Dict[str, float]], settings: Dict = {}) -> None:
+    data = {
+        "kind": kind,
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "settings": settings,
+        "results": results,
+    }
+    if path == "-":
+        json.dump(data, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+    else:
+        with open(path, "w") as f:
+            json.dump(data, f, indent=2)
+
+
+def compare(baseline_path: str, results: Dict[str, Dict[str, float]], tolerance: float,
+            settings: Dict = {}) -> List[Tuple[str, str, float, float, float]]:
+    """
+    Return the regressions, as (case, metric, baseline, current, change), the change is the ratio of how much
+    worse the current value is, the cases and the metrics that are absent in either side are skipped.
+    """
+    with open(baseline_path) as f:
+        data = json.load(f)
+    baseline = data["results"]
+    changed = [k for k, v in settings.items() if data.get("settings", {}).get(k, v) != v]
+    if changed or data.get("python") != platform.python_version():
+        print(f"Warning: the baseline is run with a different Python or settings ({', '.join(changed) or 'python'}), "
+              "the numbers may not be comparable.", file=sys.stderr)
+    regressions = []
+    for case, metrics in results.items():
+        for metric, larger_is_better in LARGER_IS_BETTER.items():
+            old = baseline.get(case, {}).get(metric)
+            new = metrics.get(metric)
+            if not old or new is None:
+                continue
+            change = (old - new) / old if larger_is_better else (new - old) / old
+            if change > tolerance:
+                regressions.append((case, metric, old, new, change))
+    return regressions
+
+
+def print_table(results: Dict[str, Dict[str, float]], columns: List[str]) -> None:
+    width = max([len(case) for case in results] + [4])
+    print("case".ljust(width) + "".join([c.rjust(max(14, len(c) + 2)) for c in columns]), file=sys.stderr)
+    for case, metrics in results.items():
+        cells = []
+        for c in columns:
+            value = metrics.get(c)
+            cells.append(("-" if value is None else f"{value:.2f}" if isinstance(value, float) else str(value)).rjust(max(14, len(c) + 2)))
+        print(case.ljust(width) + "".join(cells), file=sys.stderr)
+
+
+def print_regressions(regressions: List[Tuple[str, str, float, float, float]], tolerance: float) -> None:
+    if not regressions:
+        print(f"No regression larger than {tolerance:.0%} against the baseline.", file=sys.stderr)
+        return
+    print(f"{len(regressions)} regression(s) larger than {tolerance:.0%} against the baseline:", file=sys.stderr)
+    for case, metric, old, new, change in regressions:
+        print(f"  {case} {metric}: {old:.3f} -> {new:.3f} ({change:+.1%} worse)", file=sys.stderr)
@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+
+"""
+Load benchmarks of the threading and the coroutine servers.
+
+Each server is started in its own process (`benchmarks.bench_app`) and loaded by the scenarios one by one,
+with and without keep-alive. RPS, p50/p99 latency, the server's CPU time per request and its RSS are reported,
+and can be written as JSON and compared with a baseline:
+
+    python -m benchmarks.run_load --duration 5 --concurrency 32 --output load.json
+    python -m benchmarks.run_load --baseline load.json --tolerance 0.1
+
+The generator is in Python too, with `--processes` it runs in several processes so that the client is not
+the bottleneck on a machine with enough cores. Compare the numbers from the same machine only.
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import argparse
+import subprocess
+import multiprocessing
+import urllib.request
+from typing import Dict, List
+
+if __package__ in (None, ""):
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    __package__ = "benchmarks"
+
+from .load_generator import LoadResult, Scenario, run_load
+from .report import compare, print_regressions, print_table, write_results
+
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SERVERS = ("threading", "coroutine")
+
+
+def _multipart_body(boundary: str) -> bytes:
+    content = os.urandom(32 * 1024)
+    return b"".join([
+        f"--{boundary}\r\n".encode(),
+        b'Content-Disposition: form-data; name="note"\r\n\r\nbenchmark\r\n',
+        f"--{boundary}\r\n".encode(),
+        b'Content-Disposition: form-data; name="file"; filename="data.bin"\r\n',
+        b"Content-Type: application/octet-stream\r\n\r\n",
+        content,
+        f"\r\n--{boundary}--\r\n".encode(),
+    ])
+
+
+SCENARIOS: List[Scenario] = [
+    Scenario("text", "/bench/text"),
+    Scenario("json", "/bench/json"),
+    Scenario("path_values", "/bench/users/123/orders/abc-456"),
+    Scenario("filters", "/bench/filtered/text"),
+    Scenario("session", "/bench/session", keep_cookies=True),
+    Scenario("static", "/bench/static/page.txt"),
+    Scenario("gzip", "/bench/gzip", headers={"Accept-Encoding": "gzip"}),
+    Scenario("multipart", "/bench/upload", method="POST",
+             headers={"Content-Type": "multipart/form-data; boundary=naja-bench-boundary"},
+             body=_multipart_body("naja-bench-boundary")),
+]
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _wait_for_port(port: int, timeout: float = 10) -> None:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"The benchmark server does not listen to port {port} in {timeout} seconds.")
+
+
+def _usage(port: int) -> Dict[str, float]:
+    with urllib.request.urlopen(f"http://127.0.0.1:{port}/__bench/usage") as res:
+        return json.loads(res.read())
+
+
+def _load_in_process(args) -> LoadResult:
+    port, scenario, concurrency, duration, keep_alive = args
+    return asyncio.run(run_load("127.0.0.1", port, scenario, concurrency, duration, keep_alive))
+
+
+def _load(port: int, scenario: Scenario, concurrency: int, duration: float, keep_alive: bool, pool) -> LoadResult:
+    if pool is None:
+        return _load_in_process((port, scenario, concurrency, duration, keep_alive))
+    processes = pool._processes
+    tasks = [(port, scenario, max(1, concurrency // processes), duration, keep_alive) for _ in range(processes)]
+    result = LoadResult()
+    for part in pool.map(_load_in_process, tasks):
+        result.merge(part)
+    return result
+
+
+def bench_server(server: str, scenarios: List[Scenario], args, pool) -> Dict[str, Dict[str, float]]:
+    port = _free_port()
+    cmd = [sys.executable, "-m", "benchmarks.bench_app", "--port", str(port)]
+    if server == "coroutine":
+        cmd.append("--coroutine")
+    if args.max_workers:
+        cmd.extend(["--max-workers", str(args.max_workers)])
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([PROJECT_ROOT, os.environ.get("PYTHONPATH", "")]))
+    # The logs of the server go to stderr too, stdout may be the JSON results.
+    proc = subprocess.Popen(cmd, cwd=PROJECT_ROOT, env=env, stdout=sys.stderr)
+    results: Dict[str, Dict[str, float]] = {}
+    try:
+        _wait_for_port(port)
+        for scenario in scenarios:
+            for keep_alive in args.keep_alive_modes:
+                case = f"{server}/{scenario.name}/{'keep-alive' if keep_alive else 'close'}"
+                _load(port, scenario, args.concurrency, args.warmup, keep_alive, pool)
+                before = _usage(port)
+                result = _load(port, scenario, args.concurrency, args.duration, keep_alive, pool)
+                after = _usage(port)
+                summary = result.summary()
+                cpu_seconds = after["cpu_seconds"] - before["cpu_seconds"]
+                summary["cpu_percent"] = cpu_seconds / result.elapsed * 100 if result.elapsed else 0
+                summary["cpu_ms_per_request"] = cpu_seconds * 1000 / summary["requests"] if summary["requests"] else 0
+                summary["rss_mb"] = after["rss_kb"] / 1024
+                summary["max_rss_mb"] = after["max_rss_kb"] / 1024
+                results[case] = summary
+                print(f"{case}: {summary['rps']:.0f} rps, p50 {summary['p50_ms']:.2f}ms, p99 {summary['p99_ms']:.2f}ms, "
+                      f"{summary['errors']} errors, {summary['non_2xx']} non-2xx", file=sys.stderr)
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+    return results
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--servers", default=",".join(SERVERS), help="Comma separated, from: " + ", ".join(SERVERS))
+    parser.add_argument("--scenarios", default="", help="Comma separated, from: " + ", ".join([s.name for s in SCENARIOS]))
+    parser.add_argument("--keep-alive", default="both", choices=("both", "on", "off"))
+    parser.add_argument("--concurrency", type=int, default=32, help="Connections that send the requests at the same time.")
+    parser.add_argument("--duration", type=float, default=5, help="Seconds of each case.")
+    parser.add_argument("--warmup", type=float, default=1, help="Seconds of the load before each case, not measured.")
+    parser.add_argument("--processes", type=int, default=1, help="Processes of the load generator.")
+    parser.add_argument("--max-workers", type=int, default=None, help="Worker threads of the threading server.")
+    parser.add_argument("--output", default="", help="Write the results as JSON to this file, '-' for stdout.")
+    parser.add_argument("--baseline", default="", help="Compare the results with this JSON file of a former run.")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="Changes to the worse beyond this ratio are regressions.")
+    args = parser.parse_args(argv)
+
+    args.keep_alive_modes = {"both": (True, False), "on": (True, ), "off": (False, )}[args.keep_alive]
+    names = [n for n in args.scenarios.split(",") if n]
+    scenarios = [s for s in SCENARIOS if not names or s.name in names]
+    servers = [s for s in args.servers.split(",") if s in SERVERS]
+
+    pool = multiprocessing.Pool(args.processes) if args.processes > 1 else None
+    results: Dict[str, Dict[str, float]] = {}
+    try:
+        for server in servers:
+            results.update(bench_server(server, scenarios, args, pool))
+    finally:
+        if pool is not None:
+            pool.close()
+
+    print_table(results, ["rps", "p50_ms", "p99_ms", "cpu_percent", "cpu_ms_per_request", "rss_mb", "errors", "non_2xx"])
+    settings = {"concurrency": args.concurrency, "duration": args.duration, "processes": args.processes,
+                "max_workers": args.max_workers, "cpu_count": os.cpu_count()}
+    if args.output:
+        write_results(args.output, "load", results, settings)
+    if args.baseline:
+        regressions = compare(args.baseline, results, args.tolerance, settings)
+        print_regressions(regressions, args.tolerance)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
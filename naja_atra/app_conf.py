@@ -26,14 +26,16 @@ import sys
 import inspect
 import asyncio
 import base64
-from typing import Any, Dict, List, Type, Union, Callable
+from typing import Any, Dict, List, Tuple, Type, Union, Callable
 
 from naja_atra.request_handlers.http_session_local_impl import LocalSessionFactory
 
 from .models import Headers, HttpSessionFactory, WebsocketHandler
 from .models import WEBSOCKET_MESSAGE_BINARY, WEBSOCKET_MESSAGE_BINARY_FRAME, WEBSOCKET_MESSAGE_PING, WEBSOCKET_MESSAGE_PONG, WEBSOCKET_MESSAGE_TEXT
 from .request_handlers.model_bindings import ModelBindingConf
+from .utils.json_codec import JSONCodec, get_json_codec
 from .utils.logger import get_logger
+from .utils.http_utils import break_into
 
 _logger = get_logger("naja_atra.app_conf")
 
@@ -70,6 +72,85 @@ def _to_str_list(obj: Union[str, list, tuple]):
         return [str(obj)]
 
 
+class _MatchExpression:
+    """
+    " A compiled `headers` or `params` expression of `request_map`, parsed only once when the
+    " controller is mapped. Supported forms: `k`, `!k`, `k=v`, `k!=v` and `k^=v`.
+    """
+
+    ALWAYS = 0
+    NEVER = 1
+    EXISTS = 2
+    NOT_EXISTS = 3
+    EQUALS = 4
+    NOT_EQUALS = 5
+    STARTS_WITH = 6
+
+    def __init__(self, exp: str = "", where: str = "") -> None:
+        self.exp: str = exp
+        self.key: str = ""
+        self.value: str = ""
+        exp_ = str(exp)
+        e_idx = exp_.find("=")
+        if not exp_:
+            self.kind = self.ALWAYS
+        elif e_idx < 0:
+            if exp_.startswith('!'):
+                self.kind, self.key = self.NOT_EXISTS, exp_[1:]
+            else:
+                self.kind, self.key = self.EXISTS, exp_
+        elif 0 < exp_.find("!=") < e_idx:
+            self.kind = self.NOT_EQUALS
+            self.key, self.value = break_into(exp_, "!=")
+        elif 0 < exp_.find("^=") < e_idx:
+            self.kind = self.STARTS_WITH
+            self.key, self.value = break_into(exp_, "^=")
+        elif e_idx > 0:
+            self.kind = self.EQUALS
+            self.key, self.value = break_into(exp_, "=")
+        else:
+            _logger.error(
+                f"Controller {where} expression [{exp}] is not valied, it will never be matched.")
+            self.kind = self.NEVER
+
+    def match(self, d: Dict[str, Union[List[str], str]]) -> bool:
+        kind = self.kind
+        if kind == self.ALWAYS:
+            return True
+        if kind == self.NEVER:
+            return False
+        if kind == self.EXISTS:
+            return self.key in d
+        if kind == self.NOT_EXISTS:
+            return self.key not in d
+        if self.key not in d:
+            return False
+        dvals = d[self.key]
+        if isinstance(dvals, str):
+            dvals = [dvals]
+        if kind == self.NOT_EQUALS:
+            return self.value not in dvals
+        if kind == self.EQUALS:
+            return self.value in dvals
+        for dv in dvals:
+            if dv.startswith(self.value):
+                return True
+        return False
+
+
+def _match_expressions(d: Dict[str, Union[List[str], str]], exps: List[_MatchExpression], all: bool) -> bool:
+    if not exps:
+        return True
+    for exp in exps:
+        res = exp.match(d)
+        if all and not res:
+            return False
+        if not all and res:  # match one
+            return True
+    # return if all True else False
+    return all
+
+
 class _ControllerFunction:
 
     def __init__(self, url: str = "",
@@ -79,7 +160,8 @@ class _ControllerFunction:
                  match_all_headers_expressions: bool = None,
                  params: List[str] = [],
                  match_all_params_expressions: bool = None,
-                 func: Callable = None) -> None:
+                 func: Callable = None,
+                 max_body_size: int = None) -> None:
         self.__url: str = url
         self.__regexp = regexp
         self.__method: str = method
@@ -95,6 +177,36 @@ class _ControllerFunction:
         self.params: List[str] = params if isinstance(params, list) else [
             params]
         self._match_all_params_expressions: bool = match_all_params_expressions
+        # The maximum `Content-Length` of the request, `None` means the server's `max_body_size` is used.
+        self.max_body_size: int = max_body_size
+        self._header_expressions: List[_MatchExpression] = [
+            _MatchExpression(h, "headers") for h in self.headers]
+        self._param_expressions: List[_MatchExpression] = [
+            _MatchExpression(p, "params") for p in self.params]
+
+    def _is_request_match(self, headers: Dict[str, str], params: Dict[str, List[str]]) -> bool:
+        return _match_expressions(headers, self._header_expressions, self.match_all_headers_expressions) \
+            and _match_expressions(params, self._param_expressions, self.match_all_params_expressions)
+
+    def _required_values(self, where: str, key: str) -> List[str]:
+        """ Values that the header or the parameter of `key` must equal to when all the expressions should be matched. """
+        if where == "headers":
+            exps, all = self._header_expressions, self.match_all_headers_expressions
+        else:
+            exps, all = self._param_expressions, self.match_all_params_expressions
+        if not all:
+            return []
+        return [exp.value for exp in exps if exp.kind == _MatchExpression.EQUALS and exp.key == key]
+
+    def _required_keys(self) -> List[Tuple[str, str]]:
+        keys = []
+        if self.match_all_headers_expressions:
+            keys.extend([("headers", exp.key) for exp in self._header_expressions
+                         if exp.kind == _MatchExpression.EQUALS])
+        if self.match_all_params_expressions:
+            keys.extend([("params", exp.key) for exp in self._param_expressions
+                         if exp.kind == _MatchExpression.EQUALS])
+        return keys
 
     @property
     def match_all_headers_expressions(self):
@@ -144,15 +256,14 @@ class _ControllerFunction:
     def ctrl_object(self) -> object:
         if not self.singleton:
             obj = self._create_ctrl_obj()
-            _logger.debug(f"singleton: create a object -> {obj}")
+            _logger.debug("singleton: create a object -> %s", obj)
             return obj
 
         if self.__ctr_obj is None:
             self.__ctr_obj = self._create_ctrl_obj()
-            _logger.debug(
-                f"object does not exist, create one -> {self.__ctr_obj} ")
+            _logger.debug("object does not exist, create one -> %s ", self.__ctr_obj)
         else:
-            _logger.debug(f"object[{self.__ctr_obj}] exists, return. ")
+            _logger.debug("object[%s] exists, return. ", self.__ctr_obj)
         return self.__ctr_obj
 
     def _create_ctrl_obj(self) -> object:
@@ -267,15 +378,14 @@ class _WebsocketHandlerClass:
             return self.__ctr_obj
         if not self.singleton:
             obj = self._create_ctrl_obj()
-            _logger.debug(f"singleton: create a object -> {obj}")
+            _logger.debug("singleton: create a object -> %s", obj)
             return obj
 
         if self.__ctr_obj is None:
             self.__ctr_obj = self._create_ctrl_obj()
-            _logger.debug(
-                f"object does not exist, create one -> {self.__ctr_obj} ")
+            _logger.debug("object does not exist, create one -> %s ", self.__ctr_obj)
         else:
-            _logger.debug(f"object[{self.__ctr_obj}] exists, return. ")
+            _logger.debug("object[%s] exists, return. ", self.__ctr_obj)
         return self.__ctr_obj
 
     def _create_ctrl_obj(self) -> object:
@@ -320,8 +430,12 @@ class AppConf:
 
         self._error_page = {}
 
+        self._timing_listeners: List[Callable] = []
+
         self._session_factory: HttpSessionFactory = None
 
+        self._json_codec: JSONCodec = None
+
         self.request_map("/favicon.ico")(_favicon)
         self.route = self.request_map
         self.model_binding_conf = ModelBindingConf()
@@ -336,6 +450,20 @@ class AppConf:
     def session_factory(self, session_factory: HttpSessionFactory):
         self._session_factory = session_factory
 
+    @property
+    def json_codec(self) -> JSONCodec:
+        if self._json_codec is None:
+            return get_json_codec()
+        return self._json_codec
+
+    @json_codec.setter
+    def json_codec(self, json_codec: Union[str, JSONCodec]):
+        """ Set the codec or the name of a registered codec, e.g. `orjson`, `ujson`, `msgspec` or `json`. """
+        if isinstance(json_codec, str):
+            self._json_codec = get_json_codec(json_codec)
+        else:
+            self._json_codec = json_codec
+
     def model_binding(self, arg_type: Type):
         def map(model_binding_type):
             self.model_binding_conf.model_bingding_types[arg_type] = model_binding_type
@@ -367,7 +495,8 @@ class AppConf:
                     headers: Union[str, list, tuple] = "",
                     match_all_headers_expressions: bool = None,
                     params: Union[str, list, tuple] = "",
-                    match_all_params_expressions: bool = None) -> Callable:
+                    match_all_params_expressions: bool = None,
+                    max_body_size: int = None) -> Callable:
         _url = url
         len_args = len(anno_args)
         assert len_args <= 1
@@ -399,7 +528,8 @@ class AppConf:
                                                                       match_all_headers_expressions=match_all_headers_expressions,
                                                                       params=ps,
                                                                       match_all_params_expressions=match_all_params_expressions,
-                                                                      func=ctrl)
+                                                                      func=ctrl,
+                                                                      max_body_size=max_body_size)
 
                 return ctrl
 
@@ -411,7 +541,8 @@ class AppConf:
                                          match_all_headers_expressions=match_all_headers_expressions,
                                          params=ps,
                                          match_all_params_expressions=match_all_params_expressions,
-                                         func=ctrl)
+                                         func=ctrl,
+                                         max_body_size=max_body_size)
                 _logger.debug(
                     f"map url {_url} with method[{mth}] to function {ctrl}. with headers {cf.headers} and params {cf.params}")
                 self._request_mappings.append(cf)
@@ -423,14 +554,18 @@ class AppConf:
         else:
             return map
 
-    def request_filter(self, path: str = "", regexp: str = ""):
+    def request_filter(self, path: str = "", regexp: str = "", load_body: bool = False):
+        """
+        " The body of the request is not read before the controller needs it, set `load_body` to read and parse
+        " it before the filter is called, so that the filter can use the body parameters and `ctx.request.json`.
+        """
         p = path
         r = regexp
         assert (p and not r) or (not p and r)
 
         def map(filter_fun):
             self._filters.append(
-                {"path": p, "url_pattern": r, "func": filter_fun})
+                {"path": p, "url_pattern": r, "func": filter_fun, "load_body": load_body})
             return filter_fun
         return map
 
@@ -553,6 +688,15 @@ class AppConf:
         else:
             return map
 
+    def timing_listener(self, func: Callable) -> Callable:
+        """
+        " The function is called with the request and the seconds of each phase of it after it is responded, e.g.
+        " {"parse": 0.0001, "route": 0.00002, "filters": 0.00001, "bind": 0.00003, "controller": 0.002, "write": 0.0001}
+        " The phases that the request does not go through are absent.
+        """
+        self._timing_listeners.append(func)
+        return func
+
     def _get_request_mappings(self) -> List[_ControllerFunction]:
         mappings: List[_ControllerFunction] = []
 
@@ -580,6 +724,7 @@ class AppConf:
                 mhs = ctr_fun._match_all_headers_expressions if ctr_fun._match_all_headers_expressions is not None else clz_ctrl._match_all_headers_expressions
                 ps = ctr_fun.params + clz_ctrl.params
                 mps = ctr_fun._match_all_params_expressions if ctr_fun._match_all_params_expressions is not None else clz_ctrl._match_all_params_expressions
+                mbs = ctr_fun.max_body_size if ctr_fun.max_body_size is not None else clz_ctrl.max_body_size
                 if not ctr_fun.method and methods:
                     for mth in methods:
                         _logger.debug(
@@ -591,7 +736,8 @@ class AppConf:
                                                             headers=hs,
                                                             match_all_headers_expressions=mhs,
                                                             params=ps,
-                                                            match_all_params_expressions=mps))
+                                                            match_all_params_expressions=mps,
+                                                            max_body_size=mbs))
                 else:
                     _logger.debug(
                         f"map url {full_url} included [{clz_url}] with method[{ctr_fun.method}] to function {ctr_fun.func}. ")
@@ -602,7 +748,8 @@ class AppConf:
                                                         headers=hs,
                                                         match_all_headers_expressions=mhs,
                                                         params=ps,
-                                                        match_all_params_expressions=mps))
+                                                        match_all_params_expressions=mps,
+                                                        max_body_size=mbs))
             else:
                 mappings.append(ctr_fun)
 
@@ -630,6 +777,9 @@ class AppConf:
     def _get_error_pages(self) -> Dict[str, Callable]:
         return self._error_page
 
+    def _get_timing_listeners(self) -> List[Callable]:
+        return self._timing_listeners
+
 
 _default_app_conf = AppConf()
 _app_confs: Dict[str, AppConf] = {}
@@ -646,21 +796,23 @@ def request_map(*anno_args,
                 headers: Union[str, list, tuple] = "",
                 match_all_headers_expressions: bool = None,
                 params: Union[str, list, tuple] = "",
-                match_all_params_expressions: bool = None) -> Callable:
+                match_all_params_expressions: bool = None,
+                max_body_size: int = None) -> Callable:
     return _default_app_conf.request_map(*anno_args, url=url,
                                          regexp=regexp,
                                          method=method,
                                          headers=headers,
                                          match_all_headers_expressions=match_all_headers_expressions,
                                          params=params,
-                                         match_all_params_expressions=match_all_params_expressions)
+                                         match_all_params_expressions=match_all_params_expressions,
+                                         max_body_size=max_body_size)
 
 
 route = request_map
 
 
-def request_filter(path: str = "", regexp: str = ""):
-    return _default_app_conf.request_filter(path=path, regexp=regexp)
+def request_filter(path: str = "", regexp: str = "", load_body: bool = False):
+    return _default_app_conf.request_filter(path=path, regexp=regexp, load_body=load_body)
 
 
 def filter_map(regexp: str = "", filter_function: Callable = None) -> Callable:
@@ -694,6 +846,10 @@ def error_message(*anno_args):
     return _default_app_conf.error_message(*anno_args)
 
 
+def timing_listener(func: Callable) -> Callable:
+    return _default_app_conf.timing_listener(func)
+
+
 def model_binding(arg_type: Type):
     return _default_app_conf.model_binding(arg_type)
 
@@ -706,6 +862,10 @@ def set_session_factory(session_factory: HttpSessionFactory):
     _default_app_conf.session_factory = session_factory
 
 
+def set_json_codec(json_codec: Union[str, JSONCodec]):
+    _default_app_conf.json_codec = json_codec
+
+
 def get_app_conf(tag: str = "") -> AppConf:
     if not tag:
         return _default_app_conf
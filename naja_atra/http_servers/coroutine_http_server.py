@@ -31,6 +31,7 @@ from ..request_handlers.http_request_handler import HttpRequestHandler
 
 import asyncio
 import threading
+from typing import Set
 from asyncio.base_events import Server
 from asyncio.streams import StreamReader, StreamWriter
 from ssl import SSLContext
@@ -52,10 +53,31 @@ class CoroutineHTTPServer(RoutingServer):
         self.ssl: SSLContext = ssl
         self.server: Server = None
         self.__thread_local = threading.local()
+        self.__handlers: Set[HttpRequestHandler] = set()
+
+    @property
+    def write_buffer_size(self) -> int:
+        """ Bytes that have been written to all the connections but not sent yet. """
+        return sum([handler.write_buffer_size for handler in list(self.__handlers)])
+
+    @property
+    def open_connections(self) -> int:
+        return len(self.__handlers)
+
+    @property
+    def event_loop(self) -> asyncio.AbstractEventLoop:
+        """ The event loop that serves the connections, None before the server is started. """
+        return self.server.get_loop() if self.server is not None else None
 
     async def callback(self, reader: StreamReader, writer: StreamWriter):
+        writer.transport.set_write_buffer_limits(high=self.write_buffer_high_watermark,
+                                                 low=self.write_buffer_low_watermark)
         handler = HttpRequestHandler(reader, writer, routing_conf=self)
-        await handler.handle_request()
+        self.__handlers.add(handler)
+        try:
+            await handler.handle_request()
+        finally:
+            self.__handlers.discard(handler)
         _logger.debug("Connection ends, close the writer.")
         writer.close()
 
@@ -35,6 +35,10 @@ from ..app_conf import _ControllerFunction, _WebsocketHandlerClass, AppConf, get
 
 
 from ..utils.logger import get_logger
+from ..utils.access_log import AccessLog
+from ..utils.metrics import Metrics
+from ..utils.profiling import RequestProfiler
+from ..utils.sampling_profiler import SamplingProfiler
 
 
 _logger = get_logger("naja_atra.http_servers.http_server")
@@ -72,6 +76,19 @@ class HttpServer:
                  keep_alive_max_request=None,
                  gzip_content_types=set(),
                  gzip_compress_level=9,
+                 multipart_spool_threshold: int = 1024 * 1024,
+                 multipart_max_part_size: int = None,
+                 multipart_max_total_size: int = None,
+                 body_spool_threshold: int = 1024 * 1024,
+                 max_in_flight_body_size: int = None,
+                 max_body_size: int = None,
+                 write_buffer_high_watermark: int = 64 * 1024,
+                 write_buffer_low_watermark: int = None,
+                 access_log: AccessLog = None,
+                 metrics: Metrics = None,
+                 server_timing: bool = False,
+                 request_profiler: RequestProfiler = None,
+                 sampling_profiler: SamplingProfiler = None,
                  app_conf: AppConf = None):
         self.host = host
         self.__ready = False
@@ -108,6 +125,29 @@ class HttpServer:
 
         self.server.gzip_compress_level = gzip_compress_level
         self.server.gzip_content_types = gzip_content_types
+        self.server.multipart_spool_threshold = multipart_spool_threshold
+        self.server.multipart_max_part_size = multipart_max_part_size
+        self.server.multipart_max_total_size = multipart_max_total_size
+        self.server.body_spool_threshold = body_spool_threshold
+        self.server.max_in_flight_body_size = max_in_flight_body_size
+        self.server.max_body_size = max_body_size
+        self.server.write_buffer_high_watermark = write_buffer_high_watermark
+        self.server.write_buffer_low_watermark = write_buffer_low_watermark
+        self.server.access_log = access_log
+        self.server.metrics = metrics
+        if metrics is not None:
+            metrics.bind_server(self.server)
+            if metrics.path:
+                self.map_controller(_ControllerFunction(url=metrics.path, method="GET", func=metrics.response))
+        self.server.request_profiler = request_profiler
+        if request_profiler is not None and request_profiler.admin_path:
+            for mth in ("GET", "POST"):
+                self.map_controller(_ControllerFunction(url=request_profiler.admin_path, method=mth, func=request_profiler.admin))
+        self.server.sampling_profiler = sampling_profiler
+        if sampling_profiler is not None:
+            sampling_profiler.bind_server(self.server)
+            if sampling_profiler.path:
+                self.map_controller(_ControllerFunction(url=sampling_profiler.path, method="GET", func=sampling_profiler.response))
 
         filters = appconf._get_filters()
         # filter configuration
@@ -130,7 +170,10 @@ class HttpServer:
         self.server.keep_alive = keep_alive
         self.server.connection_idle_time = connection_idle_time
         self.server.keep_alive_max_request = keep_alive_max_request
+        self.server.server_timing = server_timing
+        self.server.timing_listeners = list(appconf._get_timing_listeners())
         self.server.session_factory = appconf.session_factory
+        self.server.json_codec = appconf.json_codec
 
     @property
     def ready(self):
@@ -142,6 +185,10 @@ class HttpServer:
     def start(self):
         try:
             self.__ready = True
+            if self.server.metrics is not None:
+                self.server.metrics.start_http_server()
+            if self.server.sampling_profiler is not None:
+                self.server.sampling_profiler.start()
             self.server.start()
         except:
             self.__ready = False
@@ -150,6 +197,10 @@ class HttpServer:
     async def start_async(self):
         try:
             self.__ready = True
+            if self.server.metrics is not None:
+                self.server.metrics.start_http_server()
+            if self.server.sampling_profiler is not None:
+                self.server.sampling_profiler.start()
             await self.server.start_async()
         except:
             self.__ready = False
@@ -158,3 +209,9 @@ class HttpServer:
     def shutdown(self):
         # shutdown it in a seperate thread.
         self.server.shutdown()
+        if self.server.access_log is not None:
+            self.server.access_log.flush()
+        if self.server.metrics is not None:
+            self.server.metrics.stop_http_server()
+        if self.server.sampling_profiler is not None:
+            self.server.sampling_profiler.stop()
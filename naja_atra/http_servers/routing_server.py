@@ -25,21 +25,26 @@ SOFTWARE.
 
 
 from abc import abstractmethod
-import json
 import os
 import re
+import threading
 
 
 from urllib.parse import unquote
 
 from typing import Any, Callable, Dict, List, Set, Tuple, Union
 
-from ..models import StaticFile, HttpSessionFactory
-from ..request_handlers.model_bindings import ModelBindingConf
+from ..models import HttpError, Request, StaticFile, HttpSessionFactory, PathValue
+from ..request_handlers.model_bindings import ModelBindingConf, ModelBindingPlan
 from ..app_conf import _WebsocketHandlerClass, _ControllerFunction
 
 from ..utils.http_utils import remove_url_first_slash, get_function_args, get_function_kwargs, get_path_reg_pattern
+from ..utils.json_codec import JSONCodec, get_json_codec
 from ..utils.logger import get_logger
+from ..utils.access_log import AccessLog
+from ..utils.metrics import Metrics
+from ..utils.profiling import RequestProfiler
+from ..utils.sampling_profiler import SamplingProfiler
 
 _logger = get_logger("naja_atra.http_servers.routing_server")
 
@@ -67,6 +72,257 @@ _EXT_CONTENT_TYPE = {
 }
 
 
+_RES_NAME_CHARS = re.compile(r'[\w%.\-@!\(\)\[\]\|\$]+')
+_RES_PATH_CHARS = re.compile(r'[\w%.\-@!\(\)\[\]\|\$/]+')
+
+
+def _static_file(fpath: str) -> StaticFile:
+    fext = os.path.splitext(fpath)[1]
+    ext = fext.lower()
+    content_type = _EXT_CONTENT_TYPE.get(ext, "application/octet-stream")
+    return StaticFile(fpath, content_type)
+
+
+def _to_url_result(ctrl: _ControllerFunction) -> Tuple[_ControllerFunction, Dict, Tuple]:
+    return ctrl, {}, ()
+
+
+def _ctrl_of(item: Union[_ControllerFunction, Tuple[_ControllerFunction, List[str]]]) -> _ControllerFunction:
+    return item[0] if isinstance(item, tuple) else item
+
+
+class _NarrowingIndex:
+    """
+    " When controllers sharing one url are narrowed by expressions like `a=b`, `a=c`, index them
+    " by the value of that header or parameter. Controllers that do not require a value are always
+    " candidates. Positions are returned in order, so the first matched controller does not change.
+    """
+
+    def __init__(self, ctrls: List[_ControllerFunction]) -> None:
+        self.where: str = ""
+        self.key: str = ""
+        self.values: Dict[str, List[int]] = {}
+        self.others: List[int] = []
+
+        counts: Dict[Tuple[str, str], int] = {}
+        for ctrl in ctrls:
+            for where_key in set(ctrl._required_keys()):
+                counts[where_key] = counts.get(where_key, 0) + 1
+        if not counts:
+            return
+        where_key, count = max(counts.items(), key=lambda it: it[1])
+        if count < 2:
+            return
+        self.where, self.key = where_key
+        for pos, ctrl in enumerate(ctrls):
+            vals = ctrl._required_values(self.where, self.key)
+            if not vals:
+                self.others.append(pos)
+            for val in set(vals):
+                self.values.setdefault(val, []).append(pos)
+
+    def candidates(self, headers: Dict[str, str], params: Dict[str, List[str]]) -> List[int]:
+        d = headers if self.where == "headers" else params
+        if self.key not in d:
+            return self.others
+        dvals = d[self.key]
+        if isinstance(dvals, str):
+            dvals = [dvals]
+        found = [pos for val in dvals for pos in self.values.get(val, ())]
+        if not found:
+            return self.others
+        if not self.others and len(dvals) == 1:
+            return found
+        return sorted(set(found + self.others))
+
+
+class _ControllerBucket(list):
+    """ Controllers (or tuples of controller and path names) mapped to the same url, pattern or regexp. """
+
+    def __init__(self, *args) -> None:
+        super().__init__(*args)
+        self.__index: _NarrowingIndex = None
+        self.__narrowed_by_params: bool = None
+
+    def insert(self, index, item) -> None:
+        super().insert(index, item)
+        self.__index = None
+        self.__narrowed_by_params = None
+
+    def append(self, item) -> None:
+        super().append(item)
+        self.__index = None
+        self.__narrowed_by_params = None
+
+    @property
+    def narrowed_by_params(self) -> bool:
+        if self.__narrowed_by_params is None:
+            self.__narrowed_by_params = any([exp.kind != exp.ALWAYS
+                                             for it in self for exp in _ctrl_of(it)._param_expressions])
+        return self.__narrowed_by_params
+
+    def first_match(self, headers: Dict[str, str], params: Dict[str, List[str]]):
+        if len(self) == 1:
+            item = self[0]
+            return item if _ctrl_of(item)._is_request_match(headers, params) else None
+        if self.__index is None:
+            self.__index = _NarrowingIndex([_ctrl_of(it) for it in self])
+        positions = self.__index.candidates(headers, params) if self.__index.key else range(len(self))
+        for pos in positions:
+            item = self[pos]
+            if _ctrl_of(item)._is_request_match(headers, params):
+                return item
+        return None
+
+
+class _StaticResourceMapping:
+    """
+    " One item of the resources configuration. The controller is created once here and the
+    " file path relative to the root folder is passed to it as the wildcard path value.
+    """
+
+    def __init__(self, order: int, root: str, url: str = "") -> None:
+        self.order: int = order
+        self.root: str = root
+        # The configured resource path is the url of the controller, so it is the route of the static files.
+        self.controller: _ControllerFunction = _ControllerFunction(
+            url=url, func=self.get_static_file)
+        self.controller.singleton = True
+        self.controllers: _ControllerBucket = _ControllerBucket(
+            [self.controller])
+
+    def get_static_file(self, path_val: PathValue) -> StaticFile:
+        return _static_file(f"{self.root}{path_val}")
+
+
+class _StaticResourceNode:
+
+    def __init__(self) -> None:
+        self.children: Dict[str, "_StaticResourceNode"] = {}
+        # xx/*
+        self.one_level: _StaticResourceMapping = None
+        # xx/**
+        self.all_levels: _StaticResourceMapping = None
+
+
+class _StaticResourceIndex:
+    """
+    " Prefix configurations (`xx/*`, `xx/**`) are stored in a tree of path segments, suffix configurations
+    " (`*.xx`, `**.xx`) are stored in dictionaries by the suffix. So a lookup costs one step per path segment
+    " plus one dictionary lookup per dot of the file name. When more than one configuration matches a path,
+    " the one configured first wins, which is the same as trying them one by one.
+    """
+
+    def __init__(self) -> None:
+        self.__root = _StaticResourceNode()
+        self.__one_level_suffixes: Dict[str, _StaticResourceMapping] = {}
+        self.__all_levels_suffixes: Dict[str, _StaticResourceMapping] = {}
+        self.__count = 0
+
+    def clear(self):
+        self.__root = _StaticResourceNode()
+        self.__one_level_suffixes.clear()
+        self.__all_levels_suffixes.clear()
+        self.__count = 0
+
+    def __new_mapping(self, root: str, url: str) -> _StaticResourceMapping:
+        mapping = _StaticResourceMapping(self.__count, root, url)
+        self.__count += 1
+        return mapping
+
+    def add_prefix(self, prefix: str, root: str, all_levels: bool, url: str = ""):
+        node = self.__root
+        for seg in prefix.split("/")[:-1]:
+            if seg not in node.children:
+                node.children[seg] = _StaticResourceNode()
+            node = node.children[seg]
+        # If the same prefix is configured twice, the first one always wins.
+        if all_levels and node.all_levels is None:
+            node.all_levels = self.__new_mapping(root, url)
+        elif not all_levels and node.one_level is None:
+            node.one_level = self.__new_mapping(root, url)
+
+    def add_suffix(self, suffix: str, root: str, all_levels: bool, url: str = ""):
+        suffixes = self.__all_levels_suffixes if all_levels else self.__one_level_suffixes
+        if suffix not in suffixes:
+            suffixes[suffix] = self.__new_mapping(root, url)
+
+    def match(self, path: str) -> Tuple[_StaticResourceMapping, str]:
+        found: _StaticResourceMapping = None
+        found_path: str = ""
+
+        # prefix: walk down the tree segment by segment.
+        node = self.__root
+        pos = 0
+        while node is not None:
+            idx = path.find("/", pos)
+            mapping = node.all_levels
+            if mapping is not None and (found is None or mapping.order < found.order) \
+                    and _RES_PATH_CHARS.fullmatch(path, pos):
+                found, found_path = mapping, path[pos:]
+            if idx < 0:
+                mapping = node.one_level
+                if mapping is not None and (found is None or mapping.order < found.order) \
+                        and _RES_NAME_CHARS.fullmatch(path, pos):
+                    found, found_path = mapping, path[pos:]
+                break
+            node = node.children.get(path[pos:idx])
+            pos = idx + 1
+
+        # suffix: try every extension of the file name, `a.tar.gz` has `tar.gz` and `gz`.
+        if self.__one_level_suffixes or self.__all_levels_suffixes:
+            in_folder = path.find("/") >= 0
+            dot = path.find(".", path.rfind("/") + 1)
+            while dot >= 0:
+                suffix = path[dot + 1:]
+                mapping = self.__all_levels_suffixes.get(suffix)
+                if mapping is not None and (found is None or mapping.order < found.order) \
+                        and _RES_PATH_CHARS.fullmatch(path, 0, dot):
+                    found, found_path = mapping, path
+                mapping = self.__one_level_suffixes.get(suffix)
+                if mapping is not None and not in_folder and (found is None or mapping.order < found.order) \
+                        and _RES_NAME_CHARS.fullmatch(path, 0, dot):
+                    found, found_path = mapping, path
+                dot = path.find(".", dot + 1)
+
+        return found, found_path
+
+
+class BodyBudget:
+    """
+    " Account the bytes of the request bodies that are read into memory by all the requests in flight.
+    " A body larger than the whole budget gets a 413, a body that does not fit in the rest gets a 503.
+    """
+
+    def __init__(self, limit: int = None) -> None:
+        self.limit: int = limit
+        self.__in_flight: int = 0
+        self.__lock = threading.Lock()
+
+    @property
+    def in_flight(self) -> int:
+        return self.__in_flight
+
+    def acquire(self, size: int, held: int = 0) -> None:
+        """ `held` is what the request has acquired before, e.g. for the other parts of a multipart body. """
+        if self.limit is None or size <= 0:
+            return
+        if held + size > self.limit:
+            raise HttpError(413, "Payload Too Large",
+                            f"The request body is larger than {self.limit} bytes.")
+        with self.__lock:
+            if self.__in_flight + size > self.limit:
+                raise HttpError(503, "Service Unavailable",
+                                "Too many request bodies are being processed, please try again later.")
+            self.__in_flight += size
+
+    def release(self, size: int) -> None:
+        if self.limit is None or size <= 0:
+            return
+        with self.__lock:
+            self.__in_flight -= size
+
+
 class RoutingServer:
 
     HTTP_METHODS = ["OPTIONS", "GET", "HEAD",
@@ -85,7 +341,10 @@ class RoutingServer:
             self.method_regexp_mapping[mth] = {}
 
         self.filter_mapping = {}
+        # The filters that need the body to be loaded before they are called.
+        self.body_loading_filters: Set[Callable] = set()
         self._res_conf = []
+        self._res_index = _StaticResourceIndex()
         self.add_res_conf(res_conf)
 
         self.ws_mapping: Dict[str, _ControllerFunction] = {}
@@ -98,8 +357,52 @@ class RoutingServer:
         self.__keep_alive_max_request: int = 10
         self.session_factory: HttpSessionFactory = None
         self.model_binding_conf = model_binding_conf
+        self.__binding_plans: Dict[_ControllerFunction, ModelBindingPlan] = {}
+        self.json_codec: JSONCodec = get_json_codec()
         self.gzip_content_types: Set[str] = set()
         self.gzip_compress_level = 9
+        # Parts with a filename larger than this are spooled to temporary files.
+        self.multipart_spool_threshold: int = 1024 * 1024
+        self.multipart_max_part_size: int = None
+        self.multipart_max_total_size: int = None
+        # Request bodies larger than this are spooled to temporary files when read as `SpooledBody`.
+        self.body_spool_threshold: int = 1024 * 1024
+        self.body_budget: BodyBudget = BodyBudget()
+        # Requests whose `Content-Length` is larger than this are rejected before the body is read.
+        self.max_body_size: int = None
+        # In coroutine mode, writing waits when more than the high watermark is buffered, until it gets below the low one.
+        self.write_buffer_high_watermark: int = 64 * 1024
+        self.write_buffer_low_watermark: int = None
+        # Writes a line for each request when it is set.
+        self.access_log: AccessLog = None
+        # Records the metrics of the requests when it is set.
+        self.metrics: Metrics = None
+        # Called with the request and the durations of its phases after it is responded.
+        self.timing_listeners: List[Callable[[Request, Dict[str, float]], None]] = []
+        # Send the durations of the phases in the `Server-Timing` header.
+        self.server_timing: bool = False
+        # Profiles the controllers of the requests that are asked or sampled to be profiled when it is set.
+        self.request_profiler: RequestProfiler = None
+        # Samples the stacks of the whole process in the background when it is set.
+        self.sampling_profiler: SamplingProfiler = None
+
+    @property
+    def request_timing(self) -> bool:
+        """ Whether the phases of the requests are timed. """
+        return self.server_timing or len(self.timing_listeners) > 0
+
+    @property
+    def max_in_flight_body_size(self) -> int:
+        return self.body_budget.limit
+
+    @max_in_flight_body_size.setter
+    def max_in_flight_body_size(self, val: int):
+        self.body_budget.limit = val if isinstance(val, int) and val > 0 else None
+
+    def get_max_body_size(self, ctrl: _ControllerFunction = None) -> int:
+        if ctrl is not None and ctrl.max_body_size is not None:
+            return ctrl.max_body_size if ctrl.max_body_size > 0 else None
+        return self.max_body_size if isinstance(self.max_body_size, int) and self.max_body_size > 0 else None
 
     @property
     def connection_idle_time(self):
@@ -125,18 +428,18 @@ class RoutingServer:
 
     def put_to_method_url_mapping(self, method, url, ctrl):
         if url not in self.method_url_mapping[method]:
-            self.method_url_mapping[method][url] = []
+            self.method_url_mapping[method][url] = _ControllerBucket()
         self.method_url_mapping[method][url].insert(0, ctrl)
 
     def put_to_path_val_url_mapping(self, method, path_pattern, ctrl, path_names):
         if path_pattern not in self.path_val_url_mapping[method]:
-            self.path_val_url_mapping[method][path_pattern] = []
+            self.path_val_url_mapping[method][path_pattern] = _ControllerBucket()
         self.path_val_url_mapping[method][path_pattern].insert(
             0, (ctrl, path_names))
 
     def put_to_method_regexp_mapping(self, method, regexp, ctrl):
         if regexp not in self.method_regexp_mapping[method]:
-            self.method_regexp_mapping[method][regexp] = []
+            self.method_regexp_mapping[method][regexp] = _ControllerBucket()
         self.method_regexp_mapping[method][regexp].insert(0, ctrl)
 
     @property
@@ -146,6 +449,7 @@ class RoutingServer:
     @res_conf.setter
     def res_conf(self, val: Dict[str, str]):
         self._res_conf.clear()
+        self._res_index.clear()
         self.add_res_conf(val)
 
     def add_res_conf(self, val: Dict[str, str]):
@@ -160,14 +464,21 @@ class RoutingServer:
                 suffix = res_k[2:] if res_k.startswith("**") else res_k[1:]
                 assert suffix.find('/') < 0 and suffix.find(
                     '*') < 0, "If a resource path starts with *, only suffix can be configurated. "
+            if v.endswith(os.path.sep):
+                val = v
+            else:
+                val = v + os.path.sep
+
             if res_k.startswith('**.'):
                 # **.xxx
                 suffix = res_k[3:]
                 key = f'^[\\w%.\\-@!\\(\\)\\[\\]\\|\\$/]+\\.{suffix}$'
+                self._res_index.add_suffix(suffix, val, True, k)
             elif res_k.startswith('*.'):
                 # *.xxx
                 suffix = res_k[2:]
                 key = f'^[\\w%.\\-@!\\(\\)\\[\\]\\|\\$]+\\.{suffix}$'
+                self._res_index.add_suffix(suffix, val, False, k)
             elif res_k.endswith("/**"):
                 # xx/**
                 prefix = res_k[0:-2]
@@ -176,6 +487,7 @@ class RoutingServer:
                 assert prefix.find(
                     "*") < 0, "You can only config a * or ** at the start or end of a path."
                 key = f'^{prefix}([\\w%.\\-@!\\(\\)\\[\\]\\|\\$/]+)$'
+                self._res_index.add_prefix(prefix, val, True, k)
             elif res_k.endswith("/*"):
                 # xx/*
                 prefix = res_k[0:-1]
@@ -184,14 +496,22 @@ class RoutingServer:
                 assert prefix.find(
                     "*") < 0, "You can only config a * or ** at the start or end of a path."
                 key = f'^{prefix}([\\w%.\\-@!\\(\\)\\[\\]\\|\\$]+)$'
-
-            if v.endswith(os.path.sep):
-                val = v
+                self._res_index.add_prefix(prefix, val, False, k)
             else:
-                val = v + os.path.sep
+                raise AssertionError(
+                    f"Resource path [{k}] should end with /, /* or /**, or start with *. or **. ")
+
             self._res_conf.append((key, val))
 
+    def get_binding_plan(self, ctrl: _ControllerFunction) -> ModelBindingPlan:
+        plan = self.__binding_plans.get(ctrl)
+        if plan is None:
+            plan = ModelBindingPlan(ctrl.func, self.model_binding_conf)
+            self.__binding_plans[ctrl] = plan
+        return plan
+
     def map_controller(self, ctrl: _ControllerFunction):
+        self.get_binding_plan(ctrl)
         url = ctrl.url
         regexp = ctrl.regexp
         method = ctrl.method
@@ -212,17 +532,36 @@ class RoutingServer:
                     _method, path_pattern, ctrl, path_names)
 
     def _res_(self, fpath: str):
-        fext = os.path.splitext(fpath)[1]
-        ext = fext.lower()
-        content_type = _EXT_CONTENT_TYPE.get(ext, "application/octet-stream")
-        return StaticFile(fpath, content_type)
+        return _static_file(fpath)
 
     def get_url_controllers(self, path: str = "", method: str = "") -> List[Tuple[_ControllerFunction, Dict, List]]:
+        ctrls, to_result = self.__get_url_bucket(path, method)
+        if ctrls is None:
+            return []
+        return [to_result(item) for item in ctrls]
+
+    def get_url_controller(self, path: str = "", method: str = "",
+                           headers: Dict[str, str] = {},
+                           params: Dict[str, List[str]] = {}) -> Tuple[_ControllerFunction, Dict, List]:
+        """ Get the first controller that matches the path, the method and the `headers` / `params` expressions. """
+        ctrls, to_result = self.__get_url_bucket(path, method)
+        if ctrls is not None:
+            item = ctrls.first_match(headers, params)
+            if item is not None:
+                return to_result(item)
+        return None, {}, ()
+
+    def is_narrowed_by_params(self, path: str = "", method: str = "") -> bool:
+        """ Whether the controllers of this path are narrowed by `params` expressions. """
+        ctrls, _ = self.__get_url_bucket(path, method)
+        return ctrls is not None and ctrls.narrowed_by_params
+
+    def __get_url_bucket(self, path: str, method: str) -> Tuple[_ControllerBucket, Callable]:
         # explicitly url matching
         if path in self.method_url_mapping[method]:
-            return [(ctrl, {}, ()) for ctrl in self.method_url_mapping[method][path]]
+            return self.method_url_mapping[method][path], _to_url_result
         elif path in self.method_url_mapping["_"]:
-            return [(ctrl, {}, ()) for ctrl in self.method_url_mapping["_"][path]]
+            return self.method_url_mapping["_"][path], _to_url_result
 
         # url with path value matching
         path_val_res = self.__try_get_from_path_val(path, method)
@@ -237,49 +576,35 @@ class RoutingServer:
             regexp_res = self.__try_get_ctrl_from_regexp(path, "_")
         if regexp_res is not None:
             return regexp_res
+
         # static files
-        for k, v in self.res_conf:
-            match_static_path_conf = re.match(k, path)
-            _logger.debug(
-                f"{path} macth static file conf {k} ? {match_static_path_conf}")
-            if match_static_path_conf:
-                if match_static_path_conf.groups():
-                    fpath = f"{v}{match_static_path_conf.group(1)}"
-                else:
-                    fpath = f"{v}{path}"
-
-                def static_fun():
-                    return self._res_(fpath)
-                return [(_ControllerFunction(func=static_fun), {}, ())]
-        return []
+        mapping, fpath = self._res_index.match(path)
+        if mapping is not None:
+            return mapping.controllers, lambda ctrl: (ctrl, {"__path_wildcard": fpath}, ())
+        return None, None
 
     def __try_get_ctrl_from_regexp(self, path, method):
         for regex, ctrls in self.method_regexp_mapping[method].items():
             m = re.match(regex, f"/{path}") or re.match(regex, path)
-            _logger.debug(
-                f"regexp::pattern::[{regex}] => path::[{path}] match? {m is not None}")
+            _logger.debug("regexp::pattern::[%s] => path::[%s] match? %s", regex, path, m is not None)
             if m:
-                res = []
                 grps = tuple([unquote(v) for v in m.groups()])
-                for ctrl in ctrls:
-                    res.append((ctrl, [], grps))
-                return res
+                return ctrls, lambda ctrl: (ctrl, [], grps)
         return None
 
     def __try_get_from_path_val(self, path, method):
         for patterns, val in self.path_val_url_mapping[method].items():
             m = re.match(patterns, path)
-            _logger.debug(
-                f"url with path value::pattern::[{patterns}] => path::[{path}] match? {m is not None}")
+            _logger.debug("url with path value::pattern::[%s] => path::[%s] match? %s", patterns, path, m is not None)
             if m:
-                res = []
-                for ctrl_fun, path_names in val:
+                def to_result(item):
+                    ctrl_fun, path_names = item
                     path_values = {}
                     for idx in range(len(path_names)):
                         key = unquote(path_names[idx])
                         path_values[key] = unquote(m.groups()[idx])
-                    res.append((ctrl_fun, path_values, ()))
-                return res
+                    return ctrl_fun, path_values, ()
+                return val, to_result
         return None
 
     def map_filter(self, filter_conf: Dict[str, Any]):
@@ -294,6 +619,8 @@ class RoutingServer:
         _logger.debug(
             f"[path: {path}] map url regexp {regexp} to function: {filter_fun}")
         self.filter_mapping[regexp] = filter_fun
+        if filter_conf.get("load_body"):
+            self.body_loading_filters.add(filter_fun)
 
     def get_matched_filters(self, path):
         return self._get_matched_filters(remove_url_first_slash(path)) + self._get_matched_filters(path)
@@ -302,8 +629,7 @@ class RoutingServer:
         available_filters = []
         for regexp, val in self.filter_mapping.items():
             m = re.match(regexp, path)
-            _logger.debug(
-                f"filter:: [{regexp}], path:: [{path}] match? {m is not None}")
+            _logger.debug("filter:: [%s], path:: [%s] match? %s", regexp, path, m is not None)
             if m:
                 available_filters.append(val)
         return available_filters
@@ -338,8 +664,7 @@ class RoutingServer:
     def __try_get_ws_hanlder_from_regexp(self, path):
         for regex, handler in self.ws_regx_mapping.items():
             m = re.match(regex, f"/{path}") or re.match(regex, path)
-            _logger.debug(
-                f"regexp::pattern::[{regex}] => path::[{path}] match? {m is not None}")
+            _logger.debug("regexp::pattern::[%s] => path::[%s] match? %s", regex, path, m is not None)
             if m:
                 return handler, {}, tuple([unquote(v) for v in m.groups()])
         return None, {}, ()
@@ -347,8 +672,7 @@ class RoutingServer:
     def __try_get_ws_handler_from_path_val(self, path):
         for patterns, val in self.ws_path_val_mapping.items():
             m = re.match(patterns, path)
-            _logger.debug(
-                f"websocket endpoint with path value::pattern::[{patterns}] => path::[{path}] match? {m is not None}")
+            _logger.debug("websocket endpoint with path value::pattern::[%s] => path::[%s] match? %s", patterns, path, m is not None)
             if m:
                 handler, path_names = val
                 path_values = {}
@@ -366,7 +690,7 @@ class RoutingServer:
         self.error_page_mapping[c] = error_page_fun
 
     def _default_error_page(self, code: int, message: str = "", explain: str = ""):
-        return json.dumps({
+        return self.json_codec.dumps({
             "code": code,
             "message": message,
             "explain": explain
@@ -386,7 +710,7 @@ class RoutingServer:
 
         if not func:
             func = self._default_error_page
-        _logger.debug(f"error page function:: {func}")
+        _logger.debug("error page function:: %s", func)
 
         co = code
         msg = message
@@ -397,7 +721,7 @@ class RoutingServer:
 
         args = []
         for n, t in args_def:
-            _logger.debug(f"set value to error_page function -> {n}")
+            _logger.debug("set value to error_page function -> %s", n)
             if co is not None:
                 if t is None or t == int:
                     args.append(co)
@@ -57,21 +57,43 @@ class ThreadingHTTPServer(TCPServer, RoutingServer):
         RoutingServer.__init__(
             self, res_conf, model_binding_conf=model_binding_conf)
         self.max_workers = max_workers or self._default_max_workers
+        self.__counts_lock: threading.Lock = threading.Lock()
+        self.__queued_connections: int = 0
+        self.__busy_threads: int = 0
         self.threadpool: ThreadPoolExecutor = ThreadPoolExecutor(
             thread_name_prefix="ReqThread",
             max_workers=self.max_workers)
         TCPServer.__init__(self, addr, SocketServerStreamRequestHandlerWraper)
 
+    @property
+    def queued_connections(self) -> int:
+        return self.__queued_connections
+
+    @property
+    def busy_threads(self) -> int:
+        return self.__busy_threads
+
+    @property
+    def open_connections(self) -> int:
+        return self.__queued_connections + self.__busy_threads
+
     def process_request_thread(self, request, client_address):
+        with self.__counts_lock:
+            self.__queued_connections -= 1
+            self.__busy_threads += 1
         try:
             self.finish_request(request, client_address)
         except Exception:
             self.handle_error(request, client_address)
         finally:
             self.shutdown_request(request)
+            with self.__counts_lock:
+                self.__busy_threads -= 1
 
     # override
     def process_request(self, request, client_address):
+        with self.__counts_lock:
+            self.__queued_connections += 1
         self.threadpool.submit(
             self.process_request_thread, request, client_address)
 
@@ -22,9 +22,15 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 """
 import http.cookies
+import io
+import mmap
+import os
+import shutil
+import tempfile
 import time
 from abc import abstractmethod
-from typing import Any, Dict, List, Tuple, Union
+from collections.abc import Mapping, MutableMapping
+from typing import Any, BinaryIO, Dict, Iterator, List, Tuple, Union
 
 
 DEFAULT_ENCODING: str = "UTF-8"
@@ -100,25 +106,131 @@ class Cookies(http.cookies.SimpleCookie):
 
 class RequestBodyReader:
 
+    __slots__ = ()
+
     @abstractmethod
     async def read(self, n: int = -1) -> bytes:
         return NotImplemented
 
+    async def read_all(self) -> bytes:
+        """ Read all the remaining body into memory. """
+        return await self.read()
+
+    async def read_spooled(self, spool_threshold: int = 1024 * 1024) -> "SpooledBody":
+        """ Read all the remaining body, spool it to a temporary file if it is larger than `spool_threshold`. """
+        body = SpooledBody(spool_threshold)
+        data = await self.read(64 * 1024)
+        while data:
+            body._write(data)
+            data = await self.read(64 * 1024)
+        body._seal()
+        return body
+
+
+class HttpHeaders(MutableMapping):
+    """
+    " Case-insensitive headers, one name can have more than one value.
+    " `headers[name]` returns the first value, `get_all(name)` returns all of them and `add(name, value)` appends one.
+    " Setting a list to a name replaces all its values.
+    """
+
+    __slots__ = ("__fields", )
+
+    def __init__(self, headers: Union[Mapping, List[Tuple[str, str]]] = None):
+        # lower case name -> [name, value, value, ...]
+        self.__fields: Dict[str, list] = {}
+        if headers:
+            self.update(headers)
+
+    def __getitem__(self, name: str) -> str:
+        return self.__fields[name.lower()][1]
+
+    def __setitem__(self, name: str, value: Union[str, List[str]]) -> None:
+        if isinstance(value, (list, tuple)):
+            if value:
+                self.__fields[name.lower()] = [name, *value]
+            else:
+                self.__fields.pop(name.lower(), None)
+        else:
+            self.__fields[name.lower()] = [name, value]
+
+    def __delitem__(self, name: str) -> None:
+        del self.__fields[name.lower()]
+
+    def __contains__(self, name: object) -> bool:
+        return isinstance(name, str) and name.lower() in self.__fields
+
+    def __iter__(self) -> Iterator[str]:
+        return (field[0] for field in self.__fields.values())
+
+    def __len__(self) -> int:
+        return len(self.__fields)
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}({self.multi_items()!r})"
+
+    def get(self, name: str, default: Any = None) -> Union[str, Any]:
+        field = self.__fields.get(name.lower())
+        return field[1] if field is not None else default
+
+    def get_all(self, name: str) -> List[str]:
+        field = self.__fields.get(name.lower())
+        return field[1:] if field is not None else []
+
+    def add(self, name: str, value: Union[str, List[str]]) -> None:
+        field = self.__fields.get(name.lower())
+        if field is None:
+            self[name] = value
+        elif isinstance(value, (list, tuple)):
+            field.extend(value)
+        else:
+            field.append(value)
+
+    def multi_items(self) -> List[Tuple[str, str]]:
+        return [(field[0], val) for field in self.__fields.values() for val in field[1:]]
+
+    def update(self, headers: Union[Mapping, List[Tuple[str, str]]] = (), **kwargs) -> None:
+        if isinstance(headers, HttpHeaders):
+            for field in headers.__fields.values():
+                self[field[0]] = field[1:]
+        elif isinstance(headers, Mapping):
+            for name, val in headers.items():
+                self[name] = val
+        else:
+            for name, val in headers:
+                self[name] = val
+        for name, val in kwargs.items():
+            self[name] = val
+
+    def copy(self) -> "HttpHeaders":
+        return self.__class__(self)
+
+    def to_dict(self) -> Dict[str, Union[str, List[str]]]:
+        """ A plain `dict` as the headers used to be, a name with more than one value is mapped to a list. """
+        return {field[0]: field[1] if len(field) == 2 else field[1:] for field in self.__fields.values()}
+
 
 class Request:
     """Request"""
 
+    # The slots are partial on purpose: every attribute the server sets, here and in `RequestWrapper`, is a slot,
+    # while `__dict__` is kept for the attributes that filters and controllers set to a request themselves, like a
+    # user an authentication filter has found. Removing it would break them. The `__dict__` is only created when
+    # such an attribute is set, so a request that nobody adds attributes to does not pay for it.
+    __slots__ = ("method", "headers", "__cookies", "query_string", "path_values", "reg_groups", "path",
+                 "__parameters", "__parameter", "_body", "json", "environment", "reader", "__dict__")
+
     def __init__(self):
         self.method: str = ""  # GET, POST, PUT, DELETE, HEAD, etc.
-        self.headers: Dict[str, str] = {}  # Request headers
-        self.__cookies = Cookies()
+        self.headers: HttpHeaders = HttpHeaders()  # Request headers
+        self.__cookies: Cookies = None  # Loaded from the `Cookie` header when it is first accessed
         self.query_string: str = ""  # Query String
         self.path_values: Dict[str, str] = {}
         self.reg_groups = ()  # If controller is matched via regexp, then ,all groups are save here
         self.path: str = ""  # Path
-        self.__parameters = {}  # Parameters, key-value array, merged by query string and request body if the `Content-Type` in request header is `application/x-www-form-urlencoded` or `multipart/form-data`
+        self.__parameters = None  # Parameters, key-value array, merged by query string and request body if the `Content-Type` in request header is `application/x-www-form-urlencoded` or `multipart/form-data`
         # Parameters, key-value, if more than one parameters with the same key, only the first one will be stored.
-        self.__parameter = {}
+        self.__parameter = None
         self._body: bytes = b""  # Request body
         # A dictionary if the `Content-Type` in request header is `application/json`
         self.json: Dict[str, Any] = None
@@ -127,47 +239,60 @@ class Request:
 
     @property
     def cookies(self) -> Cookies:
+        if self.__cookies is None:
+            self.__cookies = Cookies()
+            cookie = self.headers.get("Cookie")
+            if cookie:
+                self.__cookies.load(cookie)
         return self.__cookies
 
     @property
     def parameters(self) -> Dict[str, List[str]]:
+        if self.__parameters is None:
+            self.__parameters = self._decode_parameters()
         return self.__parameters
 
     @parameters.setter
     def parameters(self, val: Dict[str, List[str]]):
         self.__parameters = val
-        self.__parameter = {}
-        for k, v in self.__parameters.items():
-            self.__parameter[k] = v[0]
+        self.__parameter = None
 
     @property
     def parameter(self) -> Dict[str, str]:
+        if self.__parameter is None:
+            self.__parameter = {k: v[0] for k, v in self.parameters.items() if v}
         return self.__parameter
 
+    def _decode_parameters(self) -> Dict[str, List[str]]:
+        """
+        " Called when `parameters` is first accessed and has not been set.
+        """
+        return {}
+
     @property
     def host(self) -> str:
-        if "Host" not in self.headers:
-            return ""
-        else:
-            return self.headers["Host"]
+        return self.headers.get("Host", "")
 
     @property
     def body(self) -> bytes:
         return self._body
 
+    async def load_body(self) -> None:
+        """
+        " The body is read and parsed before a filter registered with `load_body=True` is called, or when a
+        " controller binds an argument that needs it, like `JSONBody`, `MultipartFile`, parameters or the
+        " `Request` itself. Async filters can also await it themselves. It does nothing if the body has been loaded.
+        """
+        pass
+
     @property
     def content_type(self) -> str:
-        if "Content-Type" not in self.headers:
-            return ""
-        else:
-            return self.headers["Content-Type"]
+        return self.headers.get("Content-Type", "")
 
     @property
     def content_length(self) -> int:
-        if "Content-Length" not in self.headers:
-            return None
-        else:
-            return int(self.headers["Content-Length"])
+        content_length = self.headers.get("Content-Length")
+        return int(content_length) if content_length is not None else None
 
     def get_parameter(self, key: str, default: str = None) -> str:
         if key not in self.parameters.keys():
@@ -187,12 +312,21 @@ class MultipartFile:
                  required: bool = False,
                  filename: str = "",
                  content_type: str = "",
-                 content: bytes = None):
+                 content: bytes = None,
+                 temp_file: str = None,
+                 size: int = None):
         self.__name = name
         self.__required = required
         self.__filename = filename
         self.__content_type = content_type
         self.__content = content
+        # Large uploads are spooled to a temporary file, which is removed after the request.
+        self.__file_path: str = temp_file
+        self.__is_temp: bool = temp_file is not None
+        if size is not None:
+            self.__size = size
+        else:
+            self.__size = len(content) if content is not None else 0
 
     @property
     def name(self) -> str:
@@ -212,17 +346,49 @@ class MultipartFile:
 
     @property
     def content(self) -> bytes:
+        """ The whole content in bytes, use `stream` for large files that are spooled to disk. """
+        if self.__content is None and self.__file_path is not None:
+            with open(self.__file_path, "rb") as f:
+                return f.read()
         return self.__content
 
+    @property
+    def size(self) -> int:
+        return self.__size
+
+    @property
+    def stream(self) -> BinaryIO:
+        """ A readable binary file object of the content, close it after reading. """
+        if self.__content is None and self.__file_path is not None:
+            return open(self.__file_path, "rb")
+        return io.BytesIO(self.__content or b"")
+
     @property
     def is_empty(self) -> bool:
-        return self.__content is None or len(self.__content) == 0
+        return self.__size == 0
 
     def save_to_file(self, file_path: str) -> None:
-        if self.__content is not None and len(self.__content) > 0:
+        if self.is_empty:
+            return
+        if self.__is_temp:
+            # rename if possible, copy if the target is in another file system.
+            shutil.move(self.__file_path, file_path)
+            self.__file_path = file_path
+            self.__is_temp = False
+        elif self.__content is None and self.__file_path is not None:
+            shutil.copyfile(self.__file_path, file_path)
+        else:
             with open(file_path, "wb") as f:
                 f.write(self.__content)
 
+    def _remove_temp_file(self) -> None:
+        if self.__is_temp:
+            self.__is_temp = False
+            try:
+                os.remove(self.__file_path)
+            except OSError:
+                pass
+
 
 class ParamStringValue(str):
 
@@ -327,6 +493,97 @@ class BytesBody(bytes):
     pass
 
 
+class SpooledBody:
+    """
+    " The request body, kept in memory if it is not larger than `spool_threshold`, and spooled to a
+    " temporary file otherwise. The temporary file is removed after the request.
+    """
+
+    def __init__(self, spool_threshold: int = 1024 * 1024) -> None:
+        self.__spool_threshold: int = spool_threshold
+        self.__buffer: bytearray = bytearray()
+        self.__file = None
+        self.__mmap: mmap.mmap = None
+        self.__size: int = 0
+
+    def _write(self, data: bytes) -> None:
+        self.__size += len(data)
+        if self.__file is not None:
+            self.__file.write(data)
+            return
+        self.__buffer += data
+        if self.__spool_threshold is not None and len(self.__buffer) > self.__spool_threshold:
+            self.__file = tempfile.NamedTemporaryFile(prefix="naja-atra-", suffix=".body", delete=False)
+            self.__file.write(self.__buffer)
+            self.__buffer = bytearray()
+
+    def _seal(self) -> None:
+        if self.__file is not None:
+            self.__file.flush()
+
+    @property
+    def size(self) -> int:
+        return self.__size
+
+    @property
+    def is_spooled(self) -> bool:
+        return self.__file is not None
+
+    @property
+    def stream(self) -> BinaryIO:
+        """ A readable binary file object of the body, close it after reading. """
+        if self.__file is not None:
+            return open(self.__file.name, "rb")
+        return io.BytesIO(self.__buffer)
+
+    def getbuffer(self) -> memoryview:
+        """
+        " A read-only view of the body without copying it, a spooled body is memory mapped.
+        " Release the view before the request ends.
+        """
+        if self.__file is None:
+            if not hasattr(memoryview, "toreadonly"):
+                # Python 3.7, a read-only view of a bytearray can only be made by copying it.
+                return memoryview(bytes(self.__buffer))
+            return memoryview(self.__buffer).toreadonly()
+        if self.__size == 0:
+            return memoryview(b"")
+        if self.__mmap is None:
+            self.__mmap = mmap.mmap(self.__file.fileno(), 0, access=mmap.ACCESS_READ)
+        return memoryview(self.__mmap)
+
+    def read(self) -> bytes:
+        """ Read the whole body into memory. """
+        if self.__file is None:
+            return bytes(self.__buffer)
+        with open(self.__file.name, "rb") as f:
+            return f.read()
+
+    def save_to_file(self, file_path: str) -> None:
+        if self.__file is not None:
+            shutil.copyfile(self.__file.name, file_path)
+        else:
+            with open(file_path, "wb") as f:
+                f.write(self.__buffer)
+
+    def close(self) -> None:
+        if self.__mmap is not None:
+            try:
+                self.__mmap.close()
+            except BufferError:
+                # a view is still exported, it will be closed when the view is released.
+                pass
+            self.__mmap = None
+        if self.__file is not None:
+            self.__file.close()
+            try:
+                os.remove(self.__file.name)
+            except OSError:
+                pass
+            self.__file = None
+        self.__buffer = bytearray()
+
+
 """
 " The folowing beans are used in Response
 """
@@ -342,12 +599,14 @@ class StaticFile:
 class Response:
     """Response"""
 
+    __slots__ = ("status_code", "__headers", "__body", "__cookies", "__dict__")
+
     def __init__(self,
                  status_code: int = 200,
                  headers: Dict[str, str] = None,
                  body: Union[str, dict, StaticFile, bytes] = ""):
         self.status_code = status_code
-        self.__headers = headers if headers is not None else {}
+        self.__headers = HttpHeaders(headers)
         self.__body = ""
         self.__cookies = Cookies()
         self.__set_body(body)
@@ -380,26 +639,19 @@ class Response:
         self.__body = val
 
     @property
-    def headers(self) -> Dict[str, Union[list, str]]:
+    def headers(self) -> HttpHeaders:
         return self.__headers
 
     def set_header(self, key: str, value: str) -> None:
         self.__headers[key] = value
 
     def add_header(self, key: str, value: Union[str, list]) -> None:
-        if key not in self.__headers.keys():
-            self.__headers[key] = value
-            return
-        if not isinstance(self.__headers[key], list):
-            self.__headers[key] = [self.__headers[key]]
-        if isinstance(value, list):
-            self.__headers[key].extend(value)
-        else:
-            self.__headers[key].append(value)
+        self.__headers.add(key, value)
 
     def add_headers(self, headers: Dict[str, Union[str, List[str]]] = {}) -> None:
         if headers is not None:
-            for k, v in headers.items():
+            items = headers.multi_items() if isinstance(headers, HttpHeaders) else headers.items()
+            for k, v in items:
                 self.add_header(k, v)
 
     @abstractmethod
@@ -418,6 +670,13 @@ class Response:
     def write_bytes(self, data: bytes):
         pass
 
+    async def drain(self) -> None:
+        """
+        " Wait until the data written by `write_bytes` is sent when too much of it is buffered.
+        " Await it in an async controller when streaming a large response to a slow client.
+        """
+        pass
+
     @abstractmethod
     def close(self):
         pass
@@ -447,10 +706,10 @@ class Redirect:
 """
 
 
-class Headers(dict):
+class Headers(HttpHeaders):
 
     def __init__(self, headers: Dict[str, Union[str, List[str]]] = {}):
-        self.update(headers)
+        super().__init__(headers)
 
 
 class Cookie(http.cookies.Morsel):
@@ -478,6 +737,8 @@ class Cookie(http.cookies.Morsel):
 
 class FilterContext:
 
+    __slots__ = ()
+
     @property
     def request(self) -> Request:
         return NotImplemented
@@ -494,35 +755,48 @@ class FilterContext:
 class WebsocketRequest:
 
     def __init__(self):
-        self.headers: Dict[str, str] = {}  # Request headers
-        self.__cookies = Cookies()
+        self.headers: HttpHeaders = HttpHeaders()  # Request headers
+        self.__cookies: Cookies = None  # Loaded from the `Cookie` header when it is first accessed
         self.query_string: str = ""  # Query String
         self.path_values: Dict[str, str] = {}
         self.reg_groups = ()  # If controller is matched via regexp, then ,all groups are save here
         self.path: str = ""  # Path
-        self.__parameters = {}  # Parameters, key-value array, merged by query string and request body if the `Content-Type` in request header is `application/x-www-form-urlencoded` or `multipart/form-data`
+        self.__parameters = None  # Parameters, key-value array, merged by query string and request body if the `Content-Type` in request header is `application/x-www-form-urlencoded` or `multipart/form-data`
         # Parameters, key-value, if more than one parameters with the same key, only the first one will be stored.
-        self.__parameter = {}
+        self.__parameter = None
 
     @property
     def cookies(self) -> Cookies:
+        if self.__cookies is None:
+            self.__cookies = Cookies()
+            cookie = self.headers.get("Cookie")
+            if cookie:
+                self.__cookies.load(cookie)
         return self.__cookies
 
     @property
     def parameters(self) -> Dict[str, List[str]]:
+        if self.__parameters is None:
+            self.__parameters = self._decode_parameters()
         return self.__parameters
 
     @parameters.setter
     def parameters(self, val: Dict[str, List[str]]):
         self.__parameters = val
-        self.__parameter = {}
-        for k, v in self.__parameters.items():
-            self.__parameter[k] = v[0]
+        self.__parameter = None
 
     @property
     def parameter(self) -> Dict[str, str]:
+        if self.__parameter is None:
+            self.__parameter = {k: v[0] for k, v in self.parameters.items() if v}
         return self.__parameter
 
+    def _decode_parameters(self) -> Dict[str, List[str]]:
+        """
+        " Called when `parameters` is first accessed and has not been set.
+        """
+        return {}
+
     def get_parameter(self, key: str, default: str = None) -> str:
         if key not in self.parameters.keys():
             return default
@@ -27,40 +27,60 @@ import asyncio
 from asyncio.streams import StreamReader, StreamWriter
 import gzip
 import os
-import json
-import threading
 import http.cookies as cookies
 import datetime
+import time
 
-from urllib.parse import unquote
-from typing import Any, Callable, Dict, List, Tuple, Union
+from collections.abc import Mapping
+from typing import Any, Awaitable, Callable, Dict, List, Set, Tuple, Union
 
-from .model_bindings import ModelBindingConf
-from ..http_servers.routing_server import RoutingServer
+from .model_bindings import ModelBindingPlan
+from ..http_servers.routing_server import BodyBudget, RoutingServer
 
-from ..models import FilterContext, HttpError, RequestBodyReader, StaticFile, Headers, Redirect, Response, Cookies, MultipartFile, Request, HttpSession, HttpSessionFactory
+from ..models import FilterContext, HttpError, HttpHeaders, RequestBodyReader, StaticFile, Headers, Redirect, Response, Cookies, MultipartFile, Request, HttpSession, HttpSessionFactory, SpooledBody
 from ..models import DEFAULT_ENCODING, SESSION_COOKIE_NAME
 from ..app_conf import _ControllerFunction
 from ..utils import http_utils
 
 from .http_session_local_impl import LocalSessionFactory
+from .multipart_parser import MultipartParser, get_boundary
+from ..utils.json_codec import JSONCodec
 from ..utils.logger import get_logger
-from ..utils.http_utils import get_function_args, get_function_kwargs
+from ..utils.profiling import RequestProfile
 
 _logger = get_logger("naja_atra.request_handlers.http_request_handler")
 
+# Unread request bodies larger than this are not drained, the connection is closed instead.
+_MAX_DISCARDED_BODY_SIZE = 64 * 1024
+
+_FILE_BUFFER_SIZE = 256 * 1024
+
 
 class RequestBodyReaderWrapper(RequestBodyReader):
 
-    def __init__(self, reader: StreamReader, content_length: int = None) -> None:
+    __slots__ = ("_content_length", "_remain_length", "_reader", "_body_budget", "_spool_threshold",
+                 "_reserved", "_spooled_bodies", "_on_first_read")
+
+    def __init__(self, reader: StreamReader, content_length: int = None,
+                 body_budget: BodyBudget = None, spool_threshold: int = 1024 * 1024,
+                 on_first_read: Callable[[], None] = None) -> None:
         self._content_length: int = content_length
         self._remain_length: int = content_length
         self._reader: StreamReader = reader
+        self._body_budget: BodyBudget = body_budget
+        self._spool_threshold: int = spool_threshold
+        self._reserved: int = 0
+        self._spooled_bodies: List[SpooledBody] = None
+        # Called before the first byte of the body is read, e.g. to send the `100 Continue` response.
+        self._on_first_read: Callable[[], None] = on_first_read
 
     async def read(self, n: int = -1):
         data = b''
         if self._remain_length is not None and self._remain_length <= 0:
             return data
+        if self._on_first_read is not None:
+            on_first_read, self._on_first_read = self._on_first_read, None
+            on_first_read()
         if not n or n < 0:
             if self._remain_length:
                 data = await self._reader.read(self._remain_length)
@@ -77,40 +97,94 @@ class RequestBodyReaderWrapper(RequestBodyReader):
 
         return data
 
+    async def read_all(self) -> bytes:
+        if self._remain_length is None:
+            return await self.read()
+        self._reserve(self._remain_length)
+        chunks = []
+        while self._remain_length > 0:
+            data = await self.read(self._remain_length)
+            if not data:
+                break
+            chunks.append(data)
+        return b"".join(chunks)
+
+    async def read_spooled(self, spool_threshold: int = None) -> SpooledBody:
+        threshold = spool_threshold if spool_threshold is not None else self._spool_threshold
+        if self._remain_length is not None and (threshold is None or self._remain_length <= threshold):
+            # Only the bodies that are kept in memory are counted.
+            self._reserve(self._remain_length)
+        body = await super().read_spooled(threshold)
+        if self._spooled_bodies is None:
+            self._spooled_bodies = []
+        self._spooled_bodies.append(body)
+        return body
+
+    def _reserve(self, size: int) -> None:
+        """ Count the bytes of the body kept in memory, they are given back when the request is handled. """
+        if self._body_budget is not None:
+            self._body_budget.acquire(size, self._reserved)
+            self._reserved += size
+
+    def _unreserve(self, size: int) -> None:
+        """ Give back the bytes that were counted but are not kept in memory any more. """
+        if self._body_budget is not None and size > 0:
+            self._body_budget.release(size)
+            self._reserved -= size
+
+    def _release(self) -> None:
+        if self._body_budget is not None:
+            self._body_budget.release(self._reserved)
+        self._reserved = 0
+        if self._spooled_bodies:
+            for body in self._spooled_bodies:
+                body.close()
+        self._spooled_bodies = None
+
+
+def _phase_durations(timestamps: List[Tuple[str, float]]) -> Dict[str, float]:
+    """ The seconds each phase takes, a phase lasts from the end of the previous one to its own end. """
+    durations: Dict[str, float] = {}
+    for (_, prev), (phase, end) in zip(timestamps, timestamps[1:]):
+        durations[phase] = durations.get(phase, 0) + end - prev
+    return durations
+
 
 class RequestWrapper(Request):
 
+    __slots__ = ("_path", "__session", "_socket_req", "_coroutine_objects", "_session_fac", "_json_codec",
+                 "_body_loader", "_multipart_files", "_timestamps", "_profile")
+
     def __init__(self):
         super().__init__()
-        self._headers_keys_in_lowcase = {}
         self._path = ""
         self.__session = None
         self._socket_req = None
         self._coroutine_objects = []
         self._session_fac: HttpSessionFactory = None
+        self._json_codec: JSONCodec = None
+        self._body_loader: Callable[["RequestWrapper"], Awaitable] = None
+        self._multipart_files: List[MultipartFile] = None
+        # (phase, the time it ends), only when the phases are timed.
+        self._timestamps: List[Tuple[str, float]] = None
+        self._profile: RequestProfile = None
 
-    @property
-    def host(self) -> str:
-        if "host" not in self._headers_keys_in_lowcase:
-            return ""
-        else:
-            return self.headers["host"]
+    def _mark(self, phase: str) -> None:
+        if self._timestamps is not None:
+            self._timestamps.append((phase, time.perf_counter()))
 
-    @property
-    def content_type(self) -> str:
-        if "content-type" not in self._headers_keys_in_lowcase:
-            return ""
-        else:
-            return self.headers["content-type"]
+    async def load_body(self) -> None:
+        loader, self._body_loader = self._body_loader, None
+        if loader is not None:
+            await loader(self)
 
-    @property
-    def content_length(self) -> int:
-        if "content-length" not in self._headers_keys_in_lowcase:
-            return ""
-        else:
-            return self.headers["content-length"]
+    def _decode_parameters(self) -> Dict[str, List[str]]:
+        return http_utils.decode_query_string(self.query_string)
 
     def get_session(self, create: bool = False) -> HttpSession:
+        if not self.__session and not create and "Cookie" not in self.headers:
+            # No session cookie, so there is no session to find.
+            return None
         if not self.__session:
             sid = self.cookies[SESSION_COOKIE_NAME].value if SESSION_COOKIE_NAME in self.cookies.keys(
             ) else ""
@@ -122,9 +196,32 @@ class RequestWrapper(Request):
         self._coroutine_objects.append(coroutine_object)
 
 
+class _ParametersView(Mapping):
+    """ Lets the routing read the parameters of a request without decoding them if no controller needs them. """
+
+    __slots__ = ("__req", )
+
+    def __init__(self, req: Request) -> None:
+        self.__req: Request = req
+
+    def __getitem__(self, key: str) -> List[str]:
+        return self.__req.parameters[key]
+
+    def __contains__(self, key: object) -> bool:
+        return key in self.__req.parameters
+
+    def __iter__(self):
+        return iter(self.__req.parameters)
+
+    def __len__(self) -> int:
+        return len(self.__req.parameters)
+
+
 class ResponseWrapper(Response):
     """ """
 
+    __slots__ = ("__req_handler", "__is_sent", "__header_sent")
+
     def __init__(self, handler,
                  status_code=200,
                  headers=None):
@@ -132,18 +229,16 @@ class ResponseWrapper(Response):
         self.__req_handler = handler
         self.__is_sent = False
         self.__header_sent = False
-        self.__send_lock__ = threading.Lock()
 
     @property
     def is_sent(self) -> bool:
         return self.__is_sent
 
     def send_error(self, status_code: int, message: str = "", explain: str = "") -> None:
-        with self.__send_lock__:
-            self.__is_sent = True
-            self.status_code = status_code
-            self.__req_handler.send_error(
-                self.status_code, message=message, explain=explain, headers=self.headers)
+        self.__is_sent = True
+        self.status_code = status_code
+        self.__req_handler.send_error(
+            self.status_code, message=message, explain=explain, headers=self.headers)
 
     def send_redirect(self, url: str) -> None:
         self.status_code = 302
@@ -152,10 +247,6 @@ class ResponseWrapper(Response):
         self.send_response()
 
     def send_response(self) -> None:
-        with self.__send_lock__:
-            self.__send_response()
-
-    def __send_response(self):
         assert not self.__is_sent and not self.__header_sent, "This response has benn sent"
         self.__header_sent = True
         self.__is_sent = True
@@ -172,12 +263,17 @@ class ResponseWrapper(Response):
             self.__req_handler._send_and_end_res_headers(
                 self.status_code, headers=self.headers, cks=self.cookies)
 
+    async def drain(self) -> None:
+        await self.__req_handler.drain_writer()
+
     def write_bytes(self, data: bytes):
         assert not self.__is_sent, "This response has benn sent"
         assert isinstance(data, bytes) or isinstance(
             data, bytearray), "You can "
         self.__send_headers()
-        self.__req_handler.writer.write(data)
+        self.__req_handler._write_body(data)
+        # Streamed data is expected by the client now, do not keep it in the buffer of threading mode.
+        self.__req_handler.flush_writer()
 
     def close(self):
         self.__is_sent = True
@@ -188,14 +284,18 @@ class ResponseWrapper(Response):
 class FilterContextImpl(FilterContext):
     """Context of a filter"""
 
+    __slots__ = ("__request", "__response", "__controller", "__filters", "__binding_plan", "__body_loading_filters")
+
     DEFAULT_TIME_OUT = 10
 
-    def __init__(self, req, res, controller: _ControllerFunction, model_binding_conf: ModelBindingConf, filters: List[Callable] = None):
+    def __init__(self, req, res, controller: _ControllerFunction, binding_plan: ModelBindingPlan, filters: List[Callable] = None,
+                 body_loading_filters: Set[Callable] = frozenset()):
         self.__request: RequestWrapper = req
         self.__response = res
         self.__controller: _ControllerFunction = controller
         self.__filters: List[Callable] = filters if filters is not None else []
-        self.__model_binding_conf = model_binding_conf
+        self.__binding_plan: ModelBindingPlan = binding_plan
+        self.__body_loading_filters: Set[Callable] = body_loading_filters
 
     @property
     def request(self) -> RequestWrapper:
@@ -206,18 +306,23 @@ class FilterContextImpl(FilterContext):
         return self.__response
 
     async def _run_ctrl_fun(self):
-        args = await self.__prepare_args()
-        kwargs = await self.__prepare_kwargs()
-        if asyncio.iscoroutinefunction(self.__controller.func):
-            if kwargs is None:
-                ctr_res = await self.__controller.func(*args)
-            else:
-                ctr_res = await self.__controller.func(*args, **kwargs)
+        profile = self.request._profile
+        if profile is not None:
+            return await profile.call_async(self.__call_ctrl_fun)
+        return await self.__call_ctrl_fun()
+
+    async def __call_ctrl_fun(self):
+        plan = self.__binding_plan
+        ctr_obj = self.__controller.ctrl_object if plan.args else None
+        if plan.requires_body(ctr_obj):
+            await self.request.load_body()
+        args, kwargs = await plan.bind(self.request, self.response, ctr_obj)
+        self.request._mark("bind")
+        if plan.is_coroutine:
+            ctr_res = await self.__controller.func(*args, **kwargs)
         else:
-            if kwargs is None:
-                ctr_res = self.__controller.func(*args)
-            else:
-                ctr_res = self.__controller.func(*args, **kwargs)
+            ctr_res = self.__controller.func(*args, **kwargs)
+        self.request._mark("controller")
         return ctr_res
 
     def _do_res(self, ctr_res):
@@ -271,7 +376,12 @@ class FilterContextImpl(FilterContext):
             self.response.send_response()
 
     async def _do_request_async(self):
+        self.request._mark("filters")
         ctr_res = await self._run_ctrl_fun()
+        profile = self.request._profile
+        if profile is not None and profile.inline:
+            ctr_res = Response(status_code=200, headers={"Content-Type": "text/plain; charset=utf-8"},
+                               body=profile.stats_text())
         self._do_res(ctr_res)
 
     def do_chain(self):
@@ -279,11 +389,15 @@ class FilterContextImpl(FilterContext):
             return
         if self.__filters:
             filter_func = self.__filters.pop(0)
-            self.request._put_coroutine_task(
-                self._wrap_to_async(filter_func, [self]))
+            self.request._put_coroutine_task(self.__call_filter(filter_func))
         else:
             self.request._put_coroutine_task(self._do_request_async())
 
+    async def __call_filter(self, filter_func: Callable) -> Any:
+        if filter_func in self.__body_loading_filters:
+            await self.request.load_body()
+        return await self._wrap_to_async(filter_func, [self])
+
     async def _wrap_to_async(self, func: Callable, args: List = [], kwargs: Dict = {}) -> Any:
         if asyncio.iscoroutinefunction(func):
             return await func(*args, **kwargs)
@@ -308,58 +422,17 @@ class FilterContextImpl(FilterContext):
                     body = item
         return status_code, headers, cks, body
 
-    async def __prepare_args(self):
-        args = get_function_args(self.__controller.func)
-        arg_vals = []
-        if len(args) > 0:
-            ctr_obj = self.__controller.ctrl_object
-            if ctr_obj is not None:
-                arg_vals.append(self.__controller.ctrl_object)
-                args = args[1:]
-        for arg, arg_type_anno in args:
-            param = await self.__get_params_(arg, arg_type_anno)
-            if param is None:
-                raise HttpError(400, "Missing Paramter",
-                                f"Parameter[{arg}] is required! ")
-            arg_vals.append(param)
-
-        return arg_vals
-
-    async def __get_params_(self, arg, arg_type, val=None):
-        if arg_type in self.__model_binding_conf.model_bingding_types:
-            binding_type = self.__model_binding_conf.model_bingding_types[arg_type]
-        else:
-            binding_type = self.__model_binding_conf.default_model_binding_type
-
-        binding_obj = binding_type(self.request,
-                                   self.response,
-                                   arg,
-                                   arg_type,
-                                   val)
-        return await self._wrap_to_async(binding_obj.bind)
-
-    async def __prepare_kwargs(self):
-        kwargs = get_function_kwargs(self.__controller.func)
-        if kwargs is None:
-            return None
-        kwarg_vals = {}
-        for k, v, t in kwargs:
-            kwarg_vals[k] = await self.__get_params_(
-                k, type(v) if v is not None else t, v)
-
-        return kwarg_vals
-
 
 class HTTPControllerHandler:
+    """
+    " Handles the requests of one connection one by one, so it is created once and reused for the keep-alive requests.
+    """
 
-    def __init__(self, http_request_handler, environment={}) -> None:
-        self.method: str = http_request_handler.command
-        self.request_path: str = http_request_handler.request_path
-        self.query_string: str = http_request_handler.query_string
-        self.query_parameters: Dict[str, List[str]
-                                    ] = http_request_handler.query_parameters
-        self.headers: Dict[str, str] = http_request_handler.headers
+    __slots__ = ("method", "request_path", "query_string", "headers", "routing_conf", "reader",
+                 "send_header", "end_headers", "send_response", "send_error", "flush_writer", "drain_writer", "writer",
+                 "environment", "__http_request_handler", "__expect_continue", "__pending_file", "__timestamps")
 
+    def __init__(self, http_request_handler, environment={}) -> None:
         self.routing_conf: RoutingServer = http_request_handler.routing_conf
         self.reader: StreamReader = http_request_handler.reader
 
@@ -367,111 +440,98 @@ class HTTPControllerHandler:
         self.end_headers = http_request_handler.end_headers
         self.send_response = http_request_handler.send_response
         self.send_error = http_request_handler.send_error
+        self.flush_writer = http_request_handler.flush_writer
+        self.drain_writer = http_request_handler.drain_writer
         self.writer: StreamWriter = http_request_handler.writer
         self.environment: Dict[str, Any] = environment
+        self.__http_request_handler = http_request_handler
+        self.__reset()
 
-    def __match_one_exp(self, d: Dict[str, Union[List[str], str]], exp: str, where: str) -> bool:
-        if not exp:
-            return True
-        _logger.debug(
-            f"Match controller {where} expression [{exp}] for values: {d}. ")
-        exp_ = str(exp)
-        e_idx = exp_.find("=")
-        if e_idx < 0:
-            _logger.debug(f"cannot find = in exp {exp}")
-            if exp_.startswith('!'):
-                return not exp_[1:] in d.keys()
-            else:
-                return exp_ in d.keys()
-        idx = exp_.find("!=")
-        if idx > 0 and idx < e_idx:
-            k, v = http_utils.break_into(exp_, '!=')
-            if k not in d.keys():
-                return False
-            dvals = d[k]
-            if isinstance(dvals, str):
-                dvals = [dvals]
-            for dv in dvals:
-                if dv == v:
-                    return False
-            return True
-
-        idx = exp_.find("^=")
-        if idx > 0 and idx < e_idx:
-            k, v = http_utils.break_into(exp_, "^=")
-            if k not in d.keys():
-                return False
-            dvals = d[k]
-            if isinstance(dvals, str):
-                dvals = [dvals]
-            for dv in dvals:
-                _logger.debug(f"^= mapping:: {dv} ... {v}")
-                if dv.startswith(v):
-                    return True
-            return False
-
-        if e_idx > 0:
-            k, v = http_utils.break_into(exp_, '=')
-            if k not in d.keys():
-                return False
-            dvals = d[k]
-            if isinstance(dvals, str):
-                dvals = [dvals]
-            for dv in dvals:
-                if dv == v:
-                    return True
-            return False
-
-        _logger.error(
-            f"Controller {where} expression [{exp}] is not valied, returning False...")
-        return False
-
-    def __match_exps(self, d: Dict[str, Union[List[str], str]], exps: List[str], all: bool, where: str) -> bool:
-        if not exps:
-            return True
-
-        for exp in exps:
-            res = self.__match_one_exp(d, exp, where)
-            if all and not res:
-                return False
-            if not all and res:  # match one
-                return True
-        # return if all True else False
-        return all
-
-    def __is_req_match_ctl(self, req: RequestWrapper, ctrl: _ControllerFunction) -> bool:
-        _logger.debug(f"{ctrl.headers} - {ctrl.params}")
-        return self.__match_exps(req.headers, ctrl.headers, ctrl.match_all_headers_expressions, 'headers') \
-            and self.__match_exps(req.parameters, ctrl.params, ctrl.match_all_params_expressions, 'params')
+    def __reset(self) -> None:
+        """ Take the request line and the headers of the current request from the request handler. """
+        http_request_handler = self.__http_request_handler
+        self.method: str = http_request_handler.command
+        self.request_path: str = http_request_handler.request_path
+        self.query_string: str = http_request_handler.query_string
+        self.headers: HttpHeaders = http_request_handler.headers
+        self.__expect_continue: bool = getattr(http_request_handler, "expect_continue", False)
+        # A file body is written after the response is handled, so that the writing can wait for the client.
+        self.__pending_file: str = None
+        if self.routing_conf.request_timing:
+            self.__timestamps: List[Tuple[str, float]] = [("start", http_request_handler.request_start),
+                                                          ("parse", http_request_handler.parsed_time)]
+        else:
+            self.__timestamps = None
 
     def __get_ctrl(self, req: RequestWrapper) -> Tuple[_ControllerFunction, Dict, List]:
         mth = self.method.upper()
-        path = req._path
-        ctrls = self.routing_conf.get_url_controllers(path, mth)
-        for ctrl, pvs, regs in ctrls:
-            if self.__is_req_match_ctl(req, ctrl):
-                return ctrl, pvs, regs
-        return None, {}, []
+        return self.routing_conf.get_url_controller(req._path, mth, req.headers, _ParametersView(req))
 
     async def handle_request(self):
+        self.__reset()
         mth = self.method.upper()
 
-        req = await self.__prepare_request(mth)
+        req = self.__prepare_request(mth)
+        metrics = self.routing_conf.metrics
+        if metrics is not None:
+            metrics.requests_in_flight.inc()
+        try:
+            await self.__handle_request(req, mth)
+            await self.__write_pending_file()
+            if self.__timestamps is not None:
+                req._mark("write")
+                self.__call_timing_listeners(req)
+        finally:
+            if metrics is not None:
+                metrics.requests_in_flight.dec()
+            if req._multipart_files:
+                for mfile in req._multipart_files:
+                    mfile._remove_temp_file()
+            req.reader._release()
+        await self.__discard_unread_body(req)
+
+    async def __handle_request(self, req: RequestWrapper, mth: str):
+        if req._body_loader is not None and self.__is_form_body(req) \
+                and self.routing_conf.is_narrowed_by_params(req._path, mth):
+            # Parameters in the form body are needed to find the controller, only the global limit can be checked.
+            if self.__is_body_too_large(req, self.routing_conf.get_max_body_size()):
+                self.send_error(413, "Payload Too Large", "Request body is too large.")
+                return
+            try:
+                await req.load_body()
+            except HttpError as e:
+                self.send_error(e.code, e.message, e.explain)
+                return
 
         ctrl, req.path_values, req.reg_groups = self.__get_ctrl(req)
+        req._mark("route")
+        if ctrl is not None:
+            self.__http_request_handler.route = ctrl.url or ctrl.regexp
+
+        profiler = self.routing_conf.request_profiler
+        if profiler is not None and ctrl is not None:
+            req._profile = profiler.start(mth, req.path, ctrl.url or ctrl.regexp, req.headers)
+        try:
+            await self.__call_ctrl(req, ctrl)
+        finally:
+            if req._profile is not None:
+                profiler.finish(req._profile)
 
+    async def __call_ctrl(self, req: RequestWrapper, ctrl: _ControllerFunction):
         res = ResponseWrapper(self)
         if ctrl is None:
             res.send_error(404, "Controller Not Found",
                            "Cannot find a controller for your path")
+        elif self.__is_body_too_large(req, self.routing_conf.get_max_body_size(ctrl)):
+            res.send_error(413, "Payload Too Large", "Request body is too large.")
         else:
             filters = self.routing_conf.get_matched_filters(req.path)
             ctx = FilterContextImpl(
-                req, res, ctrl, self.routing_conf.model_binding_conf, filters)
+                req, res, ctrl, self.routing_conf.get_binding_plan(ctrl), filters, self.routing_conf.body_loading_filters)
             try:
                 ctx.do_chain()
                 if req._coroutine_objects:
-                    _logger.debug(f"wait all the objects in waiting list.")
+                    _logger.debug("wait all the objects in waiting list.")
                     while req._coroutine_objects:
                         await req._coroutine_objects.pop(0)
             except HttpError as e:
@@ -480,54 +540,118 @@ class HTTPControllerHandler:
                 _logger.exception("error occurs! returning 500")
                 res.send_error(500, None, str(e))
 
-    async def __prepare_request(self, method) -> RequestWrapper:
+    def __call_timing_listeners(self, req: RequestWrapper):
+        durations = _phase_durations(self.__timestamps)
+        for listener in self.routing_conf.timing_listeners:
+            try:
+                listener(req, durations)
+            except Exception:
+                _logger.exception(f"Error occurs when calling timing listener {listener}.")
+
+    def _write_body(self, data: bytes):
+        """ Write a part of the streamed response body. """
+        self.writer.write(data)
+        self.__http_request_handler.response_written += len(data)
+
+    def __is_body_too_large(self, req: RequestWrapper, max_body_size: int) -> bool:
+        content_length = req.reader._content_length
+        return max_body_size is not None and content_length is not None and content_length > max_body_size
+
+    def __send_continue(self):
+        self.__expect_continue = False
+        if not self.__http_request_handler.handle_expect_100():
+            raise HttpError(417, "Expectation Failed")
+
+    async def __write_pending_file(self):
+        file_path, self.__pending_file = self.__pending_file, None
+        if file_path is None:
+            return
+        try:
+            with open(file_path, "rb") as in_file:
+                data = in_file.read(_FILE_BUFFER_SIZE)
+                while data:
+                    self.writer.write(data)
+                    await self.drain_writer()
+                    data = in_file.read(_FILE_BUFFER_SIZE)
+        except OSError:
+            # The headers have been sent, the client can only learn about it by the closed connection.
+            _logger.exception(f"Cannot send file[{file_path}], close the connection.")
+            self.__http_request_handler.close_connection = True
+
+    async def __discard_unread_body(self, req: RequestWrapper):
+        """ Read and drop the body that nobody reads, so the next request in this connection can be read. """
+        reader: RequestBodyReaderWrapper = req.reader
+        if reader._content_length is None or reader._remain_length <= 0:
+            return
+        if self.__expect_continue:
+            # The client is told nothing about whether to send the body, so the connection cannot be reused.
+            _logger.debug("Request is responded without 100 Continue, close the connection.")
+            self.__http_request_handler.close_connection = True
+            return
+        if reader._remain_length > _MAX_DISCARDED_BODY_SIZE:
+            _logger.debug("Request body of %d bytes is not read, close the connection.", reader._remain_length)
+            self.__http_request_handler.close_connection = True
+            return
+        while reader._remain_length > 0:
+            data = await reader.read()
+            if not data:
+                break
+
+    def __is_form_body(self, req: RequestWrapper) -> bool:
+        content_type = req.headers.get("Content-Type", "").lower()
+        return content_type.startswith("application/x-www-form-urlencoded") \
+            or content_type.startswith("multipart/form-data")
+
+    def __prepare_request(self, method) -> RequestWrapper:
         path = self.request_path
         req = RequestWrapper()
         req.environment = self.environment or {}
         req.path = "/" + path
         req._path = path
         req._session_fac = self.routing_conf.session_factory
-        headers = {}
-        _headers_keys_in_lowers = {}
-        for k in self.headers.keys():
-            headers[k] = self.headers[k]
-            _headers_keys_in_lowers[k.lower()] = self.headers[k]
-        req.headers = headers
-        req._headers_keys_in_lowcase = _headers_keys_in_lowers
-
-        # cookies
-        if "cookie" in _headers_keys_in_lowers.keys():
-            req.cookies.load(_headers_keys_in_lowers["cookie"])
-
+        req._json_codec = self.routing_conf.json_codec
+        req.headers = self.headers
+        req.query_string = self.query_string
         req.method = method
-
-        req.parameters = self.query_parameters
-
-        if "content-length" in _headers_keys_in_lowers.keys():
-            content_length = int(_headers_keys_in_lowers["content-length"])
-
-            req.reader = RequestBodyReaderWrapper(self.reader, content_length)
-
-            content_type = _headers_keys_in_lowers["content-type"]
-            if content_type.lower().startswith("application/x-www-form-urlencoded"):
-                req._body = await req.reader.read(content_length)
-                data_params = http_utils.decode_query_string(
-                    req._body.decode(DEFAULT_ENCODING))
-            elif content_type.lower().startswith("multipart/form-data"):
-                req._body = await req.reader.read(content_length)
-                data_params = self.__decode_multipart(
-                    content_type, req._body.decode("ISO-8859-1"))
-            elif content_type.lower().startswith("application/json"):
-                req._body = await req.reader.read(content_length)
-                req.json = json.loads(req._body.decode(DEFAULT_ENCODING))
-                data_params = {}
-            else:
-                data_params = {}
-            req.parameters = self.__merge(data_params, req.parameters)
+        req._timestamps = self.__timestamps
+
+        if "Content-Length" in self.headers:
+            content_length = int(self.headers["Content-Length"])
+            req.reader = RequestBodyReaderWrapper(self.reader, content_length,
+                                                  body_budget=self.routing_conf.body_budget,
+                                                  spool_threshold=self.routing_conf.body_spool_threshold,
+                                                  on_first_read=self.__send_continue if self.__expect_continue else None)
+            req._body_loader = self.__load_body
         else:
             req.reader = RequestBodyReaderWrapper(self.reader)
         return req
 
+    async def __load_body(self, req: RequestWrapper):
+        content_type = req.headers.get("Content-Type", "")
+        if content_type.lower().startswith("application/x-www-form-urlencoded"):
+            req._body = await req.reader.read_all()
+            data_params = http_utils.decode_query_string(
+                req._body.decode(DEFAULT_ENCODING))
+        elif content_type.lower().startswith("multipart/form-data"):
+            parser = MultipartParser(req.reader, get_boundary(content_type),
+                                     spool_threshold=self.routing_conf.multipart_spool_threshold,
+                                     max_part_size=self.routing_conf.multipart_max_part_size,
+                                     max_total_size=self.routing_conf.multipart_max_total_size,
+                                     reserve=req.reader._reserve, unreserve=req.reader._unreserve)
+            data_params = await parser.parse()
+            req._multipart_files = [v for vals in data_params.values() for v in vals if isinstance(v, MultipartFile)]
+        elif content_type.lower().startswith("application/json"):
+            req._body = await req.reader.read_all()
+            codec = self.routing_conf.json_codec
+            try:
+                req.json = codec.loads(req._body)
+            except codec.decode_error:
+                raise HttpError(400, "Bad Request", "The body of this request is not a valid JSON.")
+            data_params = {}
+        else:
+            data_params = {}
+        req.parameters = self.__merge(data_params, req.parameters)
+
     def __merge(self, dic0: Dict[str, List[str]], dic1: Dict[str, List[str]]):
         """Merge tow dictionaries of which the structure is {k:[v1, v2]}"""
         dic = dic0
@@ -539,102 +663,32 @@ class HTTPControllerHandler:
                     dic[k].append(i)
         return dic
 
-    def __decode_multipart(self, content_type, data):
-        boundary = "--" + content_type.split("; ")[1].split("=")[1]
-        fields = data.split(boundary)
-        # ignore the first empty row and the last end symbol
-        fields = fields[1: len(fields) - 1]
-        params = {}
-        for field in fields:
-            # trim the first and the last empty row
-            f = field[field.index("\r\n") + 2: field.rindex("\r\n")]
-            key, val = self.__decode_multipart_field(f)
-            http_utils.put_to(params, key, val)
-        return params
-
-    def __decode_multipart_field(self, field):
-        # first line: Content-Disposition
-        line, rest = self.__read_line(field)
-
-        kvs = self.__decode_content_disposition(line)
-        kname = kvs["name"].encode(
-            "ISO-8859-1", errors="replace").decode(DEFAULT_ENCODING, errors="replace")
-        if len(kvs) == 1:
-            # this is a string field, the second line is an empty line, the rest is the value
-            val = self.__read_line(rest)[1].encode(
-                "ISO-8859-1", errors="replace").decode(DEFAULT_ENCODING, errors="replace")
-        elif "filename" in kvs or "filename*" in kvs:
-            if "filename*" in kvs:
-                name_value = kvs["filename*"]
-                idx = name_value.find("'")
-                if idx <= 0:
-                    encoding = DEFAULT_ENCODING
-                else:
-                    encoding = name_value[0:idx]
-                name_value = name_value[idx + 1:]
-                idx = name_value.find("'")
-                filename = unquote(name_value[idx + 1:], encoding)
-            else:
-                filename = kvs["filename"].encode(
-                    "ISO-8859-1", errors="replace").decode(DEFAULT_ENCODING, errors="replace")
-
-            # the second line is Content-Type line
-            ct_line, rest = self.__read_line(rest)
-            content_type = ct_line.split(":")[1].strip()
-            # the third line is an empty line, the rest is the value
-            content = self.__read_line(rest)[1].encode(
-                "ISO-8859-1", errors="replace")
-
-            val = MultipartFile(kname, filename=filename,
-                                content_type=content_type, content=content)
-        else:
-            val = "UNKNOWN"
-
-        return kname, val
-
-    def __decode_content_disposition(self, line) -> Dict[str, str]:
-        cont_dis = {}
-        es = line.split(";")[1:]
-        for e in es:
-            k, v = http_utils.break_into(e.strip(), "=")
-            if v.startswith('"') and v.endswith('"'):
-                cont_dis[k] = v[1: -1]  # ignore the '"' symbol
-            else:
-                cont_dis[k] = v
-        return cont_dis
-
-    def __read_line(self, txt):
-        return http_utils.break_into(txt, "\r\n")
-
     def _send_response(self, response):
         try:
             headers = response["headers"]
             cks = response["cookies"]
             raw_body = response["body"]
             status_code = response["status_code"]
-            content_type, body = http_utils.decode_response_body(raw_body)
+            content_type, body = http_utils.decode_response_body(
+                raw_body, self.routing_conf.json_codec)
 
             self._send_res(status_code, headers, content_type, cks, body)
 
         except HttpError as e:
             self.send_error(e.code, e.message, e.explain)
 
-    def __send_res_headers(self, status_code: int, headers: Dict[str, str] = {}, content_type: str = "", cks: Cookies = Cookies()):
-        if "Content-Type" not in headers.keys() and "content-type" not in headers.keys():
+    def __send_res_headers(self, status_code: int, headers: HttpHeaders = None, content_type: str = "", cks: Cookies = Cookies()):
+        if "Content-Type" not in headers:
             headers["Content-Type"] = content_type
-        elif "content-type" in headers.keys():
-            headers["Content-Type"] = headers["content-type"]
-            del headers["content-type"]
 
         self.send_response(status_code)
-        self.send_header("Last-Modified", str(http_utils.date_time_string()))
-        for k, v in headers.items():
+        for k, v in headers.multi_items():
             if isinstance(v, str):
                 self.send_header(k, v)
-            elif isinstance(v, list):
-                for iov in v:
-                    if isinstance(iov, str):
-                        self.send_header(k, iov)
+        if self.__timestamps is not None and self.routing_conf.server_timing:
+            # Only the phases before sending the response can be told.
+            self.send_header("Server-Timing", ", ".join([f"{phase};dur={duration * 1000:.3f}"
+                                                         for phase, duration in _phase_durations(self.__timestamps).items()]))
 
         for k in cks:
             ck = cks[k]
@@ -647,8 +701,8 @@ class HTTPControllerHandler:
         self.__send_res_headers(*args, **kwargs)
         self.end_headers()
 
-    def _should_send_gzip(self, headers: Dict[str, str]) -> bool:
-        if "Accept-Encoding" not in self.headers.keys():
+    def _should_send_gzip(self, headers: HttpHeaders) -> bool:
+        if "Accept-Encoding" not in self.headers:
             return False
         accept_encoding = self.headers["Accept-Encoding"].split(",")
         acgzip = False
@@ -662,8 +716,10 @@ class HTTPControllerHandler:
                 return True
         return False
 
-    def _send_res(self, status_code: int, headers: Dict[str, str] = {}, content_type: str = "", cks: Cookies = Cookies(), body: Union[str, bytes, bytearray, StaticFile] = None):
+    def _send_res(self, status_code: int, headers: HttpHeaders = None, content_type: str = "", cks: Cookies = Cookies(), body: Union[str, bytes, bytearray, StaticFile] = None):
         self.__send_res_headers(status_code, headers, content_type, cks)
+        if isinstance(body, StaticFile) and "Last-Modified" not in headers:
+            self.send_header("Last-Modified", http_utils.date_time_string(os.path.getmtime(body.file_path)))
         if self._should_send_gzip(headers):
             self._send_gzip_data(body)
         else:
@@ -712,9 +768,4 @@ class HTTPControllerHandler:
             file_size = os.path.getsize(body.file_path)
             self.send_header("Content-Length", file_size)
             self.end_headers()
-            buffer_size = 1024 * 1024  # 1M
-            with open(body.file_path, "rb") as in_file:
-                data = in_file.read(buffer_size)
-                while data:
-                    self.writer.write(data)
-                    data = in_file.read(buffer_size)
+            self.__pending_file = body.file_path
@@ -25,21 +25,23 @@ SOFTWARE.
 import html
 import re
 import http.client
-import email.parser
-import email.message
 import socketserver
 import asyncio
 import socket
+import ssl
+import os
+import time
+import threading
 
 
-from typing import Any, Dict
+from typing import Any, Dict, List, Tuple
 from http import HTTPStatus
 from urllib.parse import unquote
 from asyncio.streams import StreamReader, StreamWriter
 from http import HTTPStatus
 
 from .. import name, version
-from ..models import RequestBodyReader
+from ..models import HttpHeaders, RequestBodyReader
 from ..utils import http_utils
 from ..utils.logger import get_logger
 from ..http_servers.routing_server import RoutingServer
@@ -50,8 +52,37 @@ from .websocket_controller_handler import WebsocketControllerHandler
 _LINE_MAX_BYTES = 65536
 _MAXHEADERS = 100
 
+# Writes are buffered in threading mode until this size, or until the response is done.
+_WRITE_BUFFER_SIZE = 64 * 1024
+_MAX_WRITEV_CHUNKS = 64
+
 _logger = get_logger("naja_atra.request_handlers.http_request_handler")
 
+# Encoded status lines of each protocol version, shared by all the connections.
+_STATUS_LINES: Dict[str, Dict[int, bytes]] = {}
+
+# The `Date` header only changes once a second: (second, encoded header)
+_date_header_cache: Tuple[int, bytes] = (0, b"")
+
+
+def _status_lines(protocol_version: str) -> Dict[int, bytes]:
+    lines = _STATUS_LINES.get(protocol_version)
+    if lines is None:
+        lines = {status.value: f"{protocol_version} {status.value} {status.phrase}\r\n".encode('latin-1', errors='strict')
+                 for status in HTTPStatus.__members__.values()}
+        _STATUS_LINES[protocol_version] = lines
+    return lines
+
+
+def _date_header() -> bytes:
+    global _date_header_cache
+    now = int(time.time())
+    second, header = _date_header_cache
+    if second != now:
+        header = f"Date: {http_utils.date_time_string(now)}\r\n".encode('latin-1', errors='strict')
+        _date_header_cache = (now, header)
+    return header
+
 
 class RequestWriter:
 
@@ -72,9 +103,6 @@ class HttpRequestHandler:
     # Set this to HTTP/1.1 to enable automatic keepalive
     protocol_version = "HTTP/1.1"
 
-    # MessageClass used to parse headers
-    _message_class = http.client.HTTPMessage
-
     # hack to maintain backwards compatibility
     responses = {
         v: (v.phrase, v.description)
@@ -94,22 +122,42 @@ class HttpRequestHandler:
         self.path = ''
         self.request_path = ''
         self.query_string = ''
-        self.query_parameters = {}
-        self.headers = {}
+        self.__query_parameters: Dict[str, List[str]] = None
+        self.headers: HttpHeaders = HttpHeaders()
 
         self.close_connection = True
+        self.expect_continue = False
+        self._headers_buffer: bytearray = bytearray()
+        self.__server_header: bytes = f"Server: {self.server_version}\r\n".encode('latin-1', errors='strict')
+        self.__status_lines: Dict[int, bytes] = _status_lines(self.protocol_version)
         self._keep_alive = self.routing_conf.keep_alive
         self._connection_idle_time = routing_conf.connection_idle_time
         self._keep_alive_max_req = routing_conf.keep_alive_max_request
         self.req_count = 0
+        # What is needed by the access log, set for each request.
+        self.request_start: float = 0
+        self.parsed_time: float = 0
+        self.response_code: int = 0
+        self.response_length: int = None
+        self.response_written: int = 0
+        self.route: str = ""
+        self.__client_address: str = None
+        self.__worker: str = None
+        # Created for the first request and reused by the keep-alive requests of this connection.
+        self.__http_handler: HTTPControllerHandler = None
 
     async def parse_request(self):
         self.req_count += 1
+        self.response_code = 0
+        self.response_length = None
+        self.response_written = 0
+        self.route = ""
         try:
             if hasattr(self.reader, "connection"):
                 # For blocking io. asyncio.wait_for will not raise TimeoutError if the io is blocked.
                 self.reader.connection.settimeout(self._connection_idle_time)
             raw_requestline = await asyncio.wait_for(self.reader.readline(), self._connection_idle_time)
+            self.request_start = time.perf_counter()
             if hasattr(self.reader, "connection") and hasattr(self.reader, "timeout"):
                 # For blocking io. Set the Original timeout to the connection.
                 self.reader.connection.settimeout(self.reader.timeout)
@@ -163,7 +211,7 @@ class HttpRequestHandler:
                     f"Invalid HTTP version {base_version_number}")
                 return False
             self.request_version = version
-            _logger.info(f"request version: {self.request_version}")
+            _logger.debug("request version: %s", self.request_version)
         if not 2 <= len(words) <= 3:
             self.send_error(
                 HTTPStatus.BAD_REQUEST,
@@ -183,8 +231,7 @@ class HttpRequestHandler:
 
         self.query_string = self.__get_query_string(self.path)
 
-        self.query_parameters = http_utils.decode_query_string(
-            self.query_string)
+        self.__query_parameters = None
 
         # Examine the headers and look for a Connection directive.
         try:
@@ -208,52 +255,72 @@ class HttpRequestHandler:
         self.close_connection = not self._keep_alive or conntype.lower(
         ) != 'keep-alive' or self.protocol_version != "HTTP/1.1"
 
-        # Examine the headers and look for an Expect directive
+        # Examine the headers and look for an Expect directive, the `100 Continue` response
+        # is not sent until the body is read, so that the request can be rejected without it.
         expect = self.headers.get('Expect', "")
-        if (expect.lower() == "100-continue" and
-                self.protocol_version >= "HTTP/1.1" and
-                self.request_version >= "HTTP/1.1"):
-            if not self.handle_expect_100():
-                return False
+        self.expect_continue = (expect.lower() == "100-continue" and
+                                self.protocol_version >= "HTTP/1.1" and
+                                self.request_version >= "HTTP/1.1")
+        self.parsed_time = time.perf_counter()
         return True
 
-    async def parse_headers(self):
-        """Parses only RFC2822 headers from a file pointer.
+    @property
+    def query_parameters(self) -> Dict[str, List[str]]:
+        if self.__query_parameters is None:
+            self.__query_parameters = http_utils.decode_query_string(self.query_string)
+        return self.__query_parameters
 
-        email Parser wants to see strings rather than bytes.
-        But a TextIOWrapper around self.rfile would buffer too many bytes
-        from the stream, bytes which we later need to read as bytes.
-        So we read the correct bytes here, as bytes, for email Parser
-        to parse.
+    async def parse_headers(self) -> HttpHeaders:
+        """Parses the header lines into a case-insensitive `HttpHeaders`.
+
+        The lines are read as bytes, so that the body bytes that follow
+        them are left in the stream. Obsolete line folding is joined to
+        the value of the previous header, and the lines without a colon
+        are ignored.
 
         """
-        headers = []
+        headers = HttpHeaders()
+        name, value = None, None
+        line_count = 0
         while True:
             line = await self.reader.readline()
             if len(line) > _LINE_MAX_BYTES:
                 raise http.client.LineTooLong("header line")
-            headers.append(line)
-            if len(headers) > _MAXHEADERS:
+            line_count += 1
+            if line_count > _MAXHEADERS:
                 raise http.client.HTTPException(
                     f"got more than {_MAXHEADERS} headers")
             if line in (b'\r\n', b'\n', b''):
                 break
-        hstring = b''.join(headers).decode('iso-8859-1')
-
-        return email.parser.Parser(_class=self._message_class).parsestr(hstring)
+            text = line.decode('iso-8859-1')
+            if text[0] in " \t":
+                if name is not None:
+                    value = f"{value} {text.strip()}"
+                continue
+            if name is not None:
+                headers.add(name, value)
+            name, sep, value = text.partition(":")
+            if sep:
+                name, value = name.rstrip(), value.strip()
+            else:
+                name, value = None, None
+        if name is not None:
+            headers.add(name, value)
+        return headers
 
     def handle_expect_100(self):
         """Decide what to do with an "Expect: 100-continue" header.
 
         If the client is expecting a 100 Continue response, we must
         respond with either a 100 Continue or a final response before
-        waiting for the request body. The default is to always respond
-        with a 100 Continue. You can behave differently (for example,
-        reject unauthorized requests) by overriding this method.
+        waiting for the request body. This method is called when the
+        request body is read for the first time, after the controller
+        is found and the filters have run, so a request that is rejected
+        by them (404, 413, 401...) never receives a 100 Continue.
 
         This method should either return True (possibly after sending
-        a 100 Continue response) or send an error response and return
-        False.
+        a 100 Continue response) or return False, the request is then
+        rejected with a 417 response.
 
         """
         self.send_response_only(HTTPStatus.CONTINUE)
@@ -284,8 +351,8 @@ class HttpRequestHandler:
         if explain is None:
             explain = longmsg
         self.log_error(f"code {code}, message {message}")
+        self.close_connection = True
         self.send_response(code, message)
-        self.send_header('Connection', 'close')
 
         # Message body is omitted for cases described in:
         #  - RFC7230: 3.3. 1xx, 204(No Content), 304(Not Modified)
@@ -302,12 +369,13 @@ class HttpRequestHandler:
                 content: str = html.escape(
                     message, quote=False) + ":" + html.escape(explain, quote=False)
             content_type, body = http_utils.decode_response_body_to_bytes(
-                content)
+                content, self.routing_conf.json_codec)
 
             self.send_header("Content-Type", content_type)
             self.send_header('Content-Length', str(len(body)))
         if headers:
-            for h_name, h_val in headers.items():
+            items = headers.multi_items() if isinstance(headers, HttpHeaders) else headers.items()
+            for h_name, h_val in items:
                 self.send_header(h_name, h_val)
         self.end_headers()
 
@@ -322,14 +390,20 @@ class HttpRequestHandler:
         version and the current date.
 
         """
+        self.response_code = code
         self.log_request(code)
         self.send_response_only(code, message)
-        self.send_header('Server', self.server_version)
-        self.send_header('Date', http_utils.date_time_string())
+        if self.request_version != 'HTTP/0.9':
+            self._headers_buffer += self.__server_header
+            self._headers_buffer += _date_header()
+            if self.close_connection:
+                self._headers_buffer += b"Connection: close\r\n"
 
     def send_header(self, keyword: str, value: str):
         """Send a MIME header to the headers buffer."""
-        if keyword.lower() == 'connection':
+        if len(keyword) == 14 and keyword.lower() == 'content-length':
+            self.response_length = int(value)
+        elif len(keyword) == 10 and keyword.lower() == 'connection':
             if value.lower() == 'close':
                 self.close_connection = True
             elif value.lower() == 'keep-alive':
@@ -341,53 +415,101 @@ class HttpRequestHandler:
                     return
 
         if self.request_version != 'HTTP/0.9':
-            if not hasattr(self, '_headers_buffer'):
-                self._headers_buffer = []
-            self._headers_buffer.append(
-                f"{keyword}: {value}\r\n".encode('latin-1', errors='strict'))
+            self._headers_buffer += f"{keyword}: {value}\r\n".encode('latin-1', errors='strict')
 
     def end_headers(self):
         """Send the blank line ending the MIME headers."""
         if self.request_version != 'HTTP/0.9':
-            self._headers_buffer.append(b"\r\n")
+            self._headers_buffer += b"\r\n"
             self.flush_headers()
 
     def flush_headers(self):
-        if hasattr(self, '_headers_buffer'):
-            self.writer.write(b"".join(self._headers_buffer))
-            self._headers_buffer = []
+        if self._headers_buffer:
+            # The writer may keep the buffer, so a new one is used instead of clearing it.
+            self.writer.write(self._headers_buffer)
+            self._headers_buffer = bytearray()
+
+    async def drain_writer(self):
+        """Wait until the writer's buffer gets below its low watermark, only the writer of coroutine mode has one."""
+        drain = getattr(self.writer, "drain", None)
+        if drain is not None:
+            await drain()
+
+    @property
+    def write_buffer_size(self) -> int:
+        """Bytes that have been written but not sent yet."""
+        transport = getattr(self.writer, "transport", None)
+        return transport.get_write_buffer_size() if transport is not None else 0
+
+    def flush_writer(self):
+        """Send what has been buffered by the writer, only the writer of threading mode buffers."""
+        flush = getattr(self.writer, "flush", None)
+        if flush is not None:
+            flush()
 
     def send_response_only(self, code, message: str = None):
         """Send the response header only."""
         if self.request_version != 'HTTP/0.9':
             if message is None:
-                if code in self.responses:
-                    message = self.responses[code][0]
-                else:
-                    message = ''
-            if not hasattr(self, '_headers_buffer'):
-                self._headers_buffer = []
-            self._headers_buffer \
-                .append(f"{self.protocol_version} {code} {message}\r\n".encode('latin-1', errors='strict'))
+                status_line = self.__status_lines.get(code)
+                if status_line is None:
+                    message = self.responses[code][0] if code in self.responses else ''
+                    status_line = f"{self.protocol_version} {code} {message}\r\n".encode('latin-1', errors='strict')
+                    self.__status_lines[code] = status_line
+            else:
+                status_line = f"{self.protocol_version} {code} {message}\r\n".encode('latin-1', errors='strict')
+            self._headers_buffer += status_line
 
     def log_request(self, code='-', size='-'):
+        if self.routing_conf.access_log is not None:
+            # The access log writes the line after the response is sent.
+            return
         if isinstance(code, HTTPStatus):
             code = code.value
         self.log_message('"%s" %s %s',
                          self.requestline, str(code), str(size))
 
+    @property
+    def client_address(self) -> str:
+        if self.__client_address is None:
+            addr = getattr(self.reader, "client_address", None) or self.writer.get_extra_info("peername")
+            self.__client_address = addr[0] if addr else "-"
+        return self.__client_address
+
+    @property
+    def worker(self) -> str:
+        if self.__worker is None:
+            self.__worker = f"{os.getpid()}/{threading.current_thread().name}"
+        return self.__worker
+
+    def log_access(self, latency: float):
+        """Write the line of the current request to the access log."""
+        headers = self.headers
+        self.routing_conf.access_log.log(
+            remote_addr=self.client_address,
+            request_line=self.requestline,
+            method=self.command or "",
+            path=self.path,
+            status=int(self.response_code),
+            bytes_sent=self.response_length if self.response_length is not None else self.response_written,
+            referer=headers.get("Referer", ""),
+            user_agent=headers.get("User-Agent", ""),
+            latency=latency,
+            route=self.route,
+            worker=self.worker)
+
     def log_error(self, format, *args):
         self.log_message(format, *args)
 
     def log_message(self, format, *args):
-        _logger.info(f"{format % args}")
+        _logger.info(format, *args)
 
     def set_prefer_keep_alive_params(self):
         pass
 
     def set_alive_params(self):
-        if "Keep-Alive" in self.headers:
-            ka_header = self.headers["Keep-Alive"]
+        ka_header = self.headers.get("Keep-Alive")
+        if ka_header:
             timeout_match = re.match(r"^.*timeout=(\d+).*$", ka_header)
             if timeout_match:
                 self._connection_idle_time = int(timeout_match.group(1))
@@ -398,10 +520,11 @@ class HttpRequestHandler:
     async def handle_request(self):
         parse_request_success = await self.parse_request()
         if not parse_request_success:
+            self.__log_rejected_request()
             return
         self.set_alive_params()
 
-        if self.request_version == "HTTP/1.1" and self.command == "GET" and "Upgrade" in self.headers and self.headers["Upgrade"] == "websocket":
+        if self.request_version == "HTTP/1.1" and self.command == "GET" and self.headers.get("Upgrade", "").lower() == "websocket":
             _logger.debug("This is a websocket connection. ")
             ws_handler = WebsocketControllerHandler(self)
             await ws_handler.handle_request()
@@ -414,46 +537,125 @@ class HttpRequestHandler:
             parse_request_success = await self.parse_request()
             if not parse_request_success:
                 _logger.debug("parse request fails, return. ")
+                self.__log_rejected_request()
                 return
             if self.req_count >= self._keep_alive_max_req:
-                self.send_response("Connection", "close")
+                # The last request of this connection.
+                self.close_connection = True
             await self.handle_http_request()
             _logger.debug("Handle a keep-alive request successfully!")
 
+    def __log_rejected_request(self):
+        if self.response_code:
+            # An error is responded as the request line or the headers cannot be parsed.
+            self.flush_writer()
+            self.__request_done()
+
+    def __request_done(self):
+        """Write the access log and record the metrics of the request that is just responded."""
+        access_log = self.routing_conf.access_log
+        metrics = self.routing_conf.metrics
+        if access_log is None and metrics is None:
+            return
+        latency = time.perf_counter() - self.request_start
+        if access_log is not None:
+            self.log_access(latency)
+        if metrics is not None:
+            content_length = self.headers.get("Content-Length")
+            metrics.observe_request(
+                self.route, self.command or "", int(self.response_code), latency,
+                received_bytes=int(content_length) if content_length and content_length.isdigit() else 0,
+                sent_bytes=self.response_length if self.response_length is not None else self.response_written,
+                keep_alive=self.req_count > 1)
+
     async def handle_http_request(self):
         try:
-            http_handler = HTTPControllerHandler(self)
-            await http_handler.handle_request()
-            if self.writer.can_write_eof():
+            if self.__http_handler is None:
+                self.__http_handler = HTTPControllerHandler(self)
+            await self.__http_handler.handle_request()
+            if self.close_connection and self.writer.can_write_eof():
+                # Do not shut down the writing side of a keep-alive connection.
                 self.writer.write_eof()
+            else:
+                self.flush_writer()
         except socket.timeout as e:
             # a read or a write timed out.  Discard this connection
             self.log_error("Request timed out: %r", e)
             self.close_connection = True
             return
+        finally:
+            # Also logged when the peer has gone away before the response is all sent.
+            if self.response_code:
+                self.__request_done()
 
 
 class SocketServerStreamRequestHandlerWraper(socketserver.StreamRequestHandler, RequestBodyReader):
 
     server_version = HttpRequestHandler.server_version
 
+    # Responses are written in one go, do not wait for the ACK of the previous segment.
+    disable_nagle_algorithm = True
+
+    def setup(self) -> None:
+        super().setup()
+        # Writes are kept here and sent together, so that the headers and a small body are sent in one syscall.
+        self.__out_chunks: List[bytes] = []
+        self.__out_size: int = 0
+        # SSL sockets do not support `sendmsg`.
+        self.__writev: bool = hasattr(self.connection, "sendmsg") and not isinstance(self.connection, ssl.SSLSocket)
+
     # Wrapper method for readline
     async def readline(self):
+        # The peer may wait for what has been written before it sends more, e.g. a `100 Continue`.
+        self.flush()
         return self.rfile.readline(_LINE_MAX_BYTES)
 
     async def read(self, n: int = -1):
+        self.flush()
         return self.rfile.read(n)
 
+    async def read1(self, n: int = -1):
+        """ Return what is received, at most `n` bytes, without waiting for all of them. """
+        self.flush()
+        return self.rfile.read1(n)
+
     def write(self, data: bytes):
-        self.wfile.write(data)
+        if not data:
+            return
+        self.__out_chunks.append(data)
+        self.__out_size += len(data)
+        if self.__out_size >= _WRITE_BUFFER_SIZE:
+            self.flush()
+
+    def flush(self):
+        if not self.__out_chunks:
+            return
+        chunks, self.__out_chunks, self.__out_size = self.__out_chunks, [], 0
+        if len(chunks) == 1:
+            self.connection.sendall(chunks[0])
+        elif self.__writev and len(chunks) <= _MAX_WRITEV_CHUNKS:
+            self.__sendmsg_all(chunks)
+        else:
+            self.connection.sendall(b"".join(chunks))
+
+    def __sendmsg_all(self, chunks: List[bytes]):
+        views = [memoryview(c) for c in chunks]
+        while views:
+            sent = self.connection.sendmsg(views)
+            while views and sent >= len(views[0]):
+                sent -= len(views[0])
+                views.pop(0)
+            if views and sent:
+                views[0] = views[0][sent:]
 
     def can_write_eof(self) -> bool:
         return True
 
     def write_eof(self):
-        self.wfile.flush()
+        self.flush()
 
     def close(self):
+        self.flush()
         self.wfile.close()
 
     def handle(self) -> None:
@@ -463,4 +665,9 @@ class SocketServerStreamRequestHandlerWraper(socketserver.StreamRequestHandler,
 
     def finish(self) -> None:
         _logger.debug("Finish a socket connection.")
+        try:
+            self.flush()
+        except OSError:
+            # The peer has gone away, nothing can be sent.
+            pass
         return super().finish()
@@ -22,13 +22,16 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 """
 
-import json
-from typing import Any, Dict, List, Type
+import asyncio
+from typing import Any, Callable, Dict, List, Tuple, Type
 from http.cookies import BaseCookie, SimpleCookie
 from ..models import ModelDict, Environment, RegGroup, RegGroups, HttpError, RequestBodyReader, \
     Headers, Response, Cookies, Cookie, JSONBody, BytesBody, Header, Parameters, PathValue, Parameter, \
-    MultipartFile, Request, HttpSession
+    MultipartFile, Request, HttpSession, SpooledBody
+from ..utils.http_utils import get_function_args, get_function_kwargs
+from ..utils.json_codec import get_json_codec
 from ..utils.logger import get_logger
+from ..utils.type_converter import ConversionError, get_converter, is_structured_type
 
 _logger = get_logger("naja_atra.models.model_bindings")
 
@@ -54,77 +57,120 @@ class ModelBinding:
         pass
 
 
-class RequestModelBinding(ModelBinding):
+class _SyncModelBinding(ModelBinding):
+    """
+    " Bindings that never suspend. If `bind` is not overridden, the binding plan calls `_bind` directly
+    " without creating an instance or a coroutine for each argument.
+    """
 
-    async def bind(self) -> Request:
-        return self.request
+    async def bind(self) -> Any:
+        return self._bind(self.request, self.response, self.arg_name, self.arg_type, self.default_value)
+
+    # Whether the request body should be read and parsed before binding.
+    _requires_body: bool = True
+
+    @staticmethod
+    def _bind(request: Request, response: Response, arg: str, arg_type, val=None) -> Any:
+        pass
+
+    @classmethod
+    def _prepare(cls, arg_type) -> Callable:
+        """ Called once when the binding plan is compiled, returns the function that binds the argument. """
+        return cls._bind
+
+
+class RequestModelBinding(_SyncModelBinding):
 
+    @staticmethod
+    def _bind(request, response, arg, arg_type, val=None) -> Request:
+        return request
 
-class SessionModelBinding(ModelBinding):
 
-    async def bind(self) -> HttpSession:
-        return self.request.get_session(True)
+class SessionModelBinding(_SyncModelBinding):
 
+    _requires_body = False
 
-class ResponseModelBinding(ModelBinding):
+    @staticmethod
+    def _bind(request, response, arg, arg_type, val=None) -> HttpSession:
+        return request.get_session(True)
 
-    async def bind(self) -> Response:
-        return self.response
 
+class ResponseModelBinding(_SyncModelBinding):
 
-class HeadersModelBinding(ModelBinding):
+    _requires_body = False
 
-    async def bind(self) -> Headers:
-        return Headers(self.request.headers)
+    @staticmethod
+    def _bind(request, response, arg, arg_type, val=None) -> Response:
+        return response
 
 
-class RegGroupsModelBinding(ModelBinding):
+class HeadersModelBinding(_SyncModelBinding):
 
-    async def bind(self) -> RegGroups:
-        return RegGroups(self.request.reg_groups)
+    _requires_body = False
 
+    @staticmethod
+    def _bind(request, response, arg, arg_type, val=None) -> Headers:
+        return Headers(request.headers)
 
-class EnvironmentModelBinding(ModelBinding):
 
-    async def bind(self) -> Environment:
-        return Environment(self.request.environment)
+class RegGroupsModelBinding(_SyncModelBinding):
 
+    _requires_body = False
 
-class HeaderModelBinding(ModelBinding):
+    @staticmethod
+    def _bind(request, response, arg, arg_type, val=None) -> RegGroups:
+        return RegGroups(request.reg_groups)
 
-    async def bind(self) -> Header:
-        return self.__build_header(self.arg_name, **self._kws)
 
-    def __build_header(self, key, val=Header()):
+class EnvironmentModelBinding(_SyncModelBinding):
+
+    _requires_body = False
+
+    @staticmethod
+    def _bind(request, response, arg, arg_type, val=None) -> Environment:
+        return Environment(request.environment)
+
+
+class HeaderModelBinding(_SyncModelBinding):
+
+    _requires_body = False
+
+    @staticmethod
+    def _bind(request, response, key, arg_type, val=None) -> Header:
+        if val is None:
+            val = Header()
         name = val.name if val.name is not None and val.name != "" else key
-        if val._required and name not in self.request.headers:
+        if val._required and name not in request.headers:
             raise HttpError(400, "Missing Header",
                             f"Header[{name}] is required.")
-        if name in self.request.headers:
-            v = self.request.headers[name]
+        if name in request.headers:
+            v = request.headers[name]
             return Header(name=name, default=v, required=val._required)
         else:
             return val
 
 
-class CookiesModelBinding(ModelBinding):
+class CookiesModelBinding(_SyncModelBinding):
+
+    _requires_body = False
 
-    async def bind(self) -> Cookies:
-        return self.request.cookies
+    @staticmethod
+    def _bind(request, response, arg, arg_type, val=None) -> Cookies:
+        return request.cookies
 
 
-class CookieModelBinding(ModelBinding):
+class CookieModelBinding(_SyncModelBinding):
 
-    async def bind(self) -> Cookie:
-        return self.__build_cookie(self.arg_name, **self._kws)
+    _requires_body = False
 
-    def __build_cookie(self, key, val=None):
+    @staticmethod
+    def _bind(request, response, key, arg_type, val=None) -> Cookie:
         name = val.name if val.name is not None and val.name != "" else key
-        if val._required and name not in self.request.cookies:
+        if val._required and name not in request.cookies:
             raise HttpError(400, "Missing Cookie",
                             f"Cookie[{name}] is required.")
-        if name in self.request.cookies:
-            morsel = self.request.cookies[name]
+        if name in request.cookies:
+            morsel = request.cookies[name]
             cookie = Cookie()
             cookie.set(morsel.key, morsel.value, morsel.coded_value)
             cookie.update(morsel)
@@ -133,18 +179,18 @@ class CookieModelBinding(ModelBinding):
             return val
 
 
-class MultipartFileModelBinding(ModelBinding):
+class MultipartFileModelBinding(_SyncModelBinding):
 
-    async def bind(self) -> MultipartFile:
-        return self.__build_multipart(self.arg_name, **self._kws)
-
-    def __build_multipart(self, key, val=MultipartFile()):
+    @staticmethod
+    def _bind(request, response, key, arg_type, val=None) -> MultipartFile:
+        if val is None:
+            val = MultipartFile()
         name = val.name if val.name is not None and val.name != "" else key
-        if val._required and name not in self.request.parameter.keys():
+        if val._required and name not in request.parameter.keys():
             raise HttpError(400, "Missing Parameter",
                             f"Parameter[{name}] is required.")
-        if name in self.request.parameter.keys():
-            v = self.request.parameter[name]
+        if name in request.parameter.keys():
+            v = request.parameter[name]
             if isinstance(v, MultipartFile):
                 return v
             else:
@@ -154,137 +200,155 @@ class MultipartFileModelBinding(ModelBinding):
             return val
 
 
-class ParameterModelBinding(ModelBinding):
-
-    async def bind(self) -> Parameter:
-        return self.__build_param(self.arg_name, **self._kws)
+class ParameterModelBinding(_SyncModelBinding):
 
-    def __build_param(self, key, val=Parameter()):
+    @staticmethod
+    def _bind(request, response, key, arg_type, val=None) -> Parameter:
+        if val is None:
+            val = Parameter()
         name = val.name if val.name is not None and val.name != "" else key
-        if val._required and name not in self.request.parameter:
+        if val._required and name not in request.parameter:
             raise HttpError(400, "Missing Parameter",
                             f"Parameter[{name}] is required.")
-        if name in self.request.parameter:
-            v = self.request.parameter[name]
+        if name in request.parameter:
+            v = request.parameter[name]
             return Parameter(name=name, default=v, required=val._required)
         else:
             return val
 
 
-class PathValueModelBinding(ModelBinding):
+class PathValueModelBinding(_SyncModelBinding):
 
-    async def bind(self) -> PathValue:
-        return self.__build_path_value(self.arg_name, **self._kws)
+    _requires_body = False
 
-    def __build_path_value(self, key, val=PathValue()):
+    @staticmethod
+    def _bind(request, response, key, arg_type, val=None) -> PathValue:
+        if val is None:
+            val = PathValue()
         # wildcard value
-        if len(self.request.path_values) == 1 and "__path_wildcard" in self.request.path_values:
+        if len(request.path_values) == 1 and "__path_wildcard" in request.path_values:
             if val.name:
                 _logger.warning(
                     f"Wildcard value, `name` of the PathValue:: [{val.name}] will be ignored. ")
-            return self.request.path_values["__path_wildcard"]
+            return request.path_values["__path_wildcard"]
 
         # brace values
         name = val.name if val.name is not None and val.name != "" else key
-        if name in self.request.path_values:
-            return PathValue(name=name, _value=self.request.path_values[name])
+        if name in request.path_values:
+            return PathValue(name=name, _value=request.path_values[name])
         else:
             raise HttpError(
                 500, None, f"path name[{name}] not in your url mapping!")
 
 
-class ParametersModelBinding(ModelBinding):
+class ParametersModelBinding(_SyncModelBinding):
 
-    async def bind(self) -> Parameters:
-        return self.__build_params(self.arg_name, **self._kws)
-
-    def __build_params(self, key, val=Parameters()):
+    @staticmethod
+    def _bind(request, response, key, arg_type, val=None) -> Parameters:
+        if val is None:
+            val = Parameters()
         name = val.name if val.name is not None and val.name != "" else key
-        if val._required and name not in self.request.parameters:
+        if val._required and name not in request.parameters:
             raise HttpError(400, "Missing Parameter",
                             f"Parameter[{name}] is required.")
-        if name in self.request.parameters:
-            v = self.request.parameters[name]
+        if name in request.parameters:
+            v = request.parameters[name]
             return Parameters(name=name, default=v, required=val._required)
         else:
             return val
 
 
-class RegGroupModelBinding(ModelBinding):
+class RegGroupModelBinding(_SyncModelBinding):
 
-    async def bind(self) -> RegGroup:
-        return self.__build_reg_group(**self._kws)
+    _requires_body = False
 
-    def __build_reg_group(self, val: RegGroup = RegGroup(group=0)):
-        if val.group >= len(self.request.reg_groups):
+    @staticmethod
+    def _bind(request, response, arg, arg_type, val=None) -> RegGroup:
+        if val is None:
+            val = RegGroup(group=0)
+        if val.group >= len(request.reg_groups):
             raise HttpError(
-                400, None, f"RegGroup required an element at {val.group}, but the reg length is only {len(self.request.reg_groups)}")
-        return RegGroup(group=val.group, _value=self.request.reg_groups[val.group])
+                400, None, f"RegGroup required an element at {val.group}, but the reg length is only {len(request.reg_groups)}")
+        return RegGroup(group=val.group, _value=request.reg_groups[val.group])
 
 
-class JSONBodyModelBinding(ModelBinding):
+class JSONBodyModelBinding(_SyncModelBinding):
 
-    async def bind(self) -> Any:
-        return self.__build_json_body()
-
-    def __build_json_body(self):
-        if "content-type" not in self.request._headers_keys_in_lowcase.keys() or \
-                not self.request._headers_keys_in_lowcase["content-type"].lower().startswith("application/json"):
+    @staticmethod
+    def _bind(request, response, arg, arg_type, val=None) -> Any:
+        if not request.headers.get("Content-Type", "").lower().startswith("application/json"):
             raise HttpError(
                 400, None, 'The content type of this request must be "application/json"')
-        return JSONBody(self.request.json)
+        if request.json is None and request._body:
+            codec = getattr(request, "_json_codec", None) or get_json_codec()
+            try:
+                request.json = codec.loads(request._body)
+            except codec.decode_error:
+                raise HttpError(400, "Bad Request", "The body of this request is not a valid JSON.")
+        return JSONBody(request.json)
 
 
-class RequestBodyReaderModelBinding(ModelBinding):
+class RequestBodyReaderModelBinding(_SyncModelBinding):
 
-    async def bind(self) -> Any:
-        return self.request.reader
+    _requires_body = False
+
+    @staticmethod
+    def _bind(request, response, arg, arg_type, val=None) -> Any:
+        return request.reader
 
 
 class BytesBodyModelBinding(ModelBinding):
+    """ Read the body from the reader itself if it is not loaded. """
 
     async def bind(self) -> Any:
         if not self.request._body:
-            self.request._body = await self.request.reader.read()
+            self.request._body = await self.request.reader.read_all()
         return BytesBody(self.request._body)
 
 
-class StrModelBinding(ModelBinding):
+class SpooledBodyModelBinding(ModelBinding):
+    """ Read the body into memory or a temporary file according to its size. """
 
     async def bind(self) -> Any:
-        return self.__build_str(self.arg_name, **self._kws)
+        if self.request._body:
+            # The body has been loaded, e.g. before a filter, so nothing is left in the reader.
+            body = SpooledBody(spool_threshold=None)
+            body._write(self.request._body)
+            body._seal()
+            return body
+        return await self.request.reader.read_spooled()
+
+
+class StrModelBinding(_SyncModelBinding):
 
-    def __build_str(self, key, val=None):
-        if key in self.request.parameter.keys():
-            return Parameter(name=key, default=self.request.parameter[key], required=False)
+    @staticmethod
+    def _bind(request, response, key, arg_type, val=None) -> Any:
+        if key in request.parameter.keys():
+            return Parameter(name=key, default=request.parameter[key], required=False)
         elif val is None:
             return None
         else:
             return Parameter(name=key, default=val, required=False)
 
 
-class BoolModelBinding(ModelBinding):
+class BoolModelBinding(_SyncModelBinding):
 
-    async def bind(self) -> Any:
-        return self.__build_bool(self.arg_name, **self._kws)
-
-    def __build_bool(self, key, val=None):
-        if key in self.request.parameter.keys():
-            v = self.request.parameter[key]
+    @staticmethod
+    def _bind(request, response, key, arg_type, val=None) -> Any:
+        if key in request.parameter.keys():
+            v = request.parameter[key]
             return v.lower() not in ("0", "false", "")
         else:
             return val
 
 
-class IntModelBinding(ModelBinding):
-
-    async def bind(self) -> Any:
-        return self.__build_int(self.arg_name, **self._kws)
+class IntModelBinding(_SyncModelBinding):
 
-    def __build_int(self, key, val=None):
-        if key in self.request.parameter.keys():
+    @staticmethod
+    def _bind(request, response, key, arg_type, val=None) -> Any:
+        if key in request.parameter.keys():
             try:
-                return int(self.request.parameter[key])
+                return int(request.parameter[key])
             except:
                 raise HttpError(
                     400, None, f"Parameter[{key}] should be an int. ")
@@ -292,15 +356,13 @@ class IntModelBinding(ModelBinding):
             return val
 
 
-class FloatModelBinding(ModelBinding):
-
-    async def bind(self) -> Any:
-        return self.__build_float(self.arg_name, **self._kws)
+class FloatModelBinding(_SyncModelBinding):
 
-    def __build_float(self, key, val=None):
-        if key in self.request.parameter.keys():
+    @staticmethod
+    def _bind(request, response, key, arg_type, val=None) -> Any:
+        if key in request.parameter.keys():
             try:
-                return float(self.request.parameter[key])
+                return float(request.parameter[key])
             except:
                 raise HttpError(
                     400, None, f"Parameter[{key}] should be an float. ")
@@ -308,16 +370,14 @@ class FloatModelBinding(ModelBinding):
             return val
 
 
-class ListModelBinding(ModelBinding):
+class ListModelBinding(_SyncModelBinding):
 
-    async def bind(self) -> Any:
-        return self.__build_list(self.arg_name, **self._kws)
-
-    def __build_list(self, key, target_type=list, val=[]):
-        if key in self.request.parameters.keys():
-            ori_list = self.request.parameters[key]
+    @staticmethod
+    def _bind(request, response, key, target_type=list, val=None) -> Any:
+        if key in request.parameters.keys():
+            ori_list = request.parameters[key]
         else:
-            ori_list = val
+            ori_list = val if val is not None else []
 
         if target_type == List[int]:
             try:
@@ -335,7 +395,8 @@ class ListModelBinding(ModelBinding):
             return [p.lower() not in ("0", "false", "") for p in ori_list]
         elif target_type in (List[dict], List[Dict]):
             try:
-                return [json.loads(p) for p in ori_list]
+                codec = getattr(request, "_json_codec", None) or get_json_codec()
+                return [codec.loads(p) for p in ori_list]
             except:
                 raise HttpError(
                     400, None, f"One of the parameter[{key}] is not JSON string. ")
@@ -345,14 +406,12 @@ class ListModelBinding(ModelBinding):
             return ori_list
 
 
-class ModelDictModelBinding(ModelBinding):
-
-    async def bind(self) -> Any:
-        return self.__build_model_dict()
+class ModelDictModelBinding(_SyncModelBinding):
 
-    def __build_model_dict(self):
+    @staticmethod
+    def _bind(request, response, arg, arg_type, val=None) -> Any:
         mdict = ModelDict()
-        for k, v in self.request.parameters.items():
+        for k, v in request.parameters.items():
             if len(v) == 1:
                 mdict[k] = v[0]
             else:
@@ -360,32 +419,68 @@ class ModelDictModelBinding(ModelBinding):
         return mdict
 
 
-class DictModelBinding(ModelBinding):
+class DictModelBinding(_SyncModelBinding):
 
-    async def bind(self) -> Any:
-        return self.__build_dict(self.arg_name, **self._kws)
-
-    def __build_dict(self, key, val={}):
-        if key in self.request.parameter.keys():
+    @staticmethod
+    def _bind(request, response, key, arg_type, val=None) -> Any:
+        if key in request.parameter.keys():
             try:
-                return json.loads(self.request.parameter[key])
+                codec = getattr(request, "_json_codec", None) or get_json_codec()
+                return codec.loads(request.parameter[key])
             except:
                 raise HttpError(
                     400, None, f"Parameter[{key}] should be a JSON string.")
         else:
-            return val
+            return val if val is not None else {}
 
 
-class DefaultModelBinding(ModelBinding):
+class StructuredModelBinding(_SyncModelBinding):
+    """
+    " Bind the JSON body, or the parameters if the request does not have a JSON body, to a dataclass,
+    " a TypedDict or a NamedTuple. The converter of the type is compiled when the controller is mapped.
+    """
 
-    async def bind(self) -> Any:
-        return self.default_value
+    @classmethod
+    def _prepare(cls, arg_type) -> Callable:
+        converter = get_converter(arg_type)
+
+        def bind(request, response, arg, arg_type, val=None) -> Any:
+            return StructuredModelBinding._convert(request, arg_type, converter)
+        return bind
+
+    @staticmethod
+    def _bind(request, response, arg, arg_type, val=None) -> Any:
+        return StructuredModelBinding._convert(request, arg_type, get_converter(arg_type))
+
+    @staticmethod
+    def _convert(request: Request, arg_type, converter: Callable[[Any], Any]) -> Any:
+        if request.json is not None:
+            data = request.json
+        else:
+            data = {}
+            for k, v in request.parameters.items():
+                data[k] = v[0] if len(v) == 1 else v
+        try:
+            return converter(data)
+        except ConversionError as e:
+            raise HttpError(400, "Invalid Body",
+                            f"Cannot bind request to {arg_type.__name__}: {e}")
+
+
+class DefaultModelBinding(_SyncModelBinding):
+
+    _requires_body = False
+
+    @staticmethod
+    def _bind(request, response, arg, arg_type, val=None) -> Any:
+        return val
 
 
 class ModelBindingConf:
 
     def __init__(self) -> None:
         self.default_model_binding_type = DefaultModelBinding
+        self.structured_model_binding_type = StructuredModelBinding
         self.model_bingding_types: Dict[Type, Type[ModelBinding]] = {
             Request: RequestModelBinding,
             HttpSession: SessionModelBinding,
@@ -406,6 +501,7 @@ class ModelBindingConf:
             JSONBody: JSONBodyModelBinding,
             RequestBodyReader: RequestBodyReaderModelBinding,
             BytesBody: BytesBodyModelBinding,
+            SpooledBody: SpooledBodyModelBinding,
             str: StrModelBinding,
             bool: BoolModelBinding,
             int: IntModelBinding,
@@ -422,3 +518,93 @@ class ModelBindingConf:
             dict: DictModelBinding,
             Dict: DictModelBinding
         }
+
+    def get_binding_type(self, arg_type) -> Type[ModelBinding]:
+        if arg_type in self.model_bingding_types:
+            return self.model_bingding_types[arg_type]
+        elif self.default_model_binding_type is DefaultModelBinding and is_structured_type(arg_type):
+            # A default binding set by `@default_model_binding` is used for the structured types too.
+            return self.structured_model_binding_type
+        else:
+            return self.default_model_binding_type
+
+    def _create_binder(self, arg: str, arg_type, val=None) -> "_ArgBinder":
+        binding_type = self.get_binding_type(arg_type)
+        try:
+            return _ArgBinder(binding_type, arg, arg_type, val)
+        except TypeError as e:
+            # e.g. a dataclass with a forward reference or a field type that cannot be converted.
+            if binding_type is self.default_model_binding_type:
+                raise
+            _logger.warning(f"Argument [{arg}] cannot be bound by {binding_type.__name__}: {e}, "
+                            f"{self.default_model_binding_type.__name__} is used instead.")
+            return _ArgBinder(self.default_model_binding_type, arg, arg_type, val)
+
+
+class _ArgBinder:
+
+    def __init__(self, binding_type: Type[ModelBinding], arg: str, arg_type, val=None) -> None:
+        self.binding_type = binding_type
+        self.arg = arg
+        self.arg_type = arg_type
+        self.val = val
+        if issubclass(binding_type, _SyncModelBinding) and binding_type.bind is _SyncModelBinding.bind:
+            self.sync_bind: Callable = binding_type._prepare(arg_type)
+            self.requires_body: bool = binding_type._requires_body
+        else:
+            self.sync_bind: Callable = None
+            self.requires_body: bool = binding_type not in (BytesBodyModelBinding, SpooledBodyModelBinding)
+
+    async def bind(self, request: Request, response: Response) -> Any:
+        binding_obj = self.binding_type(request, response, self.arg, self.arg_type, self.val)
+        if asyncio.iscoroutinefunction(binding_obj.bind):
+            return await binding_obj.bind()
+        else:
+            return binding_obj.bind()
+
+
+class ModelBindingPlan:
+    """
+    " The argument bindings of a controller function, resolved once when the controller is mapped.
+    " Bindings that cannot suspend are called synchronously, the others are awaited.
+    """
+
+    def __init__(self, func: Callable, model_binding_conf: ModelBindingConf) -> None:
+        self.func: Callable = func
+        self.is_coroutine: bool = asyncio.iscoroutinefunction(func)
+        self.args: List[_ArgBinder] = [model_binding_conf._create_binder(arg, t)
+                                       for arg, t in get_function_args(func)]
+        self.kwargs: List[_ArgBinder] = []
+        for k, v, t in get_function_kwargs(func):
+            arg_type = type(v) if v is not None else t
+            self.kwargs.append(model_binding_conf._create_binder(k, arg_type, v))
+        # The first argument is the controller object if the function is defined in a class.
+        self.__requires_body: bool = any([b.requires_body for b in self.args + self.kwargs])
+        self.__requires_body_with_object: bool = any([b.requires_body for b in self.args[1:] + self.kwargs])
+
+    def requires_body(self, ctrl_object: object = None) -> bool:
+        return self.__requires_body_with_object if ctrl_object is not None else self.__requires_body
+
+    async def bind(self, request: Request, response: Response, ctrl_object: object = None) -> Tuple[List, Dict]:
+        args = []
+        binders = self.args
+        if binders and ctrl_object is not None:
+            args.append(ctrl_object)
+            binders = binders[1:]
+        for binder in binders:
+            if binder.sync_bind is not None:
+                param = binder.sync_bind(request, response, binder.arg, binder.arg_type, binder.val)
+            else:
+                param = await binder.bind(request, response)
+            if param is None:
+                raise HttpError(400, "Missing Paramter",
+                                f"Parameter[{binder.arg}] is required! ")
+            args.append(param)
+
+        kwargs = {}
+        for binder in self.kwargs:
+            if binder.sync_bind is not None:
+                kwargs[binder.arg] = binder.sync_bind(request, response, binder.arg, binder.arg_type, binder.val)
+            else:
+                kwargs[binder.arg] = await binder.bind(request, response)
+        return args, kwargs
@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (c) 2018 Keijack Wu
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+
+import os
+import tempfile
+from typing import Callable, Dict, List, Union
+from urllib.parse import unquote
+
+from ..models import DEFAULT_ENCODING, HttpError, MultipartFile, RequestBodyReader
+from ..utils import http_utils
+from ..utils.logger import get_logger
+
+_logger = get_logger("naja_atra.request_handlers.multipart_parser")
+
+_CHUNK_SIZE = 64 * 1024
+
+_MAX_PART_HEADERS_SIZE = 16 * 1024
+
+
+def get_boundary(content_type: str) -> str:
+    for param in content_type.split(";")[1:]:
+        k, v = http_utils.break_into(param.strip(), "=")
+        if k.lower() == "boundary" and v:
+            return v[1:-1] if v.startswith('"') and v.endswith('"') else v
+    return ""
+
+
+class _PartSink:
+    """
+    " Collect the content of a part in memory, file parts are spooled to a temporary file
+    " when they grow larger than `spool_threshold`. The bytes kept in memory are counted by `reserve`.
+    """
+
+    def __init__(self, spool: bool, spool_threshold: int, max_part_size: int,
+                 reserve: Callable[[int], None] = None, unreserve: Callable[[int], None] = None) -> None:
+        self.spool: bool = spool
+        self.spool_threshold: int = spool_threshold
+        self.max_part_size: int = max_part_size
+        self.reserve: Callable[[int], None] = reserve
+        self.unreserve: Callable[[int], None] = unreserve
+        self.size: int = 0
+        self.buffer: bytearray = bytearray()
+        self.file = None
+
+    def write(self, data: Union[bytes, bytearray]) -> None:
+        if not data:
+            return
+        self.size += len(data)
+        if self.max_part_size is not None and self.size > self.max_part_size:
+            raise HttpError(413, "Payload Too Large",
+                            f"A part of the multipart body is larger than {self.max_part_size} bytes.")
+        if self.file is not None:
+            self.file.write(data)
+            return
+        if self.reserve is not None:
+            self.reserve(len(data))
+        self.buffer += data
+        if self.spool and self.spool_threshold is not None and len(self.buffer) > self.spool_threshold:
+            self.file = tempfile.NamedTemporaryFile(prefix="naja-atra-", suffix=".part", delete=False)
+            self.file.write(self.buffer)
+            if self.unreserve is not None:
+                self.unreserve(len(self.buffer))
+            self.buffer = bytearray()
+
+    def close(self) -> None:
+        if self.file is not None:
+            self.file.close()
+
+    def remove(self) -> None:
+        if self.file is not None:
+            self.file.close()
+            try:
+                os.remove(self.file.name)
+            except OSError:
+                pass
+
+
+class MultipartParser:
+    """
+    " An incremental `multipart/form-data` parser. The body is read from the reader chunk by chunk,
+    " so a large upload does not have to be in memory, parts with a filename are spooled to temporary
+    " files when they are larger than `spool_threshold`. The parts kept in memory are counted by `reserve`
+    " and the spooled ones given back by `unreserve`, e.g. against the budget of the request bodies in flight.
+    """
+
+    def __init__(self, reader: RequestBodyReader, boundary: str,
+                 spool_threshold: int = 1024 * 1024,
+                 max_part_size: int = None,
+                 max_total_size: int = None,
+                 reserve: Callable[[int], None] = None,
+                 unreserve: Callable[[int], None] = None) -> None:
+        self.__reader: RequestBodyReader = reader
+        self.__boundary: bytes = b"--" + boundary.encode("ISO-8859-1")
+        self.__delimiter: bytes = b"\r\n" + self.__boundary
+        self.__spool_threshold: int = spool_threshold
+        self.__max_part_size: int = max_part_size
+        self.__max_total_size: int = max_total_size
+        self.__reserve: Callable[[int], None] = reserve
+        self.__unreserve: Callable[[int], None] = unreserve
+        self.__buffer: bytearray = bytearray()
+        self.__eof: bool = False
+        self.__total_size: int = 0
+
+    async def parse(self) -> Dict[str, List[Union[str, MultipartFile]]]:
+        params = {}
+        sinks: List[_PartSink] = []
+        try:
+            await self.__skip_preamble()
+            while True:
+                await self.__fill_to(2)
+                if self.__buffer[:2] == b"--":
+                    # the close delimiter
+                    break
+                if self.__buffer[:2] != b"\r\n":
+                    raise HttpError(400, "Bad Request", "Malformed multipart body.")
+                del self.__buffer[:2]
+                headers = await self.__read_part_headers()
+                kvs = self.__decode_content_disposition(
+                    headers.get("content-disposition", ""))
+                is_file = "filename" in kvs or "filename*" in kvs
+                sink = _PartSink(is_file, self.__spool_threshold, self.__max_part_size,
+                                 self.__reserve, self.__unreserve)
+                sinks.append(sink)
+                await self.__read_part_body(sink)
+                sink.close()
+                key, val = self.__to_field(kvs, headers, sink)
+                http_utils.put_to(params, key, val)
+        except:
+            for sink in sinks:
+                sink.remove()
+            raise
+        return params
+
+    async def __read(self) -> bool:
+        if self.__eof:
+            return False
+        data = await self.__reader.read(_CHUNK_SIZE)
+        if not data:
+            self.__eof = True
+            return False
+        self.__total_size += len(data)
+        if self.__max_total_size is not None and self.__total_size > self.__max_total_size:
+            raise HttpError(413, "Payload Too Large",
+                            f"The multipart body is larger than {self.__max_total_size} bytes.")
+        self.__buffer += data
+        return True
+
+    async def __fill_to(self, size: int) -> None:
+        while len(self.__buffer) < size:
+            if not await self.__read():
+                raise HttpError(400, "Bad Request", "Unexpected end of multipart body.")
+
+    async def __skip_preamble(self) -> None:
+        while True:
+            idx = self.__buffer.find(self.__boundary)
+            if idx >= 0:
+                del self.__buffer[:idx + len(self.__boundary)]
+                return
+            # keep the tail, the boundary may be split into two chunks.
+            keep = len(self.__boundary) - 1
+            if len(self.__buffer) > keep:
+                del self.__buffer[:len(self.__buffer) - keep]
+            if not await self.__read():
+                raise HttpError(400, "Bad Request", "Cannot find the boundary in the multipart body.")
+
+    async def __read_part_headers(self) -> Dict[str, str]:
+        start = 0
+        while True:
+            idx = self.__buffer.find(b"\r\n\r\n", start)
+            if idx >= 0:
+                break
+            if len(self.__buffer) > _MAX_PART_HEADERS_SIZE:
+                raise HttpError(400, "Bad Request", "Headers of the multipart body are too large.")
+            start = max(0, len(self.__buffer) - 3)
+            if not await self.__read():
+                raise HttpError(400, "Bad Request", "Unexpected end of multipart body.")
+        lines = self.__buffer[:idx].decode("ISO-8859-1").split("\r\n")
+        del self.__buffer[:idx + 4]
+        headers = {}
+        for line in lines:
+            k, v = http_utils.break_into(line, ":")
+            if v is not None:
+                headers[k.strip().lower()] = v.strip()
+        return headers
+
+    async def __read_part_body(self, sink: _PartSink) -> None:
+        delimiter = self.__delimiter
+        keep = len(delimiter) - 1
+        while True:
+            idx = self.__buffer.find(delimiter)
+            if idx >= 0:
+                sink.write(self.__buffer[:idx])
+                del self.__buffer[:idx + len(delimiter)]
+                return
+            if len(self.__buffer) > keep:
+                n = len(self.__buffer) - keep
+                sink.write(self.__buffer[:n])
+                del self.__buffer[:n]
+            if not await self.__read():
+                raise HttpError(400, "Bad Request", "Unexpected end of multipart body.")
+
+    def __decode_content_disposition(self, line: str) -> Dict[str, str]:
+        cont_dis = {}
+        es = line.split(";")[1:]
+        for e in es:
+            k, v = http_utils.break_into(e.strip(), "=")
+            if v is None:
+                continue
+            if v.startswith('"') and v.endswith('"'):
+                cont_dis[k] = v[1: -1]  # ignore the '"' symbol
+            else:
+                cont_dis[k] = v
+        return cont_dis
+
+    def __to_field(self, kvs: Dict[str, str], headers: Dict[str, str], sink: _PartSink):
+        kname = kvs.get("name", "").encode(
+            "ISO-8859-1", errors="replace").decode(DEFAULT_ENCODING, errors="replace")
+        if len(kvs) == 1:
+            # this is a string field
+            return kname, bytes(sink.buffer).decode(DEFAULT_ENCODING, errors="replace")
+        elif "filename" in kvs or "filename*" in kvs:
+            if "filename*" in kvs:
+                name_value = kvs["filename*"]
+                idx = name_value.find("'")
+                if idx <= 0:
+                    encoding = DEFAULT_ENCODING
+                else:
+                    encoding = name_value[0:idx]
+                name_value = name_value[idx + 1:]
+                idx = name_value.find("'")
+                filename = unquote(name_value[idx + 1:], encoding)
+            else:
+                filename = kvs["filename"].encode(
+                    "ISO-8859-1", errors="replace").decode(DEFAULT_ENCODING, errors="replace")
+            content_type = headers.get("content-type", "")
+            if sink.file is not None:
+                return kname, MultipartFile(kname, filename=filename, content_type=content_type,
+                                            temp_file=sink.file.name, size=sink.size)
+            return kname, MultipartFile(kname, filename=filename, content_type=content_type,
+                                        content=bytes(sink.buffer))
+        else:
+            return kname, "UNKNOWN"
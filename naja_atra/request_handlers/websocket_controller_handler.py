@@ -36,10 +36,16 @@ from uuid import uuid4
 from socket import error as SocketError
 
 from ..utils.logger import get_logger
-from ..models import Headers, WebsocketCloseReason, WebsocketRequest, WebsocketSession
+from ..utils.metrics import Metrics
+from ..models import Headers, HttpHeaders, WebsocketCloseReason, WebsocketRequest, WebsocketSession
 from ..models import WEBSOCKET_OPCODE_BINARY, WEBSOCKET_OPCODE_CLOSE, WEBSOCKET_OPCODE_CONTINUATION, WEBSOCKET_OPCODE_PING, WEBSOCKET_OPCODE_PONG, WEBSOCKET_OPCODE_TEXT
 from ..models import DEFAULT_ENCODING
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 
 _logger = get_logger("naja_atra.request_handlers.websocket_request_handler")
 
@@ -78,6 +84,12 @@ PAYLOAD_LEN_EXT16 = 0x7e
 PAYLOAD_LEN_EXT64 = 0x7f
 GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
 _BUFFER_SIZE = 1024 * 1024
+# Bytes asked for in one read, the frames that are received together are parsed from it without reading again.
+_READ_SIZE = 64 * 1024
+# Payloads larger than this are unmasked by slices (or numpy when it is installed) instead of as one integer.
+_LARGE_PAYLOAD = 4 * 1024
+# The tables that XOR a byte with each of the 256 values, used by `bytes.translate`.
+_XOR_TABLES: List[bytes] = [bytes([b ^ k for b in range(256)]) for k in range(256)]
 
 OPTYPES = {
     WEBSOCKET_OPCODE_CONTINUATION: "CONTINUATION",
@@ -89,6 +101,27 @@ OPTYPES = {
 }
 
 
+def _unmask(payload: bytes, mask: bytes) -> Union[bytes, bytearray]:
+    """
+    " XOR the payload with the 4 bytes mask, as a whole instead of byte by byte.
+    """
+    length = len(payload)
+    if not length:
+        return b""
+    if length < _LARGE_PAYLOAD:
+        masks = mask * (length >> 2) + mask[:length & 3]
+        return (int.from_bytes(payload, "little") ^ int.from_bytes(masks, "little")).to_bytes(length, "little")
+    if numpy is not None:
+        data = numpy.frombuffer(payload, dtype=numpy.uint8)
+        masks = numpy.resize(numpy.frombuffer(mask, dtype=numpy.uint8), length)
+        return numpy.bitwise_xor(data, masks).tobytes()
+    # Every 4th byte is XORed with the same byte of the mask, which is a translation of that slice.
+    unmasked = bytearray(length)
+    for i in range(4):
+        unmasked[i::4] = payload[i::4].translate(_XOR_TABLES[mask[i]])
+    return unmasked
+
+
 class _ContinuationMessageCache:
 
     def __init__(self, opcode: int) -> None:
@@ -123,6 +156,8 @@ class WebsocketControllerHandler:
         self.reader = http_request_handler.reader
         self.keep_alive = True
         self.handshake_done = False
+        self.metrics: Metrics = self.routing_conf.metrics
+        self.__session_opened: bool = False
 
         handler_class, path_values, regroups = self.routing_conf.get_websocket_handler(
             http_request_handler.request_path)
@@ -134,42 +169,37 @@ class WebsocketControllerHandler:
         self.ws_request.parameters = http_request_handler.query_parameters
         self.ws_request.path_values = path_values
         self.ws_request.reg_groups = regroups
-        if "cookie" in self.ws_request.headers:
-            self.ws_request.cookies.load(self.ws_request.headers["cookie"])
-        elif "Cookie" in self.ws_request.headers:
-            self.ws_request.cookies.load(self.ws_request.headers["Cookie"])
         self.session = WebsocketSessionImpl(self, self.ws_request)
         self.close_reason: WebsocketCloseReason = None
 
         self._continution_cache: _ContinuationMessageCache = None
+        # The bytes that have been read but not parsed, e.g. the next frames that come with the current one.
+        self.__buffer: bytearray = bytearray()
         self._send_msg_lock = Lock()
         self._send_frame_lock = Lock()
 
     @property
-    def response_headers(self):
-        if hasattr(self.http_request_handler, "_headers_buffer"):
-            return self.http_request_handler._headers_buffer
-        else:
-            return []
+    def response_headers(self) -> bytes:
+        return bytes(self.http_request_handler._headers_buffer)
 
     async def await_func(self, obj):
         if asyncio.iscoroutine(obj):
             return await obj
         return obj
 
-    async def on_handshake(self) -> Tuple[int, Dict[str, List[str]]]:
+    async def on_handshake(self) -> Tuple[int, HttpHeaders]:
         try:
             if not hasattr(self.handler, "on_handshake") or not callable(self.handler.on_handshake):
-                return None, {}
+                return None, HttpHeaders()
             res = await self.await_func(self.handler.on_handshake(self.ws_request))
             http_status_code = None
-            headers = {}
+            headers = HttpHeaders()
             if not res:
                 pass
             elif isinstance(res, int):
                 http_status_code = res
             elif isinstance(res, dict) or isinstance(res, Headers):
-                headers = res
+                headers.update(res)
             elif isinstance(res, tuple):
                 for item in res:
                     if isinstance(item, int) and not http_status_code:
@@ -181,9 +211,9 @@ class WebsocketControllerHandler:
             return http_status_code, headers
         except Exception as e:
             _logger.error(f"Error occurs when handshake. ")
-            return 500, {}
+            return 500, HttpHeaders()
 
-    async def on_message(self, opcode: int, message_bytes: bytearray):
+    async def on_message(self, opcode: int, message_bytes: Union[bytes, bytearray]):
         try:
             if opcode == WEBSOCKET_OPCODE_CLOSE:
                 _logger.info("Client asked to close connection.")
@@ -202,13 +232,13 @@ class WebsocketControllerHandler:
                 await self.await_func(self.handler.on_ping_message(self.session, bytes(message_bytes)))
             elif opcode == WEBSOCKET_OPCODE_PONG and hasattr(self.handler, "on_pong_message") and callable(self.handler.on_pong_message):
                 await self.await_func(self.handler.on_pong_message(self.session, bytes(message_bytes)))
-            elif opcode == WEBSOCKET_OPCODE_BINARY and self._continution_cache.message_bytes and hasattr(self.handler, "on_binary_message") and callable(self.handler.on_binary_message):
+            elif opcode == WEBSOCKET_OPCODE_BINARY and (self._continution_cache is None or self._continution_cache.message_bytes) and hasattr(self.handler, "on_binary_message") and callable(self.handler.on_binary_message):
                 await self.await_func(self.handler.on_binary_message(self.session, bytes(message_bytes)))
         except Exception as e:
             _logger.error(f"Error occurs when on message!")
             self.close(f"Error occurs when on_message. {e}")
 
-    async def on_continuation_frame(self, first_frame_opcode: int, fin: int, message_frame: bytearray):
+    async def on_continuation_frame(self, first_frame_opcode: int, fin: int, message_frame: Union[bytes, bytearray]):
         try:
             if first_frame_opcode == WEBSOCKET_OPCODE_BINARY and hasattr(self.handler, "on_binary_frame") and callable(self.handler.on_binary_frame):
                 should_append_to_cache = await self.await_func(self.handler.on_binary_frame(self.session, bool(fin), bytes(message_frame)))
@@ -242,12 +272,13 @@ class WebsocketControllerHandler:
                     await self.handshake()
                 else:
                     await self.read_next_message()
+                # Do not read more messages while the client is not reading what has been sent.
+                await self.http_request_handler.drain_writer()
             except WebsocketException as e:
                 if not e.is_graceful:
-                    _logger.warning(
-                        f"Something's wrong, close connection: {e.reason}")
+                    _logger.warning("Something's wrong, close connection: %s", e.reason)
                 else:
-                    _logger.info(f"Close connection: {e.reason}")
+                    _logger.info("Close connection: %s", e.reason)
                 self.keep_alive = False
                 self.close_reason = e.reason
             except:
@@ -256,6 +287,8 @@ class WebsocketControllerHandler:
                 self.close_reason = WebsocketCloseReason(
                     "Errors occur when handling message!")
 
+        if self.__session_opened:
+            self.metrics.websocket_sessions.dec()
         await self.on_close()
 
     async def handshake(self):
@@ -271,23 +304,25 @@ class WebsocketControllerHandler:
                 self.send_header("Sec-WebSocket-Accept",
                                  self.calculate_response_key())
             if headers:
-                for h_name, h_val in headers.items():
+                for h_name, h_val in headers.multi_items():
                     self.send_header(h_name, h_val)
         else:
             self.keep_alive = False
             self.send_response(404)
 
-        ws_res_headers = b"".join(self.response_headers) + b"\r\n"
+        ws_res_headers = self.response_headers + b"\r\n"
         _logger.debug(ws_res_headers)
         self.request_writer.send(ws_res_headers)
         self.handshake_done = True
         if self.keep_alive == True:
+            if self.metrics is not None:
+                self.__session_opened = True
+                self.metrics.websocket_sessions.inc()
             await self.on_open()
 
     def calculate_response_key(self):
-        key: str = self.ws_request.headers["Sec-WebSocket-Key"] if "Sec-WebSocket-Key" in self.ws_request.headers else self.ws_request.headers["Sec-Websocket-Key"]
-        _logger.debug(
-            f"Sec-WebSocket-Key: {key}")
+        key: str = self.ws_request.headers["Sec-WebSocket-Key"]
+        _logger.debug("Sec-WebSocket-Key: %s", key)
         key_hash = sha1(key.encode(errors="replace") +
                         GUID.encode(errors="replace"))
         response_key = b64encode(key_hash.digest()).strip()
@@ -296,10 +331,49 @@ class WebsocketControllerHandler:
     async def read_bytes(self, num):
         return await self.reader.read(num)
 
-    async def _read_message_content(self) -> Tuple[int, int, bytearray]:
-        _logger.debug(f"Read next websocket[{self.ws_request.path}] message")
+    async def __read_some(self) -> bytes:
+        reader = self.reader
+        if hasattr(reader, "read1"):
+            # The blocking reader of the threading mode, `read` would wait until all the bytes are received.
+            return await reader.read1(_READ_SIZE)
+        return await reader.read(_READ_SIZE)
+
+    async def __read_exactly(self, num: int) -> Union[bytes, bytearray]:
+        buffer = self.__buffer
+        if len(buffer) >= num:
+            data = buffer[:num]
+            del buffer[:num]
+            return data
+        if num - len(buffer) >= _READ_SIZE:
+            # A large payload is read in one go instead of being copied through the buffer.
+            head = bytes(buffer)
+            buffer.clear()
+            reader = self.reader
+            if hasattr(reader, "readexactly"):
+                try:
+                    rest = await reader.readexactly(num - len(head))
+                except asyncio.IncompleteReadError:
+                    rest = b""
+            else:
+                rest = await reader.read(num - len(head))
+            if len(rest) < num - len(head):
+                raise WebsocketException(
+                    graceful=True, reason=WebsocketCloseReason("Client closed connection."))
+            return head + rest if head else rest
+        while len(buffer) < num:
+            data = await self.__read_some()
+            if not data:
+                raise WebsocketException(
+                    graceful=True, reason=WebsocketCloseReason("Client closed connection."))
+            buffer.extend(data)
+        data = buffer[:num]
+        del buffer[:num]
+        return data
+
+    async def _read_message_content(self) -> Tuple[int, int, Union[bytes, bytearray]]:
+        _logger.debug("Read next websocket[%s] message", self.ws_request.path)
         try:
-            b1, b2 = await self.read_bytes(2)
+            b1, b2 = await self.__read_exactly(2)
         except ConnectionResetError as e:
             raise WebsocketException(
                 graceful=True, reason=WebsocketCloseReason("Client closed connection."))
@@ -308,8 +382,6 @@ class WebsocketControllerHandler:
                 raise WebsocketException(
                     graceful=True, reason=WebsocketCloseReason("Client closed connection."))
             b1, b2 = 0, 0
-        except ValueError as e:
-            b1, b2 = 0, 0
 
         fin = b1 & FIN
         opcode = b1 & OPCODE
@@ -329,20 +401,16 @@ class WebsocketControllerHandler:
                 f"Ping/Pong message payload is too large! The max length of the Ping/Pong messages is 125. but now is {payload_length}"))
 
         if payload_length == 126:
-            hb = await self.reader.read(2)
-            payload_length = struct.unpack(">H", hb)[0]
+            payload_length = struct.unpack(">H", await self.__read_exactly(2))[0]
         elif payload_length == 127:
-            qb = await self.reader.read(8)
-            payload_length = struct.unpack(">Q", qb)[0]
-
-        frame_bytes = bytearray()
-        if payload_length > 0:
-            masks = await self.read_bytes(4)
-            payload = await self.read_bytes(payload_length)
-            for encoded_byte in payload:
-                frame_bytes.append(encoded_byte ^ masks[len(frame_bytes) % 4])
-
-        return fin, opcode, frame_bytes
+            payload_length = struct.unpack(">Q", await self.__read_exactly(8))[0]
+
+        # The masking key is sent even if the payload is empty.
+        masks = await self.__read_exactly(4)
+        if payload_length == 0:
+            return fin, opcode, b""
+        payload = await self.__read_exactly(payload_length)
+        return fin, opcode, _unmask(payload, masks)
 
     async def read_next_message(self):
 
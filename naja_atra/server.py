@@ -34,6 +34,10 @@ from typing import Dict
 from .http_servers.http_server import HttpServer
 
 from .app_conf import AppConf
+from .utils.access_log import AccessLog
+from .utils.metrics import Metrics
+from .utils.profiling import RequestProfiler
+from .utils.sampling_profiler import SamplingProfiler
 from .utils.logger import get_logger
 
 
@@ -137,6 +141,19 @@ def _prepare_server(host: str = "",
                     keep_alive_max_request=None,
                     gzip_content_types=set(),
                     gzip_compress_level=9,
+                    multipart_spool_threshold: int = 1024 * 1024,
+                    multipart_max_part_size: int = None,
+                    multipart_max_total_size: int = None,
+                    body_spool_threshold: int = 1024 * 1024,
+                    max_in_flight_body_size: int = None,
+                    max_body_size: int = None,
+                    write_buffer_high_watermark: int = 64 * 1024,
+                    write_buffer_low_watermark: int = None,
+                    access_log: AccessLog = None,
+                    metrics: Metrics = None,
+                    server_timing: bool = False,
+                    request_profiler: RequestProfiler = None,
+                    sampling_profiler: SamplingProfiler = None,
                     prefer_coroutine=False,
                     app_conf: AppConf = None
                     ) -> None:
@@ -158,6 +175,19 @@ def _prepare_server(host: str = "",
                              keep_alive_max_request=keep_alive_max_request,
                              gzip_content_types=gzip_content_types,
                              gzip_compress_level=gzip_compress_level,
+                             multipart_spool_threshold=multipart_spool_threshold,
+                             multipart_max_part_size=multipart_max_part_size,
+                             multipart_max_total_size=multipart_max_total_size,
+                             body_spool_threshold=body_spool_threshold,
+                             max_in_flight_body_size=max_in_flight_body_size,
+                             max_body_size=max_body_size,
+                             write_buffer_high_watermark=write_buffer_high_watermark,
+                             write_buffer_low_watermark=write_buffer_low_watermark,
+                             access_log=access_log,
+                             metrics=metrics,
+                             server_timing=server_timing,
+                             request_profiler=request_profiler,
+                             sampling_profiler=sampling_profiler,
                              prefer_corountine=prefer_coroutine,
                              app_conf=app_conf)
 
@@ -177,6 +207,19 @@ def start(host: str = "",
           keep_alive_max_request=None,
           gzip_content_types=set(),
           gzip_compress_level=9,
+          multipart_spool_threshold: int = 1024 * 1024,
+          multipart_max_part_size: int = None,
+          multipart_max_total_size: int = None,
+          body_spool_threshold: int = 1024 * 1024,
+          max_in_flight_body_size: int = None,
+          max_body_size: int = None,
+          write_buffer_high_watermark: int = 64 * 1024,
+          write_buffer_low_watermark: int = None,
+          access_log: AccessLog = None,
+          metrics: Metrics = None,
+          server_timing: bool = False,
+          request_profiler: RequestProfiler = None,
+          sampling_profiler: SamplingProfiler = None,
           prefer_coroutine=False,
           app_conf: AppConf = None) -> None:
     _prepare_server(
@@ -195,6 +238,19 @@ def start(host: str = "",
         keep_alive_max_request=keep_alive_max_request,
         gzip_content_types=gzip_content_types,
         gzip_compress_level=gzip_compress_level,
+        multipart_spool_threshold=multipart_spool_threshold,
+        multipart_max_part_size=multipart_max_part_size,
+        multipart_max_total_size=multipart_max_total_size,
+        body_spool_threshold=body_spool_threshold,
+        max_in_flight_body_size=max_in_flight_body_size,
+        max_body_size=max_body_size,
+        write_buffer_high_watermark=write_buffer_high_watermark,
+        write_buffer_low_watermark=write_buffer_low_watermark,
+        access_log=access_log,
+        metrics=metrics,
+        server_timing=server_timing,
+        request_profiler=request_profiler,
+        sampling_profiler=sampling_profiler,
         prefer_coroutine=prefer_coroutine,
         app_conf=app_conf
     )
@@ -217,6 +273,19 @@ async def start_async(host: str = "",
                       keep_alive_max_request=None,
                       gzip_content_types=set(),
                       gzip_compress_level=9,
+                      multipart_spool_threshold: int = 1024 * 1024,
+                      multipart_max_part_size: int = None,
+                      multipart_max_total_size: int = None,
+                      body_spool_threshold: int = 1024 * 1024,
+                      max_in_flight_body_size: int = None,
+                      max_body_size: int = None,
+                      write_buffer_high_watermark: int = 64 * 1024,
+                      write_buffer_low_watermark: int = None,
+                      access_log: AccessLog = None,
+                      metrics: Metrics = None,
+                      server_timing: bool = False,
+                      request_profiler: RequestProfiler = None,
+                      sampling_profiler: SamplingProfiler = None,
                       prefer_coroutine=True,
                       app_conf: AppConf = None) -> None:
     _prepare_server(
@@ -235,6 +304,19 @@ async def start_async(host: str = "",
         keep_alive_max_request=keep_alive_max_request,
         gzip_content_types=gzip_content_types,
         gzip_compress_level=gzip_compress_level,
+        multipart_spool_threshold=multipart_spool_threshold,
+        multipart_max_part_size=multipart_max_part_size,
+        multipart_max_total_size=multipart_max_total_size,
+        body_spool_threshold=body_spool_threshold,
+        max_in_flight_body_size=max_in_flight_body_size,
+        max_body_size=max_body_size,
+        write_buffer_high_watermark=write_buffer_high_watermark,
+        write_buffer_low_watermark=write_buffer_low_watermark,
+        access_log=access_log,
+        metrics=metrics,
+        server_timing=server_timing,
+        request_profiler=request_profiler,
+        sampling_profiler=sampling_profiler,
         prefer_coroutine=prefer_coroutine,
         app_conf=app_conf
     )
@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (c) 2018 Keijack Wu
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import os
+import sys
+import time
+import atexit
+import random
+import threading
+from json.encoder import encode_basestring_ascii
+from typing import IO, Callable, Dict, List, Tuple
+
+from .logger import get_logger
+
+
+_logger = get_logger("naja_atra.utils.access_log")
+
+_MONTHS = ("Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec")
+
+FORMAT_COMBINED = "combined"
+
+FORMAT_JSON = "json"
+
+# The fields that can be used in a custom format, e.g. "%(remote_addr)s %(request_line)s %(status)s".
+FIELDS: Tuple[str] = ("remote_addr", "time_local", "time_iso", "request_line", "method", "path", "status",
+                      "bytes_sent", "referer", "user_agent", "latency_ms", "route", "worker")
+
+
+class _TimeCache:
+    """
+    " The time fields only change once a second, they are formatted once for all the lines in that second.
+    """
+
+    def __init__(self) -> None:
+        self.__cache: Tuple[int, str, str] = (0, "", "")
+
+    def get(self, timestamp: float) -> Tuple[str, str]:
+        second = int(timestamp)
+        cached_second, time_local, time_iso = self.__cache
+        if cached_second != second:
+            t = time.gmtime(second)
+            time_local = f"{t.tm_mday:02d}/{_MONTHS[t.tm_mon - 1]}/{t.tm_year}:{t.tm_hour:02d}:{t.tm_min:02d}:{t.tm_sec:02d} +0000"
+            time_iso = time.strftime("%Y-%m-%dT%H:%M:%SZ", t)
+            self.__cache = (second, time_local, time_iso)
+        return time_local, time_iso
+
+
+def _quote(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"') if value else "-"
+
+
+def _compile_format(fmt: str) -> Callable[..., str]:
+    """
+    " Turn a format into a function that builds a line, the format is only parsed once here.
+    """
+    if fmt == FORMAT_COMBINED:
+        def combined(remote_addr, time_local, time_iso, request_line, method, path, status, bytes_sent,
+                     referer, user_agent, latency_ms, route, worker) -> str:
+            return (f'{remote_addr} - - [{time_local}] "{_quote(request_line)}" {status} {bytes_sent} '
+                    f'"{_quote(referer)}" "{_quote(user_agent)}" {latency_ms:.3f}ms "{_quote(route)}" {worker}\n')
+        return combined
+    if fmt == FORMAT_JSON:
+        def json_line(remote_addr, time_local, time_iso, request_line, method, path, status, bytes_sent,
+                      referer, user_agent, latency_ms, route, worker) -> str:
+            return (f'{{"time":"{time_iso}","remote_addr":{encode_basestring_ascii(remote_addr)},'
+                    f'"method":{encode_basestring_ascii(method)},"path":{encode_basestring_ascii(path)},'
+                    f'"status":{status},"bytes_sent":{bytes_sent},"latency_ms":{latency_ms:.3f},'
+                    f'"route":{encode_basestring_ascii(route)},"referer":{encode_basestring_ascii(referer)},'
+                    f'"user_agent":{encode_basestring_ascii(user_agent)},"worker":{encode_basestring_ascii(worker)}}}\n')
+        return json_line
+
+    if not fmt.endswith("\n"):
+        fmt = fmt + "\n"
+
+    def custom(**fields) -> str:
+        return fmt % fields
+    return custom
+
+
+class AccessLog:
+    """
+    " Write one line for each request when the response is sent, with the latency, bytes sent and the route.
+    "
+    " - file_path: the file to write to, if absent, the lines are written to `stream` (default to stdout).
+    " - format: "combined" (the Apache combined format with latency, route and worker appended), "json",
+    "           or a %-style format of the `FIELDS`.
+    " - sample_rate: the ratio of the requests to log, 1 to log all of them.
+    " - route_sample_rates: the sample rates of some routes, the keys are the url (or regexp) in the route mappings.
+    " - always_log_status: the requests with a status code that is not lower than this one are always logged.
+    " - max_bytes, backup_count: rotate the file when it is larger than `max_bytes`, `backup_count` files are kept.
+    " - buffer_size, flush_interval: the lines are buffered and written to the file (or the stream) when the
+    "                                buffer is full or every `flush_interval` seconds, not line by line.
+    """
+
+    def __init__(self,
+                 file_path: str = "",
+                 format: str = FORMAT_COMBINED,
+                 sample_rate: float = 1,
+                 route_sample_rates: Dict[str, float] = {},
+                 always_log_status: int = 500,
+                 max_bytes: int = 100 * 1024 * 1024,
+                 backup_count: int = 7,
+                 buffer_size: int = 64 * 1024,
+                 flush_interval: float = 1,
+                 stream: IO[str] = None) -> None:
+        assert 0 <= sample_rate <= 1, "sample_rate must be between 0 and 1."
+        self.file_path: str = file_path
+        self.sample_rate: float = sample_rate
+        self.route_sample_rates: Dict[str, float] = dict(route_sample_rates)
+        self.always_log_status: int = always_log_status
+        self.max_bytes: int = max_bytes
+        self.backup_count: int = backup_count
+        self.buffer_size: int = buffer_size
+        self.flush_interval: float = flush_interval
+        self.__format: Callable[..., str] = _compile_format(format)
+        self.__time_cache: _TimeCache = _TimeCache()
+        self.__lock: threading.Lock = threading.Lock()
+        self.__stream: IO[str] = stream
+        # The lines waiting to be written to the stream, the file has its own buffer.
+        self.__stream_buffer: List[str] = []
+        self.__stream_buffered: int = 0
+        self.__file: IO[bytes] = None
+        self.__file_size: int = 0
+        self.__closed: threading.Event = threading.Event()
+        self.__flush_thread: threading.Thread = None
+        if file_path:
+            self.__open_file()
+        elif self.__stream is None:
+            self.__stream = sys.stdout
+        atexit.register(self.close)
+
+    def __open_file(self):
+        self.__file = open(self.file_path, "ab", buffering=self.buffer_size)
+        self.__file_size = self.__file.tell()
+
+    def __rotate(self):
+        self.__file.close()
+        if self.backup_count > 0:
+            for i in range(self.backup_count - 1, 0, -1):
+                src = f"{self.file_path}.{i}"
+                if os.path.exists(src):
+                    os.replace(src, f"{self.file_path}.{i + 1}")
+            os.replace(self.file_path, f"{self.file_path}.1")
+        else:
+            os.remove(self.file_path)
+        self.__open_file()
+
+    def __start_flush_thread(self):
+        self.__flush_thread = threading.Thread(target=self.__flush_periodically, name="access-log-flush", daemon=True)
+        self.__flush_thread.start()
+
+    def __flush_periodically(self):
+        while not self.__closed.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception:
+                _logger.exception("Cannot flush the access log.")
+
+    def should_log(self, status: int, route: str) -> bool:
+        if status >= self.always_log_status:
+            return True
+        rate = self.route_sample_rates.get(route, self.sample_rate) if self.route_sample_rates else self.sample_rate
+        return rate >= 1 or (rate > 0 and random.random() < rate)
+
+    def log(self, remote_addr: str = "-",
+            request_line: str = "",
+            method: str = "",
+            path: str = "",
+            status: int = 0,
+            bytes_sent: int = 0,
+            referer: str = "",
+            user_agent: str = "",
+            latency: float = 0,
+            route: str = "",
+            worker: str = "") -> None:
+        """
+        " Write a line of a request, `latency` is in seconds.
+        """
+        if not self.should_log(status, route):
+            return
+        end_time = time.time()
+        time_local, time_iso = self.__time_cache.get(end_time - latency)
+        line = self.__format(remote_addr=remote_addr, time_local=time_local, time_iso=time_iso,
+                             request_line=request_line, method=method, path=path, status=status,
+                             bytes_sent=bytes_sent, referer=referer, user_agent=user_agent,
+                             latency_ms=latency * 1000, route=route, worker=worker)
+        self.write(line)
+
+    def write(self, line: str) -> None:
+        if self.__closed.is_set():
+            return
+        if self.__file is None:
+            with self.__lock:
+                if self.__flush_thread is None:
+                    self.__start_flush_thread()
+                self.__stream_buffer.append(line)
+                self.__stream_buffered += len(line)
+                if self.__stream_buffered >= self.buffer_size:
+                    self.__write_stream_buffer()
+            return
+        data = line.encode("utf-8", errors="replace")
+        with self.__lock:
+            if self.__flush_thread is None:
+                self.__start_flush_thread()
+            if self.max_bytes and self.__file_size + len(data) > self.max_bytes and self.__file_size > 0:
+                self.__rotate()
+            self.__file.write(data)
+            self.__file_size += len(data)
+
+    def __write_stream_buffer(self):
+        if self.__stream_buffer:
+            self.__stream.write("".join(self.__stream_buffer))
+            self.__stream_buffer = []
+            self.__stream_buffered = 0
+
+    def flush(self) -> None:
+        with self.__lock:
+            if self.__file is not None and not self.__file.closed:
+                self.__file.flush()
+            elif self.__stream is not None:
+                self.__write_stream_buffer()
+                self.__stream.flush()
+
+    def close(self) -> None:
+        if self.__closed.is_set():
+            return
+        self.__closed.set()
+        atexit.unregister(self.close)
+        with self.__lock:
+            if self.__file is not None:
+                self.__file.close()
+            else:
+                self.__write_stream_buffer()
+                self.__stream.flush()
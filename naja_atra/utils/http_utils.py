@@ -27,7 +27,6 @@ import inspect
 import time
 import os
 import email
-import json
 import re
 from collections import OrderedDict
 from typing import Any, Tuple, Union
@@ -35,6 +34,7 @@ from urllib.parse import unquote, quote
 from ..models import HttpError, StaticFile, DEFAULT_ENCODING
 
 from .logger import get_logger
+from .json_codec import JSONCodec, get_json_codec
 
 
 _logger = get_logger("naja_atra.utils.http_utils")
@@ -100,12 +100,18 @@ def decode_query_string(query_string: str):
     params = {}
     if not query_string:
         return params
-    pairs = query_string.split("&")
-    for item in pairs:
-        key, val = break_into(item, "=")
-        if val is None:
-            val = ""
-        put_to(params, unquote(key), unquote(val))
+    for item in query_string.split("&"):
+        key, _, val = item.partition("=")
+        # Most keys and values are not quoted, `unquote` is skipped for them.
+        if "%" in key:
+            key = unquote(key)
+        if "%" in val:
+            val = unquote(val)
+        vals = params.get(key)
+        if vals is None:
+            params[key] = [val]
+        else:
+            vals.append(val)
 
     return params
 
@@ -116,13 +122,13 @@ def date_time_string(timestamp=None):
     return email.utils.formatdate(timestamp, usegmt=True)
 
 
-def decode_response_body(raw_body: Any) -> Tuple[str, Union[str,  bytes, StaticFile]]:
+def decode_response_body(raw_body: Any, json_codec: JSONCodec = None) -> Tuple[str, Union[str,  bytes, StaticFile]]:
     content_type = "text/plain; chartset=utf8"
     if raw_body is None:
         body = ""
     elif isinstance(raw_body, dict):
         content_type = "application/json; charset=utf8"
-        body = json.dumps(raw_body, ensure_ascii=False)
+        body = (json_codec or get_json_codec()).dumps_bytes(raw_body)
     elif isinstance(raw_body, str):
         body = raw_body.strip()
         if body.startswith("<?xml") and body.endswith(">"):
@@ -148,8 +154,8 @@ def decode_response_body(raw_body: Any) -> Tuple[str, Union[str,  bytes, StaticF
     return content_type, body
 
 
-def decode_response_body_to_bytes(raw_body: Any) -> Tuple[str, bytes]:
-    content_type, body = decode_response_body(raw_body)
+def decode_response_body_to_bytes(raw_body: Any, json_codec: JSONCodec = None) -> Tuple[str, bytes]:
+    content_type, body = decode_response_body(raw_body, json_codec)
     if body is None:
         byte_body = b''
     elif isinstance(body, str):
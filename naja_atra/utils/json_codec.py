@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (c) 2018 Keijack Wu
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+
+import json
+from typing import Any, Callable, Dict, List, Tuple, Type, Union
+
+from .logger import get_logger
+
+_logger = get_logger("naja_atra.utils.json_codec")
+
+
+class JSONCodec:
+    """
+    " Decode request bodies and encode response bodies. Subclass it and register it via `register_json_codec`
+    " to use a JSON library other than the built-in ones.
+    "
+    " `decode_error` holds the exceptions that `loads` raises when the data is not valid JSON.
+    """
+
+    name: str = ""
+
+    decode_error: Tuple[Type[BaseException], ...] = (ValueError,)
+
+    def loads(self, data: Union[str, bytes]) -> Any:
+        raise NotImplementedError()
+
+    def dumps(self, obj: Any) -> str:
+        return self.dumps_bytes(obj).decode("utf-8")
+
+    def dumps_bytes(self, obj: Any) -> bytes:
+        raise NotImplementedError()
+
+
+class StdlibJSONCodec(JSONCodec):
+
+    name = "json"
+
+    def loads(self, data: Union[str, bytes]) -> Any:
+        return json.loads(data)
+
+    def dumps(self, obj: Any) -> str:
+        return json.dumps(obj, ensure_ascii=False)
+
+    def dumps_bytes(self, obj: Any) -> bytes:
+        return json.dumps(obj, ensure_ascii=False).encode("utf-8", errors="replace")
+
+
+_stdlib_codec = StdlibJSONCodec()
+
+
+class OrjsonCodec(JSONCodec):
+
+    name = "orjson"
+
+    def __init__(self) -> None:
+        import orjson
+        self.__orjson = orjson
+        self.__options = orjson.OPT_NON_STR_KEYS
+
+    def loads(self, data: Union[str, bytes]) -> Any:
+        return self.__orjson.loads(data)
+
+    def dumps_bytes(self, obj: Any) -> bytes:
+        try:
+            return self.__orjson.dumps(obj, option=self.__options)
+        except TypeError:
+            # Types that orjson does not support, like int over 64 bits, or subclasses of str.
+            return _stdlib_codec.dumps_bytes(obj)
+
+
+class UjsonCodec(JSONCodec):
+
+    name = "ujson"
+
+    def __init__(self) -> None:
+        import ujson
+        self.__ujson = ujson
+
+    def loads(self, data: Union[str, bytes]) -> Any:
+        return self.__ujson.loads(data)
+
+    def dumps(self, obj: Any) -> str:
+        try:
+            return self.__ujson.dumps(obj, ensure_ascii=False)
+        except (TypeError, OverflowError):
+            return _stdlib_codec.dumps(obj)
+
+    def dumps_bytes(self, obj: Any) -> bytes:
+        return self.dumps(obj).encode("utf-8", errors="replace")
+
+
+class MsgspecCodec(JSONCodec):
+
+    name = "msgspec"
+
+    def __init__(self) -> None:
+        import msgspec
+        # `msgspec.DecodeError` is not a `ValueError`.
+        self.decode_error = (msgspec.DecodeError, ValueError)
+        self.__encoder = msgspec.json.Encoder()
+        self.__decoder = msgspec.json.Decoder()
+
+    def loads(self, data: Union[str, bytes]) -> Any:
+        return self.__decoder.decode(data)
+
+    def dumps_bytes(self, obj: Any) -> bytes:
+        try:
+            return self.__encoder.encode(obj)
+        except (TypeError, OverflowError):
+            return _stdlib_codec.dumps_bytes(obj)
+
+
+# name -> factory, the auto selecting order is the order of registration.
+_codec_factories: Dict[str, Callable[[], JSONCodec]] = {
+    OrjsonCodec.name: OrjsonCodec,
+    UjsonCodec.name: UjsonCodec,
+    MsgspecCodec.name: MsgspecCodec,
+    StdlibJSONCodec.name: lambda: _stdlib_codec
+}
+
+_codecs: Dict[str, JSONCodec] = {}
+
+_default_codec: JSONCodec = None
+
+
+def register_json_codec(name: str, factory: Callable[[], JSONCodec]) -> None:
+    """ Register a codec, `factory` should raise `ImportError` if the library it uses is not installed. """
+    _codec_factories[name] = factory
+    _codecs.pop(name, None)
+
+
+def json_codec_names() -> List[str]:
+    return list(_codec_factories.keys())
+
+
+def get_json_codec(name: str = "") -> JSONCodec:
+    """
+    " Get the codec by name. If name is not given, the first one whose library is installed
+    " is returned, in the order of orjson, ujson, msgspec and the standard library json.
+    """
+    if not name:
+        global _default_codec
+        if _default_codec is None:
+            _default_codec = _auto_select()
+        return _default_codec
+    if name not in _codecs:
+        if name not in _codec_factories:
+            raise ValueError(f"JSON codec [{name}] is not registered. ")
+        _codecs[name] = _codec_factories[name]()
+    return _codecs[name]
+
+
+def _auto_select() -> JSONCodec:
+    for name in _codec_factories.keys():
+        try:
+            codec = get_json_codec(name)
+            _logger.debug(f"Use JSON codec: {name}")
+            return codec
+        except ImportError:
+            continue
+    return _stdlib_codec
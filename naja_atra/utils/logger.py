@@ -24,11 +24,12 @@ SOFTWARE.
 
 from abc import abstractmethod
 import sys
-import time
+import atexit
+import traceback
 import logging
-import asyncio
-from threading import Thread
-from typing import Dict, List, Tuple
+from collections import deque
+from threading import Condition, Event, Lock, Thread, current_thread
+from typing import Deque, Dict, List, Tuple
 
 
 class LazyCalledLogger(logging.Logger):
@@ -42,53 +43,118 @@ class LazyCalledLogger(logging.Logger):
 
 
 class LazyCalledLoggerThread:
+    """
+    " Hand the log records over to a background thread, which calls the handlers in batches.
+    "
+    " The records are appended to a bounded deque without any lock, and the thread is only woken up
+    " when it is waiting. When the queue is full, the new records are dropped and counted in
+    " `dropped_records`, or, if `overflow` is "block", the caller waits until there is space again.
+    " Records logged by the handlers in the logger thread itself are always dropped when the queue is full,
+    " because nobody else can make space for them.
+    """
 
     daemon_threads = True
 
-    def __init__(self) -> None:
-        self.coroutine_loop = None
-        self.coroutine_thread = None
+    OVERFLOW_DROP: str = "drop"
 
-    def coroutine_main(self):
-        self.coroutine_loop = loop = asyncio.new_event_loop()
-        try:
-            loop.run_forever()
-        finally:
-            loop.run_until_complete(loop.shutdown_asyncgens())
-            loop.close()
+    OVERFLOW_BLOCK: str = "block"
+
+    def __init__(self, capacity: int = 10000, overflow: str = OVERFLOW_DROP) -> None:
+        self.capacity: int = capacity
+        self.overflow: str = overflow
+        self.__dropped_records: int = 0
+        # Not `__lock`, which is held by `stop` while it waits for the thread that may drop records.
+        self.__dropped_lock: Lock = Lock()
+        self.__records: Deque[Tuple[LazyCalledLogger, logging.LogRecord]] = deque()
+        self.__wakeup: Event = Event()
+        self.__not_full: Condition = Condition()
+        self.__lock: Lock = Lock()
+        self.__running: bool = False
+        self.coroutine_thread: Thread = None
+
+    @property
+    def dropped_records(self) -> int:
+        return self.__dropped_records
+
+    def __main(self):
+        records = self.__records
+        wakeup = self.__wakeup
+        while True:
+            wakeup.wait()
+            wakeup.clear()
+            self.__call_handlers(records)
+            if not self.__running:
+                # Records may be appended while stopping, call them all before exiting.
+                self.__call_handlers(records)
+                return
+
+    def __call_handlers(self, records: Deque[Tuple[LazyCalledLogger, logging.LogRecord]]):
+        while records:
+            logger, record = records.popleft()
+            try:
+                logger.do_call_handlers(record)
+            except Exception:
+                # Keep the thread alive, the errors of emitting records are already handled by the handlers.
+                traceback.print_exc(file=sys.stderr)
+        if self.overflow == self.OVERFLOW_BLOCK:
+            with self.__not_full:
+                self.__not_full.notify_all()
 
     def start(self):
-        if self.coroutine_thread is not None:
-            while not self.coroutine_loop:
-                # wait for the loop ready
-                time.sleep(0.1)
-            return
-        self.coroutine_thread = Thread(target=self.coroutine_main, name="logger-thread", daemon=self.daemon_threads)
-        self.coroutine_thread.start()
-
-        while not self.coroutine_loop:
-            # wait for the loop ready
-            time.sleep(0.1)
+        with self.__lock:
+            if self.coroutine_thread is not None:
+                return
+            self.__running = True
+            self.coroutine_thread = Thread(target=self.__main, name="logger-thread", daemon=self.daemon_threads)
+            self.coroutine_thread.start()
 
     def stop(self):
-        if self.coroutine_loop:
-            self.coroutine_loop.call_soon_threadsafe(self.coroutine_loop.stop)
-            self.coroutine_thread.join()
-            self.coroutine_loop = None
+        """
+        " Stop the thread after all the queued records are passed to the handlers.
+        """
+        with self.__lock:
+            thread = self.coroutine_thread
+            if thread is None:
+                return
+            self.__running = False
+            self.__wakeup.set()
+            thread.join()
             self.coroutine_thread = None
 
-    async def _call(self, logger: LazyCalledLogger, record):
-        logger.do_call_handlers(record)
+    def flush(self):
+        """
+        " Pass all the queued records to the handlers, the thread will be started again when a new record comes.
+        """
+        self.stop()
 
     def call_logger_handler(self, logger: LazyCalledLogger, record):
-        self.start()
-        asyncio.run_coroutine_threadsafe(self._call(logger, record), self.coroutine_loop)
+        if self.coroutine_thread is None:
+            self.start()
+        records = self.__records
+        if len(records) >= self.capacity:
+            if self.overflow != self.OVERFLOW_BLOCK or self.coroutine_thread is None \
+                    or current_thread() is self.coroutine_thread:
+                with self.__dropped_lock:
+                    self.__dropped_records += 1
+                return
+            with self.__not_full:
+                while len(records) >= self.capacity and self.__running:
+                    self.__wakeup.set()
+                    self.__not_full.wait(0.1)
+        records.append((logger, record))
+        if not self.__wakeup.is_set():
+            self.__wakeup.set()
 
 
 class CachingLogger(LazyCalledLogger):
 
     logger_thread: LazyCalledLoggerThread = LazyCalledLoggerThread()
 
+    def setLevel(self, level):
+        super().setLevel(level)
+        # The logger is not registered to the logging manager, its cache of `isEnabledFor` is not cleared there.
+        self._cache.clear()
+
     def callHandlers(self, record):
         CachingLogger.logger_thread.call_logger_handler(self, record)
 
@@ -195,3 +261,26 @@ def set_handler(handler: logging.Handler) -> None:
 
 def get_logger(tag: str = "naja_atra", factory: str = "") -> logging.Logger:
     return get_logger_factory(factory).get_logger(tag)
+
+
+def set_queue(capacity: int = 10000, overflow: str = LazyCalledLoggerThread.OVERFLOW_DROP) -> None:
+    """
+    " Set how many records can be waiting for the logger thread, and what to do when the queue is full:
+    " "drop" the new records, or "block" the callers until there is space.
+    """
+    assert capacity > 0, "The capacity of the logger queue must be greater than 0."
+    assert overflow in (LazyCalledLoggerThread.OVERFLOW_DROP, LazyCalledLoggerThread.OVERFLOW_BLOCK), \
+        f"Overflow policy of the logger queue must be one of 'drop' and 'block', but '{overflow}' is given."
+    CachingLogger.logger_thread.capacity = capacity
+    CachingLogger.logger_thread.overflow = overflow
+
+
+def dropped_records() -> int:
+    return CachingLogger.logger_thread.dropped_records
+
+
+def flush() -> None:
+    CachingLogger.logger_thread.flush()
+
+
+atexit.register(flush)
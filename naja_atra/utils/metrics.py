@@ -0,0 +1,348 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (c) 2018 Keijack Wu
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import itertools
+import threading
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Tuple
+
+from ..models import Response
+from .logger import get_logger
+
+
+_logger = get_logger("naja_atra.utils.metrics")
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+DEFAULT_BUCKETS: Tuple[float] = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Values are kept in this many stripes, each thread always records to the same one, so the threads
+# seldom wait for each other. The stripes are summed up when the metrics are collected.
+_STRIPES = 16
+
+_stripe_local = threading.local()
+
+_stripe_counter = itertools.count()
+
+
+def _new_stripe_index() -> int:
+    _stripe_local.index = index = next(_stripe_counter) % _STRIPES
+    return index
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+def _escape_label_value(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Tuple[str], values: Tuple, extra: str = "") -> str:
+    items = [f'{name}="{_escape_label_value(value)}"' for name, value in zip(names, values)]
+    if extra:
+        items.append(extra)
+    return "{" + ",".join(items) + "}" if items else ""
+
+
+class Metric:
+
+    type: str = "untyped"
+
+    def __init__(self, name: str, help: str = "", labelnames: Tuple[str] = ()) -> None:
+        self.name: str = name
+        self.help: str = help
+        self.labelnames: Tuple[str] = tuple(labelnames)
+
+    def _samples(self) -> List[str]:
+        return []
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        lines.extend(self._samples())
+        return "\n".join(lines) + "\n"
+
+
+class Counter(Metric):
+    """
+    " A value that only goes up, `labels` is a tuple of the label values in the order of `labelnames`.
+    """
+
+    type: str = "counter"
+
+    def __init__(self, name: str, help: str = "", labelnames: Tuple[str] = ()) -> None:
+        super().__init__(name, help, labelnames)
+        self._stripes: List[Tuple[threading.Lock, Dict[Tuple, float]]] = [(threading.Lock(), {}) for _ in range(_STRIPES)]
+        if not self.labelnames:
+            # Exposed as 0 before anything is recorded.
+            self._stripes[0][1][()] = 0
+
+    def inc(self, labels: Tuple = (), amount: float = 1) -> None:
+        # The lookups are inlined and the lock is not used as a context manager, this is on the request path.
+        try:
+            index = _stripe_local.index
+        except AttributeError:
+            index = _new_stripe_index()
+        lock, values = self._stripes[index]
+        lock.acquire()
+        values[labels] = values.get(labels, 0) + amount
+        lock.release()
+
+    def values(self) -> Dict[Tuple, float]:
+        total: Dict[Tuple, float] = {}
+        for lock, values in self._stripes:
+            with lock:
+                items = list(values.items())
+            for labels, value in items:
+                total[labels] = total.get(labels, 0) + value
+        return total
+
+    def value(self, labels: Tuple = ()) -> float:
+        return self.values().get(labels, 0)
+
+    def _samples(self) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+                for labels, value in sorted(self.values().items())]
+
+
+class Gauge(Counter):
+    """
+    " A value that goes up and down, or that is read by `function` when collected.
+    """
+
+    type: str = "gauge"
+
+    def __init__(self, name: str, help: str = "", labelnames: Tuple[str] = (), function: Callable[[], float] = None) -> None:
+        super().__init__(name, help, labelnames)
+        self.function: Callable[[], float] = function
+
+    def dec(self, labels: Tuple = (), amount: float = 1) -> None:
+        self.inc(labels, -amount)
+
+    def values(self) -> Dict[Tuple, float]:
+        if self.function is None:
+            return super().values()
+        try:
+            return {(): self.function()}
+        except Exception:
+            _logger.exception(f"Cannot read the value of gauge {self.name}.")
+            return {}
+
+
+class Histogram(Metric):
+    """
+    " Observations counted in buckets, the bucket of a value is found by a binary search of the upper bounds.
+    """
+
+    type: str = "histogram"
+
+    def __init__(self, name: str, help: str = "", labelnames: Tuple[str] = (), buckets: Tuple[float] = DEFAULT_BUCKETS) -> None:
+        super().__init__(name, help, labelnames)
+        self.buckets: Tuple[float] = tuple(sorted(buckets))
+        # labels => [count of each bucket..., count of +Inf, sum]
+        self._stripes: List[Tuple[threading.Lock, Dict[Tuple, List[float]]]] = [(threading.Lock(), {}) for _ in range(_STRIPES)]
+
+    def observe(self, value: float, labels: Tuple = ()) -> None:
+        idx = bisect_left(self.buckets, value)
+        try:
+            index = _stripe_local.index
+        except AttributeError:
+            index = _new_stripe_index()
+        lock, values = self._stripes[index]
+        lock.acquire()
+        counts = values.get(labels)
+        if counts is None:
+            counts = values[labels] = [0] * (len(self.buckets) + 2)
+        counts[idx] += 1
+        counts[-1] += value
+        lock.release()
+
+    def values(self) -> Dict[Tuple, List[float]]:
+        total: Dict[Tuple, List[float]] = {}
+        for lock, values in self._stripes:
+            with lock:
+                items = [(labels, list(counts)) for labels, counts in values.items()]
+            for labels, counts in items:
+                if labels in total:
+                    total[labels] = [a + b for a, b in zip(total[labels], counts)]
+                else:
+                    total[labels] = counts
+        return total
+
+    def _samples(self) -> List[str]:
+        lines = []
+        for labels, counts in sorted(self.values().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = f'le="{_format_value(float(bound))}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+            label_str = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{label_str} {_format_value(counts[-1])}")
+            lines.append(f"{self.name}_count{label_str} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+
+    def __init__(self) -> None:
+        self.__metrics: Dict[str, Metric] = {}
+        self.__lock: threading.Lock = threading.Lock()
+
+    def register(self, metric: Metric) -> Metric:
+        with self.__lock:
+            assert metric.name not in self.__metrics, f"Metric {metric.name} is already registered."
+            self.__metrics[metric.name] = metric
+        return metric
+
+    def get(self, name: str) -> Metric:
+        return self.__metrics.get(name)
+
+    def counter(self, name: str, help: str = "", labelnames: Tuple[str] = ()) -> Counter:
+        return self.register(Counter(name, help, labelnames))
+
+    def gauge(self, name: str, help: str = "", labelnames: Tuple[str] = (), function: Callable[[], float] = None) -> Gauge:
+        return self.register(Gauge(name, help, labelnames, function))
+
+    def histogram(self, name: str, help: str = "", labelnames: Tuple[str] = (), buckets: Tuple[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def render(self) -> str:
+        """
+        " All the metrics in the Prometheus text format.
+        """
+        with self.__lock:
+            metrics = list(self.__metrics.values())
+        return "".join([m.render() for m in metrics])
+
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+
+    registry: MetricsRegistry = None
+
+    def do_GET(self):
+        body = self.registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        _logger.debug(format, *args)
+
+
+class Metrics(MetricsRegistry):
+    """
+    " The metrics of a server, pass it to `server.start(metrics=...)` to record them.
+    "
+    " - path: serve the metrics in the Prometheus text format at this path of the server, None not to serve them there.
+    " - port, host: also serve the metrics in a separate http server listening to this port.
+    " - buckets: the upper bounds (in seconds) of the buckets of the request latency histogram.
+    "
+    " You can also register your own metrics by `counter`, `gauge` and `histogram`, they are served together.
+    """
+
+    def __init__(self, path: str = "/metrics", port: int = None, host: str = "", buckets: Tuple[float] = DEFAULT_BUCKETS) -> None:
+        super().__init__()
+        self.path: str = path
+        self.port: int = port
+        self.host: str = host
+        self.__http_server: ThreadingHTTPServer = None
+
+        self.requests: Counter = self.counter(
+            "naja_atra_requests_total", "Requests handled, by route, method and status.", ("route", "method", "status"))
+        self.request_duration: Histogram = self.histogram(
+            "naja_atra_request_duration_seconds", "Time from reading the request line to sending the response.",
+            ("route", "method"), buckets)
+        self.requests_in_flight: Gauge = self.gauge(
+            "naja_atra_requests_in_flight", "Requests being handled.")
+        self.keep_alive_requests: Counter = self.counter(
+            "naja_atra_keep_alive_requests_total", "Requests read from a reused keep-alive connection.")
+        self.received_bytes: Counter = self.counter(
+            "naja_atra_received_bytes_total", "Bytes of the request bodies.")
+        self.sent_bytes: Counter = self.counter(
+            "naja_atra_sent_bytes_total", "Bytes of the response bodies.")
+        self.websocket_sessions: Gauge = self.gauge(
+            "naja_atra_websocket_sessions", "Open websocket sessions.")
+
+    def __bind_gauge(self, name: str, help: str, function: Callable[[], float]) -> None:
+        gauge = self.get(name)
+        if gauge is None:
+            self.gauge(name, help, function=function)
+        else:
+            # The metrics object is passed to a new server.
+            gauge.function = function
+
+    def bind_server(self, server) -> None:
+        """
+        " Add the gauges that are read from the server when collected.
+        """
+        self.__bind_gauge("naja_atra_open_connections", "Open connections.",
+                          lambda: server.open_connections)
+        if hasattr(server, "busy_threads"):
+            self.__bind_gauge("naja_atra_threadpool_busy_threads", "Worker threads handling a connection.",
+                              lambda: server.busy_threads)
+            self.__bind_gauge("naja_atra_threadpool_queued_connections", "Connections waiting for a worker thread.",
+                              lambda: server.queued_connections)
+        if hasattr(server, "write_buffer_size"):
+            self.__bind_gauge("naja_atra_write_buffer_bytes", "Bytes written to the connections but not sent yet.",
+                              lambda: server.write_buffer_size)
+
+    def observe_request(self, route: str, method: str, status: int, latency: float,
+                        received_bytes: int, sent_bytes: int, keep_alive: bool) -> None:
+        self.requests.inc((route, method, status))
+        self.request_duration.observe(latency, (route, method))
+        if received_bytes:
+            self.received_bytes.inc(amount=received_bytes)
+        if sent_bytes:
+            self.sent_bytes.inc(amount=sent_bytes)
+        if keep_alive:
+            self.keep_alive_requests.inc()
+
+    def response(self):
+        """
+        " The controller function of `path`.
+        """
+        return Response(status_code=200, headers={"Content-Type": CONTENT_TYPE}, body=self.render().encode("utf-8"))
+
+    def start_http_server(self) -> None:
+        if not self.port or self.__http_server is not None:
+            return
+        handler_class = type("MetricsRequestHandler", (_MetricsRequestHandler,), {"registry": self})
+        self.__http_server = ThreadingHTTPServer((self.host, self.port), handler_class)
+        self.__http_server.daemon_threads = True
+        threading.Thread(target=self.__http_server.serve_forever, name="metrics-server", daemon=True).start()
+        _logger.info(f"Serve metrics at port {self.port}")
+
+    def stop_http_server(self) -> None:
+        if self.__http_server is not None:
+            self.__http_server.shutdown()
+            self.__http_server.server_close()
+            self.__http_server = None
@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (c) 2018 Keijack Wu
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import os
+import io
+import re
+import hmac
+import time
+import random
+import pstats
+import cProfile
+import threading
+from typing import Any, Coroutine, Dict, List
+
+from ..models import HttpError, Request
+from .logger import get_logger
+
+
+_logger = get_logger("naja_atra.utils.profiling")
+
+
+class _ProfiledCoroutine:
+    """
+    " Drive a coroutine with the profiler enabled only while the coroutine itself runs, so the other
+    " coroutines that run in the same event loop while it is waiting are not profiled.
+    """
+
+    def __init__(self, coro: Coroutine, profile: cProfile.Profile) -> None:
+        self.__coro: Coroutine = coro
+        self.__profile: cProfile.Profile = profile
+
+    def __await__(self):
+        coro = self.__coro
+        profile = self.__profile
+        value = None
+        error: BaseException = None
+        while True:
+            profile.enable()
+            try:
+                if error is None:
+                    future = coro.send(value)
+                else:
+                    future = coro.throw(error)
+            except StopIteration as e:
+                return e.value
+            finally:
+                profile.disable()
+            try:
+                value = yield future
+                error = None
+            except BaseException as e:
+                value = None
+                error = e
+
+
+class RequestProfile:
+    """
+    " The profile of one request, created when the request is to be profiled.
+    """
+
+    __slots__ = ("profile", "inline", "method", "path", "route")
+
+    def __init__(self, inline: bool, method: str, path: str, route: str) -> None:
+        self.profile: cProfile.Profile = cProfile.Profile()
+        self.inline: bool = inline
+        self.method: str = method
+        self.path: str = path
+        self.route: str = route
+
+    def call(self, func, *args, **kwargs) -> Any:
+        return self.profile.runcall(func, *args, **kwargs)
+
+    async def call_async(self, func, *args, **kwargs) -> Any:
+        return await _ProfiledCoroutine(func(*args, **kwargs), self.profile)
+
+    def stats_text(self, sort_by: str = "cumulative", limit: int = 50) -> str:
+        out = io.StringIO()
+        out.write(f"{self.method} {self.path} => {self.route}\n")
+        stats = pstats.Stats(self.profile, stream=out)
+        stats.sort_stats(sort_by).print_stats(limit)
+        return out.getvalue()
+
+
+class RequestProfiler:
+    """
+    " Profile the controllers of some requests with `cProfile`.
+    "
+    " A request is profiled when it carries the `header` with the `secret` as its value, or when it is sampled
+    " by the rate of its route. The rates can be read and changed at `admin_path`, the requests to it must carry
+    " the secret header too:
+    "   GET  /_profiler                         the rates and the recent profile files.
+    "   POST /_profiler?route=/order&rate=0.1   profile 10% of the requests to the route `/order`, rate 0 to stop.
+    "
+    " The stats are dumped to `output_dir` (pstats format, can be read by `pstats` or `snakeviz`), when the value
+    " of the header is `<secret>;inline`, the text of the stats is responded instead of what the controller returns.
+    " Only one request is profiled at a time, the others are not profiled while one is.
+    """
+
+    def __init__(self,
+                 secret: str,
+                 header: str = "X-Naja-Profile",
+                 output_dir: str = "",
+                 route_sample_rates: Dict[str, float] = {},
+                 admin_path: str = "/_profiler",
+                 max_files: int = 100) -> None:
+        assert secret, "A secret must be given to profile the requests."
+        self.secret: str = secret
+        self.header: str = header
+        self.output_dir: str = output_dir
+        self.route_sample_rates: Dict[str, float] = dict(route_sample_rates)
+        self.admin_path: str = admin_path
+        self.max_files: int = max_files
+        self.__lock: threading.Lock = threading.Lock()
+        self.__files: List[str] = []
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+
+    def __is_trusted(self, value: str) -> bool:
+        return hmac.compare_digest(value.encode("utf-8", errors="replace"), self.secret.encode("utf-8"))
+
+    def start(self, method: str, path: str, route: str, headers) -> RequestProfile:
+        """
+        " Return a profile if the request is to be profiled, or None.
+        """
+        header_value = headers.get(self.header)
+        inline = False
+        if header_value is not None:
+            secret, _, option = header_value.partition(";")
+            if not self.__is_trusted(secret.strip()):
+                return None
+            inline = option.strip() == "inline"
+        else:
+            rate = self.route_sample_rates.get(route) if self.route_sample_rates else None
+            if not rate or random.random() >= rate:
+                return None
+        if not inline and not self.output_dir:
+            return None
+        # cProfile cannot profile two requests at the same time in one thread (and in newer Python, in one process).
+        if not self.__lock.acquire(blocking=False):
+            _logger.debug("Another request is being profiled, skip %s %s", method, path)
+            return None
+        return RequestProfile(inline, method, path, route)
+
+    def finish(self, profile: RequestProfile) -> None:
+        try:
+            if self.output_dir:
+                self.__dump(profile)
+        except Exception:
+            _logger.exception("Cannot write the profile of %s %s", profile.method, profile.path)
+        finally:
+            self.__lock.release()
+
+    def __dump(self, profile: RequestProfile) -> None:
+        name = re.sub(r"[^\w.\-]+", "_", profile.route or profile.path).strip("_") or "root"
+        file_path = os.path.join(self.output_dir, f"{time.strftime('%Y%m%d-%H%M%S')}-{profile.method}-{name}-{id(profile):x}.prof")
+        profile.profile.dump_stats(file_path)
+        _logger.info("Profile of %s %s is written to %s", profile.method, profile.path, file_path)
+        self.__files.append(file_path)
+        while len(self.__files) > self.max_files:
+            old = self.__files.pop(0)
+            try:
+                os.remove(old)
+            except OSError:
+                pass
+
+    def admin(self, request: Request) -> Dict[str, Any]:
+        """
+        " The controller function of `admin_path`.
+        """
+        if not self.__is_trusted(request.headers.get(self.header, "")):
+            raise HttpError(403, "Forbidden")
+        if request.method == "POST":
+            route = request.parameter.get("route", "")
+            try:
+                rate = float(request.parameter.get("rate", "0"))
+            except ValueError:
+                raise HttpError(400, "Bad Request", "The rate should be a number.")
+            if not route or not 0 <= rate <= 1:
+                raise HttpError(400, "Bad Request", "A route and a rate between 0 and 1 are required.")
+            rates = dict(self.route_sample_rates)
+            if rate > 0:
+                rates[route] = rate
+            else:
+                rates.pop(route, None)
+            # Replaced rather than changed, it is read by the other threads without a lock.
+            self.route_sample_rates = rates
+        return {"route_sample_rates": self.route_sample_rates, "files": list(self.__files)}
@@ -0,0 +1,313 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (c) 2018 Keijack Wu
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import os
+import sys
+import hmac
+import time
+import asyncio
+import threading
+from types import CodeType, FrameType
+from typing import Any, Dict, List, Set, Tuple
+
+from ..models import HttpError, Request, Response
+from .logger import get_logger
+
+
+_logger = get_logger("naja_atra.utils.sampling_profiler")
+
+VIEW_THREADS = "threads"
+
+VIEW_TASKS = "tasks"
+
+FORMAT_SPEEDSCOPE = "speedscope"
+
+FORMAT_COLLAPSED = "collapsed"
+
+# The stacks that are not kept any more when the table is full are counted to this one.
+_TRUNCATED: Tuple[CodeType] = ()
+
+# The frames where the threads wait for a lock, a queue or a socket, the stacks that end in them are idle.
+IDLE_FUNCTIONS: Set[Tuple[str, str]] = {
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("selectors.py", "select"),
+    ("queue.py", "get"),
+    ("thread.py", "_worker"),
+    ("socket.py", "readinto"),
+}
+
+
+class _StackTable:
+    """
+    " Count the stacks, a stack is a tuple of code objects from the root to the leaf. The size is bounded,
+    " the stacks that come after it is full are counted as one truncated stack.
+    """
+
+    def __init__(self, max_stacks: int) -> None:
+        self.max_stacks: int = max_stacks
+        self.counts: Dict[Tuple[CodeType], int] = {}
+        self.samples: int = 0
+
+    def add(self, stack: Tuple[CodeType]) -> None:
+        counts = self.counts
+        if stack in counts:
+            counts[stack] += 1
+        elif len(counts) < self.max_stacks:
+            counts[stack] = 1
+        else:
+            counts[_TRUNCATED] = counts.get(_TRUNCATED, 0) + 1
+        self.samples += 1
+
+
+def _frame_name(code: CodeType) -> str:
+    if code is None:
+        return "[truncated]"
+    return f"{getattr(code, 'co_qualname', code.co_name)} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    """
+    " Sample the stacks of all the threads in a background thread, to show where the time of the whole process goes.
+    "
+    " - interval: the seconds between two samples, 0.01 is 100 samples a second.
+    " - max_stacks: the count of different stacks that are kept, the later ones are counted as `[truncated]`.
+    " - max_depth: the frames deeper than this are dropped from the root side of the stacks.
+    " - include_idle: whether to count the stacks of the threads that are waiting in `IDLE_FUNCTIONS`.
+    " - path: the stacks are exported here, as `?format=speedscope` (default, open it in https://www.speedscope.app)
+    "         or `?format=collapsed` (for flamegraph.pl), `?view=tasks` exports the await stacks of the coroutine
+    "         tasks in the coroutine mode, and `?reset=true` clears the stacks after exporting. It is
+    "         `/_sampling_profiler` by default if the secret is given, the stacks are not exported without a secret.
+    " - secret, header: the requests to `path` must carry the secret in the header.
+    """
+
+    def __init__(self,
+                 interval: float = 0.01,
+                 max_stacks: int = 10000,
+                 max_depth: int = 128,
+                 include_idle: bool = False,
+                 path: str = None,
+                 secret: str = "",
+                 header: str = "X-Naja-Profile") -> None:
+        assert interval > 0, "interval must be larger than 0."
+        # The stacks show the code of the whole process, they should never be exported to everyone.
+        assert secret or not path, "A secret must be given to export the stacks at the path."
+        self.interval: float = interval
+        self.max_stacks: int = max_stacks
+        self.max_depth: int = max_depth
+        self.include_idle: bool = include_idle
+        self.path: str = (path if path is not None else "/_sampling_profiler") if secret else ""
+        self.secret: str = secret
+        self.header: str = header
+        self.__lock: threading.Lock = threading.Lock()
+        self.__threads: _StackTable = _StackTable(max_stacks)
+        self.__tasks: _StackTable = _StackTable(max_stacks)
+        self.__started_time: float = time.time()
+        self.__sampling_time: float = 0
+        self.__stopped: threading.Event = threading.Event()
+        self.__thread: threading.Thread = None
+        self.__server = None
+        self.__idle_codes: Dict[CodeType, bool] = {}
+
+    def bind_server(self, server) -> None:
+        """
+        " The await stacks of the tasks are sampled from the event loop of the server in the coroutine mode.
+        """
+        self.__server = server
+
+    @property
+    def sampling_time(self) -> float:
+        """ The seconds spent in sampling, to tell the overhead. """
+        return self.__sampling_time
+
+    def start(self) -> None:
+        if self.__thread is not None:
+            return
+        self.__stopped.clear()
+        self.__thread = threading.Thread(target=self.__run, name="sampling-profiler", daemon=True)
+        self.__thread.start()
+
+    def stop(self) -> None:
+        self.__stopped.set()
+        if self.__thread is not None:
+            self.__thread.join()
+            self.__thread = None
+
+    def __run(self) -> None:
+        my_id = threading.get_ident()
+        while not self.__stopped.wait(self.interval):
+            begin = time.perf_counter()
+            try:
+                self.sample(my_id)
+            except Exception:
+                _logger.exception("Cannot sample the stacks.")
+            self.__sampling_time += time.perf_counter() - begin
+
+    def __stack_of(self, frame: FrameType) -> Tuple[CodeType]:
+        codes: List[CodeType] = []
+        max_depth = self.max_depth
+        while frame is not None and len(codes) < max_depth:
+            codes.append(frame.f_code)
+            frame = frame.f_back
+        codes.reverse()
+        return tuple(codes)
+
+    def __is_idle(self, code: CodeType) -> bool:
+        idle = self.__idle_codes.get(code)
+        if idle is None:
+            idle = self.__idle_codes[code] = (os.path.basename(code.co_filename), code.co_name) in IDLE_FUNCTIONS
+        return idle
+
+    def sample(self, skip_thread: int = None) -> None:
+        """
+        " Take one sample of all the threads (and the tasks), it is called by the background thread.
+        """
+        include_idle = self.include_idle
+        stacks: List[Tuple[CodeType]] = []
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == skip_thread:
+                continue
+            if not include_idle and self.__is_idle(frame.f_code):
+                continue
+            stacks.append(self.__stack_of(frame))
+        task_stacks = self.__sample_tasks()
+        with self.__lock:
+            for stack in stacks:
+                self.__threads.add(stack)
+            for stack in task_stacks:
+                self.__tasks.add(stack)
+
+    def __sample_tasks(self) -> List[Tuple[CodeType]]:
+        loop: asyncio.AbstractEventLoop = getattr(self.__server, "event_loop", None)
+        if loop is None or loop.is_closed():
+            return []
+        stacks: List[Tuple[CodeType]] = []
+        try:
+            tasks = asyncio.all_tasks(loop)
+        except RuntimeError:
+            # The tasks are changed by the loop thread while they are being copied.
+            return stacks
+        for task in tasks:
+            codes: List[CodeType] = []
+            # `Task.get_coro` is added in Python 3.8.
+            coro = task.get_coro() if hasattr(task, "get_coro") else getattr(task, "_coro", None)
+            # Follow what each coroutine is awaiting, from the task to the innermost one.
+            while coro is not None and len(codes) < self.max_depth:
+                code = getattr(coro, "cr_code", None) or getattr(coro, "gi_code", None)
+                if code is None:
+                    break
+                codes.append(code)
+                coro = getattr(coro, "cr_await", None) or getattr(coro, "gi_yieldfrom", None)
+            if codes:
+                stacks.append(tuple(codes))
+        return stacks
+
+    def snapshot(self, view: str = VIEW_THREADS, reset: bool = False) -> Tuple[Dict[Tuple[CodeType], int], int]:
+        """
+        " Return a copy of the stack counts and the count of the samples.
+        """
+        with self.__lock:
+            table = self.__tasks if view == VIEW_TASKS else self.__threads
+            counts, samples = dict(table.counts), table.samples
+            if reset:
+                self.__threads = _StackTable(self.max_stacks)
+                self.__tasks = _StackTable(self.max_stacks)
+                self.__started_time = time.time()
+        return counts, samples
+
+    def collapsed(self, view: str = VIEW_THREADS, reset: bool = False) -> str:
+        """
+        " The stacks in the collapsed format of flamegraph.pl, "root;caller;leaf count" in each line.
+        """
+        counts, _ = self.snapshot(view, reset)
+        names: Dict[CodeType, str] = {}
+        lines = []
+        for stack, count in counts.items():
+            parts = []
+            for code in stack or (None, ):
+                name = names.get(code)
+                if name is None:
+                    name = names[code] = _frame_name(code).replace(";", ":")
+                parts.append(name)
+            lines.append(f"{';'.join(parts)} {count}\n")
+        return "".join(lines)
+
+    def speedscope(self, view: str = VIEW_THREADS, reset: bool = False) -> Dict[str, Any]:
+        """
+        " The stacks in the file format of speedscope, as a sampled profile weighted by the counts.
+        """
+        started_time = self.__started_time
+        counts, samples = self.snapshot(view, reset)
+        frames: List[Dict[str, Any]] = []
+        indexes: Dict[CodeType, int] = {}
+        stacks: List[List[int]] = []
+        weights: List[int] = []
+        for stack, count in counts.items():
+            stack_indexes = []
+            for code in stack or (None, ):
+                idx = indexes.get(code)
+                if idx is None:
+                    idx = indexes[code] = len(frames)
+                    frame = {"name": _frame_name(code)}
+                    if code is not None:
+                        frame["file"] = code.co_filename
+                        frame["line"] = code.co_firstlineno
+                    frames.append(frame)
+                stack_indexes.append(idx)
+            stacks.append(stack_indexes)
+            weights.append(count)
+        name = f"naja_atra {view} ({samples} samples every {self.interval}s since {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(started_time))})"
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": name,
+            "exporter": "naja_atra",
+            "shared": {"frames": frames},
+            "profiles": [{
+                "type": "sampled",
+                "name": name,
+                "unit": "none",
+                "startValue": 0,
+                "endValue": sum(weights),
+                "samples": stacks,
+                "weights": weights
+            }]
+        }
+
+    def response(self, request: Request):
+        """
+        " The controller function of `path`.
+        """
+        if not self.secret or not hmac.compare_digest(request.headers.get(self.header, "").encode("utf-8", errors="replace"),
+                                                   self.secret.encode("utf-8")):
+            raise HttpError(403, "Forbidden")
+        view = request.parameter.get("view", VIEW_THREADS)
+        fmt = request.parameter.get("format", FORMAT_SPEEDSCOPE)
+        reset = request.parameter.get("reset", "false").lower() in ("true", "1")
+        if view not in (VIEW_THREADS, VIEW_TASKS) or fmt not in (FORMAT_SPEEDSCOPE, FORMAT_COLLAPSED):
+            raise HttpError(400, "Bad Request", f"view should be {VIEW_THREADS} or {VIEW_TASKS}, "
+                            f"format should be {FORMAT_SPEEDSCOPE} or {FORMAT_COLLAPSED}.")
+        if fmt == FORMAT_COLLAPSED:
+            return Response(status_code=200, headers={"Content-Type": "text/plain; charset=utf-8"},
+                            body=self.collapsed(view, reset))
+        return self.speedscope(view, reset)
@@ -0,0 +1,412 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (c) 2018 Keijack Wu
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+
+import dataclasses
+import threading
+import typing
+from typing import Any, Callable, Dict, List, Tuple
+
+from .logger import get_logger
+
+try:
+    import typing_extensions
+except ImportError:
+    typing_extensions = None
+
+_logger = get_logger("naja_atra.utils.type_converter")
+
+_NONE_TYPE = type(None)
+
+# `typing.Literal` is added in Python 3.8, `typing_extensions` provides it for the earlier versions.
+_LITERAL_ORIGINS = tuple([lit for lit in (getattr(typing, "Literal", None), getattr(typing_extensions, "Literal", None))
+                          if lit is not None])
+
+_TRUE_STRS = ("1", "true", "yes", "on")
+_FALSE_STRS = ("0", "false", "no", "off", "")
+
+
+class ConversionError(Exception):
+    """
+    " Raised when a value cannot be converted to the target type, `errors` contains a list
+    " of (field path, message) of all the fields that failed.
+    """
+
+    def __init__(self, errors: List[Tuple[str, str]]) -> None:
+        super().__init__("; ".join([f"{path}: {msg}" for path, msg in errors]))
+        self.errors: List[Tuple[str, str]] = errors
+
+
+def is_typed_dict(tp) -> bool:
+    return isinstance(tp, type) and issubclass(tp, dict) and hasattr(tp, "__total__") and hasattr(tp, "__annotations__")
+
+
+def is_named_tuple(tp) -> bool:
+    return isinstance(tp, type) and issubclass(tp, tuple) and hasattr(tp, "_fields") and hasattr(tp, "__annotations__")
+
+
+def is_structured_type(tp) -> bool:
+    """ Whether the type is a dataclass, a TypedDict or a NamedTuple. """
+    return (isinstance(tp, type) and dataclasses.is_dataclass(tp)) or is_typed_dict(tp) or is_named_tuple(tp)
+
+
+class _Converter:
+    """
+    " A compiled converter of one type. `convert` appends the errors it meets to `errors` and
+    " returns None instead of raising, so all the failed fields of a body are reported at once.
+    """
+
+    def __init__(self) -> None:
+        self.convert: Callable[[Any, str, List[Tuple[str, str]]], Any] = None
+
+    def __call__(self, value: Any) -> Any:
+        errors: List[Tuple[str, str]] = []
+        res = self.convert(value, "$", errors)
+        if errors:
+            raise ConversionError(errors)
+        return res
+
+
+# The compiled converters, read without the lock.
+_converters: Dict[Any, _Converter] = {}
+# The converters being compiled by the thread that holds the lock, recursive types find themselves here.
+_compiling: Dict[Any, _Converter] = {}
+_converters_lock = threading.RLock()
+
+
+def get_converter(tp) -> Callable[[Any], Any]:
+    """
+    " Get the converter of the type, the converter is compiled when this function is called the first time.
+    " The returned function raises a `ConversionError` if the value cannot be converted.
+    """
+    return _get_converter(tp)
+
+
+def convert(value: Any, tp) -> Any:
+    return get_converter(tp)(value)
+
+
+def _get_converter(tp) -> _Converter:
+    converter = _converters.get(tp)
+    if converter is not None:
+        return converter
+    with _converters_lock:
+        converter = _converters.get(tp) or _compiling.get(tp)
+        if converter is not None:
+            return converter
+        outermost = not _compiling
+        converter = _Converter()
+        _compiling[tp] = converter
+        try:
+            converter.convert = _compile(tp)
+        except:
+            if outermost:
+                _compiling.clear()
+            else:
+                del _compiling[tp]
+            raise
+        _logger.debug(f"Compile converter for type {tp}")
+        if outermost:
+            # Publish them together, a converter may refer to the ones compiled after it, e.g. in recursive types.
+            _converters.update(_compiling)
+            _compiling.clear()
+        return converter
+
+
+def _get_origin(tp):
+    # `typing.get_origin` and `typing.get_args` are added in Python 3.8.
+    return getattr(tp, "__origin__", None)
+
+
+def _get_args(tp) -> Tuple:
+    if getattr(tp, "_special", False):
+        # Bare `List`, `Dict` etc. in Python 3.7 and 3.8, whose `__args__` are type variables.
+        return ()
+    return getattr(tp, "__args__", None) or ()
+
+
+def _compile(tp) -> Callable[[Any, str, List[Tuple[str, str]]], Any]:
+    if tp is Any or tp is object:
+        return lambda v, path, errors: v
+    if tp is _NONE_TYPE or tp is None:
+        return _compile_none()
+    if tp is bool:
+        return _convert_bool
+    if tp is int:
+        return _convert_int
+    if tp is float:
+        return _convert_float
+    if tp is str:
+        return _convert_str
+    if isinstance(tp, type) and dataclasses.is_dataclass(tp):
+        return _compile_dataclass(tp)
+    if is_typed_dict(tp):
+        return _compile_typed_dict(tp)
+    if is_named_tuple(tp):
+        return _compile_named_tuple(tp)
+
+    origin = _get_origin(tp)
+    args = _get_args(tp)
+    if origin is typing.Union:
+        return _compile_union(args)
+    if origin in (list, set, frozenset) or tp in (list, set, frozenset):
+        return _compile_list(origin or tp, args[0] if args else Any)
+    if origin is tuple or tp is tuple:
+        return _compile_tuple(args)
+    if origin is dict or tp is dict:
+        return _compile_dict(args[0] if args else Any, args[1] if args else Any)
+    if origin is not None and origin in _LITERAL_ORIGINS:
+        return _compile_literal(args)
+    if isinstance(tp, type):
+        return _compile_instance(tp)
+    raise TypeError(f"Type {tp} is not supported to convert. ")
+
+
+def _compile_none():
+    def convert(v, path, errors):
+        if v is not None:
+            errors.append((path, "should be null"))
+        return None
+    return convert
+
+
+def _convert_bool(v, path, errors):
+    if isinstance(v, bool):
+        return v
+    if isinstance(v, int):
+        return v != 0
+    if isinstance(v, str):
+        lv = v.lower()
+        if lv in _TRUE_STRS:
+            return True
+        if lv in _FALSE_STRS:
+            return False
+    errors.append((path, "should be a boolean"))
+    return None
+
+
+def _convert_int(v, path, errors):
+    if isinstance(v, int) and not isinstance(v, bool):
+        return v
+    if isinstance(v, float) and v.is_integer():
+        return int(v)
+    if isinstance(v, str):
+        try:
+            return int(v)
+        except ValueError:
+            pass
+    errors.append((path, "should be an int"))
+    return None
+
+
+def _convert_float(v, path, errors):
+    if isinstance(v, (int, float)) and not isinstance(v, bool):
+        return float(v)
+    if isinstance(v, str):
+        try:
+            return float(v)
+        except ValueError:
+            pass
+    errors.append((path, "should be a float"))
+    return None
+
+
+def _convert_str(v, path, errors):
+    if isinstance(v, str):
+        return v
+    if isinstance(v, (int, float)) and not isinstance(v, bool):
+        return str(v)
+    errors.append((path, "should be a string"))
+    return None
+
+
+def _compile_instance(tp):
+    def convert(v, path, errors):
+        if isinstance(v, tp):
+            return v
+        errors.append((path, f"should be {tp.__name__}"))
+        return None
+    return convert
+
+
+def _compile_literal(values):
+    def convert(v, path, errors):
+        if v in values:
+            return v
+        errors.append((path, f"should be one of {list(values)}"))
+        return None
+    return convert
+
+
+def _compile_union(args):
+    nullable = _NONE_TYPE in args
+    members = [_get_converter(a) for a in args if a is not _NONE_TYPE]
+
+    def convert(v, path, errors):
+        if v is None and nullable:
+            return None
+        first_errors = None
+        for member in members:
+            member_errors = []
+            res = member.convert(v, path, member_errors)
+            if not member_errors:
+                return res
+            if first_errors is None:
+                first_errors = member_errors
+        if first_errors:
+            errors.extend(first_errors)
+        else:
+            errors.append((path, "should not be null"))
+        return None
+    return convert
+
+
+def _compile_list(container, item_type):
+    item = _get_converter(item_type)
+
+    def convert(v, path, errors):
+        if v is None:
+            errors.append((path, "should not be null"))
+            return None
+        if isinstance(v, (str, bytes, dict)) or not hasattr(v, "__iter__"):
+            # A single value, query strings may only have one value of a list.
+            v = [v]
+        res = [item.convert(iv, f"{path}[{idx}]", errors) for idx, iv in enumerate(v)]
+        return res if container is list else container(res)
+    return convert
+
+
+def _compile_tuple(args):
+    if not args or (len(args) == 2 and args[1] is Ellipsis):
+        as_list = _compile_list(list, args[0] if args else Any)
+        return lambda v, path, errors: tuple(as_list(v, path, errors) or ())
+    items = [_get_converter(a) for a in args]
+
+    def convert(v, path, errors):
+        if not isinstance(v, (list, tuple)) or len(v) != len(items):
+            errors.append((path, f"should be an array of {len(items)} items"))
+            return None
+        return tuple([item.convert(iv, f"{path}[{idx}]", errors) for idx, (item, iv) in enumerate(zip(items, v))])
+    return convert
+
+
+def _compile_dict(key_type, val_type):
+    key_conv = _get_converter(key_type)
+    val_conv = _get_converter(val_type)
+
+    def convert(v, path, errors):
+        if not isinstance(v, dict):
+            errors.append((path, "should be an object"))
+            return None
+        return {key_conv.convert(k, f"{path}.{k}", errors): val_conv.convert(iv, f"{path}.{k}", errors) for k, iv in v.items()}
+    return convert
+
+
+def _compile_fields(fields: List[Tuple[str, Any, bool]]):
+    """
+    " fields: list of (name, type, required). Missing optional fields are not put into the returned dict,
+    " so the defaults of the target type are used.
+    """
+    field_convs = [(name, _get_converter(ftype), required) for name, ftype, required in fields]
+
+    def convert_fields(v, path, errors) -> Dict[str, Any]:
+        if not isinstance(v, dict):
+            errors.append((path, "should be an object"))
+            return None
+        values = {}
+        for name, conv, required in field_convs:
+            if name in v:
+                values[name] = conv.convert(v[name], f"{path}.{name}", errors)
+            elif required:
+                errors.append((f"{path}.{name}", "is required"))
+        return values
+    return convert_fields
+
+
+def _type_hints(tp) -> Dict[str, Any]:
+    try:
+        return typing.get_type_hints(tp)
+    except Exception:
+        return getattr(tp, "__annotations__", {})
+
+
+def _construct(tp, values: Dict[str, Any], path: str, errors: List[Tuple[str, str]]):
+    try:
+        return tp(**values)
+    except (TypeError, ValueError) as e:
+        # Validations in `__post_init__` or `__new__`
+        errors.append((path, str(e)))
+        return None
+
+
+def _compile_dataclass(tp):
+    hints = _type_hints(tp)
+    fields = []
+    for f in dataclasses.fields(tp):
+        if not f.init:
+            continue
+        required = f.default is dataclasses.MISSING and f.default_factory is dataclasses.MISSING
+        fields.append((f.name, hints.get(f.name, Any), required))
+    convert_fields = _compile_fields(fields)
+
+    def convert(v, path, errors):
+        if isinstance(v, tp):
+            return v
+        values = convert_fields(v, path, errors)
+        if values is None or errors:
+            return None
+        return _construct(tp, values, path, errors)
+    return convert
+
+
+def _compile_typed_dict(tp):
+    hints = _type_hints(tp)
+    required_keys = getattr(tp, "__required_keys__", set(hints.keys()) if tp.__total__ else set())
+    fields = [(name, ftype, name in required_keys) for name, ftype in hints.items()]
+    convert_fields = _compile_fields(fields)
+
+    def convert(v, path, errors):
+        values = convert_fields(v, path, errors)
+        if values is None:
+            return None
+        return tp(**values)
+    return convert
+
+
+def _compile_named_tuple(tp):
+    hints = _type_hints(tp)
+    defaults = getattr(tp, "_field_defaults", {})
+    fields = [(name, hints.get(name, Any), name not in defaults) for name in tp._fields]
+    convert_fields = _compile_fields(fields)
+
+    def convert(v, path, errors):
+        if isinstance(v, tp):
+            return v
+        if isinstance(v, (list, tuple)):
+            v = dict(zip(tp._fields, v))
+        values = convert_fields(v, path, errors)
+        if values is None or errors:
+            return None
+        return _construct(tp, values, path, errors)
+    return convert
@@ -1,10 +1,12 @@
 # -*- coding: utf-8 -*-
 
 
+import asyncio
 import time
+from json import dumps as json_dumps
 from typing import List, OrderedDict
 
-from naja_atra import BytesBody, FilterContext, ModelDict, Redirect, RegGroup, RequestBodyReader, request_filter
+from naja_atra import BytesBody, SpooledBody, FilterContext, ModelDict, Redirect, RegGroup, RequestBodyReader, request_filter
 from naja_atra import Headers
 from naja_atra import HttpError
 from naja_atra import JSONBody
@@ -21,6 +23,7 @@ from naja_atra import HttpSession
 from naja_atra import request_map, route
 from naja_atra import controller
 from naja_atra import error_message
+from naja_atra import timing_listener
 from naja_atra.app_conf import get_app_conf
 import os
 import naja_atra.utils.logger as logger
@@ -89,6 +92,83 @@ def my_upload(img=MultipartFile("img"), txt=Parameter("中文text", required=Fal
     return f"<!DOCTYPE html><html><body>upload ok! {txt} </body></html>"
 
 
+@request_map("/upload/digest", method="POST")
+def upload_digest(file=MultipartFile("file"), note: str = ""):
+    import hashlib
+    md5 = hashlib.md5()
+    with file.stream as f:
+        data = f.read(1024 * 64)
+        while data:
+            md5.update(data)
+            data = f.read(1024 * 64)
+    return {"filename": file.filename, "size": file.size, "md5": md5.hexdigest(), "note": note}
+
+
+@request_map("/body/spooled", method="POST")
+def spooled_body_digest(body: SpooledBody):
+    import hashlib
+    buf = body.getbuffer()
+    try:
+        md5 = hashlib.md5(buf).hexdigest()
+    finally:
+        buf.release()
+    return {"size": body.size, "spooled": body.is_spooled, "md5": md5}
+
+
+@request_map("/body/limited", method="POST", max_body_size=16)
+def limited_body(body=BytesBody()):
+    return body
+
+
+@request_map("/stream/large")
+async def stream_large(res: Response, size: int = 32):
+    res.add_header("Content-Type", "application/octet-stream")
+    res.add_header("Content-Length", str(size * 1024 * 1024))
+    chunk = b"x" * 1024 * 1024
+    for _ in range(size):
+        res.write_bytes(chunk)
+        await res.drain()
+    res.close()
+
+
+request_timings = {}
+
+
+@timing_listener
+def record_timings(req: Request, durations):
+    if req.path == "/timing":
+        request_timings[req.path] = durations
+
+
+@request_map("/timing")
+def timing_ctrl(name: str = "x"):
+    time.sleep(0.01)
+    return f"hello {name}"
+
+
+def profiled_work(n: int) -> int:
+    return sum(i * i for i in range(n))
+
+
+@request_map("/profile/async")
+async def profile_async_ctrl(n: int = 1000):
+    await asyncio.sleep(0.01)
+    return {"sum": profiled_work(n)}
+
+
+@request_map("/profile/busy")
+def profile_busy_ctrl():
+    until = time.time() + 0.1
+    while time.time() < until:
+        profiled_work(100)
+    return "done"
+
+
+@request_map("/binding/plan")
+def binding_plan_ctrl(name: str, ids: List[int], page: int = 1, tags: List[str] = []):
+    return {"name": name, "ids": ids, "page": page, "tags": tags}
+
+
 @request_map("/post_txt", method=["GET", "POST"])
 def normal_form_post(txt=Parameter("中文txt", required=False, default="DEFAULT"), req=Request(), bd=BytesBody()):
     for k, v in req.parameter.items():
@@ -161,6 +241,12 @@ def header_echo(headers: Headers):
     return 200, headers, ""
 
 
+@request_map("header_multi")
+def header_multi(req: Request, res: Response):
+    res.add_header("X-Tag", req.headers.get_all("x-tag"))
+    return {"tags": req.headers.get_all("X-TAG"), "ua": req.headers["user-agent"]}
+
+
 @request_filter("/abcde/**")
 def fil(ctx: FilterContext):
     print("---------- through filter ---------------")
@@ -189,6 +275,50 @@ async def filter_tuple(ctx: FilterContext):
         ctx.do_chain()
 
 
+@request_filter("/filter/body/**", load_body=True)
+def sync_body_filter(ctx: FilterContext):
+    ctx.response.add_header("X-Filter-Name", str(ctx.request.parameter.get("name")))
+    ctx.response.add_header("X-Filter-Json", json_dumps(ctx.request.json))
+    ctx.do_chain()
+
+
+@request_map("/filter/body/echo", method="POST")
+def filter_body_echo():
+    return "ok"
+
+
+@request_map("/filter/body/spooled", method="POST")
+def filter_body_spooled(body: SpooledBody):
+    return spooled_body_digest(body)
+
+
+@request_filter("/filter/auth/**")
+def auth_filter(ctx: FilterContext):
+    if ctx.request.headers.get("Authorization") != "Bearer token":
+        # Not `send_error`, which always closes the connection.
+        ctx.response.status_code = 401
+        ctx.response.body = "Unauthorized"
+        ctx.response.send_response()
+    else:
+        ctx.do_chain()
+
+
+@request_map("/filter/auth/echo", method="POST")
+def filter_auth_echo(body: BytesBody):
+    return body
+
+
+@request_filter("/filter/attr/**")
+def attr_filter(ctx: FilterContext):
+    ctx.request.user = "bob"
+    ctx.do_chain()
+
+
+@request_map("/filter/attr/echo")
+def filter_attr_echo(request: Request):
+    return {"user": request.user, "attrs": sorted(vars(request))}
+
+
 @request_map("/redirect")
 def redirect():
     return Redirect("/index")
@@ -319,6 +449,21 @@ def params_narrowing2():
     return "a!=b"
 
 
+@route("/param/version")
+def params_version_default():
+    return "default"
+
+
+@route("/param/version", params="v=1")
+def params_version_1():
+    return "v1"
+
+
+@route("/param/version", params="v=2")
+def params_version_2():
+    return "v2"
+
+
 @controller
 @request_map(url="/page", params=("a=b", ))
 class IndexPage:
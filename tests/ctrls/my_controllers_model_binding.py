@@ -1,6 +1,11 @@
 
-from typing import Any
-from naja_atra.request_handlers.model_bindings import ModelBinding
+from dataclasses import dataclass, field
+from typing import Any, List, Optional
+try:
+    from typing import TypedDict
+except ImportError:
+    from typing_extensions import TypedDict
+from naja_atra.request_handlers.model_bindings import ModelBinding, StructuredModelBinding
 from naja_atra import model_binding, default_model_binding
 from naja_atra import HttpError, route
 from naja_atra.utils.logger import get_logger
@@ -57,6 +62,23 @@ class SetAttrModelBinding(ModelBinding):
             return self.default_value
 
 
+class Address(TypedDict):
+    city: str
+    zip_code: int
+
+
+@dataclass
+class Order:
+    item: str
+    count: int = 1
+    tags: List[str] = field(default_factory=list)
+    address: Optional[Address] = None
+
+
+# `SetAttrModelBinding` is the default binding of this app, so the dataclass has to ask for the structured binding.
+model_binding(Order)(StructuredModelBinding)
+
+
 @route("/model_binding/person")
 def test_model_binding(person: Person):
     return {
@@ -71,3 +93,14 @@ def test_model_binding_dog(dog: Dog):
     return {
         "name": dog.wang()
     }
+
+
+@route("/model_binding/order", method="POST")
+def test_model_binding_order(order: Order):
+    return {
+        "item": order.item,
+        "count": order.count,
+        "tags": order.tags,
+        "city": order.address["city"] if order.address else None,
+        "zip_code": order.address["zip_code"] if order.address else None
+    }
@@ -1,19 +1,42 @@
 # coding: utf-8
 
 from gzip import GzipFile
+import io
 import os
+import logging
+import email.utils
 import json
 import websocket
 import unittest
 import urllib.request
 import urllib.error
 import http.client
-from typing import Dict
-from threading import Thread
+import socket
+import tempfile
+import asyncio
+from dataclasses import dataclass
+from typing import Dict, List
+from threading import Event, Thread
+from unittest import mock
 from time import sleep
 
-from naja_atra.utils.logger import get_logger, set_level
+from naja_atra.utils.logger import get_logger, set_level, LoggerFactory, CachingLogger, LazyCalledLoggerThread
 import naja_atra.server as server
+from naja_atra import HttpError, Request, Response
+from naja_atra.models import HttpHeaders
+from naja_atra.app_conf import _ControllerFunction, get_app_conf
+from naja_atra.http_servers.routing_server import RoutingServer
+from naja_atra.request_handlers.http_controller_handler import RequestWrapper, _ParametersView
+from naja_atra.request_handlers.model_bindings import DefaultModelBinding, ModelBinding, ModelBindingConf, ModelBindingPlan, \
+    StructuredModelBinding
+from naja_atra.utils import json_codec
+from naja_atra.utils.json_codec import JSONCodec, StdlibJSONCodec, get_json_codec, json_codec_names, register_json_codec
+from naja_atra.utils import http_utils
+from naja_atra.utils.http_utils import decode_response_body
+from naja_atra.utils.access_log import AccessLog
+from naja_atra.utils.metrics import Metrics
+from naja_atra.utils.profiling import RequestProfiler
+from naja_atra.utils.sampling_profiler import SamplingProfiler
 
 set_level("DEBUG")
 
@@ -33,12 +56,21 @@ class ThreadingServerTest(unittest.TestCase):
         cls.tearDownClass()
         _logger.info("start server in background. ")
         root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        cls.access_log_stream = io.StringIO()
+        cls.profile_dir = tempfile.mkdtemp()
         server.scan(project_dir=root, base_dir="tests/ctrls",
                     regx=r'.*controllers.*')
         server.start(
             port=cls.PORT,
             resources={"/public/*": f"{root}/tests/static"},
             gzip_content_types={"text/plain"},
+            max_in_flight_body_size=1024 * 1024 * 4,
+            access_log=AccessLog(format="json", stream=cls.access_log_stream,
+                                 route_sample_rates={"/exception": 0, "/res/write/bytes": 0}),
+            metrics=Metrics(path="/metrics"),
+            server_timing=True,
+            request_profiler=RequestProfiler(secret="profile-secret", output_dir=cls.profile_dir),
+            sampling_profiler=SamplingProfiler(interval=0.005, secret="sampling-secret"),
             prefer_coroutine=cls.COROUTINE)
 
     @classmethod
@@ -52,6 +84,13 @@ class ThreadingServerTest(unittest.TestCase):
                 f"server is not ready wait. {retry}/{cls.WAIT_COUNT} ")
             if retry >= cls.WAIT_COUNT:
                 raise Exception("Server start wait timeout.")
+        # The server is ready before it listens to the port in coroutine mode.
+        for _ in range(cls.WAIT_COUNT * 10):
+            try:
+                socket.create_connection(("127.0.0.1", cls.PORT)).close()
+                break
+            except ConnectionRefusedError:
+                sleep(0.1)
 
     @classmethod
     def tearDownClass(cls):
@@ -89,10 +128,33 @@ class ThreadingServerTest(unittest.TestCase):
         assert "X-Kj-Abc" in res.headers
         assert res.headers["X-Kj-Abc"] == "my-headers"
 
+    def test_header_multi(self):
+        conn = http.client.HTTPConnection("127.0.0.1", self.PORT)
+        try:
+            conn.putrequest("GET", "/header_multi")
+            conn.putheader("X-Tag", "a")
+            conn.putheader("x-tag", "b")
+            conn.putheader("User-Agent", "test")
+            conn.endheaders()
+            res = conn.getresponse()
+            assert json.loads(res.read()) == {"tags": ["a", "b"], "ua": "test"}
+            assert res.headers.get_all("X-Tag") == ["a", "b"]
+        finally:
+            conn.close()
+
     def test_static(self):
         txt = self.visit("public/a.txt")
         assert txt == "hello world!"
 
+    def test_last_modified(self):
+        root = os.path.dirname(os.path.abspath(__file__))
+        headers = self.visit("public/a.txt", return_type="HEADERS")
+        assert headers["Last-Modified"] == email.utils.formatdate(os.path.getmtime(f"{root}/static/a.txt"), usegmt=True)
+        assert headers["Date"]
+        headers = self.visit("header_echo", return_type="HEADERS")
+        assert "Last-Modified" not in headers
+        assert headers["Server"].startswith("naja-atra/")
+
     def test_gzip(self):
         res: http.client.HTTPResponse = self.visit(
             f"public/a.txt", headers={"Accept-Encoding": "gzip ,deflate"}, return_type="RESPONSE")
@@ -132,12 +194,40 @@ class ThreadingServerTest(unittest.TestCase):
         assert data_dict["code"] == res_dict["code"]
         assert data_dict["msg"] == res_dict["msg"]
 
+    def test_post_malformed_json(self):
+        try:
+            self.visit("post_json", headers={"Content-Type": "application/json"}, data=b'{"code": 0,')
+            assert False, "A malformed JSON body should be rejected."
+        except urllib.error.HTTPError as err:
+            assert err.code == 400
+
     def test_filter(self):
         res: http.client.HTTPResponse = self.visit(
             f"tuple?user_name=kj&pass=wu", return_type="RESPONSE")
         assert "Res-Filter-Header" in res.headers
         assert res.headers["Res-Filter-Header"] == "from-filter"
 
+    def test_filter_reads_body(self):
+        headers = self.visit("filter/body/echo?q=1", headers={"Content-Type": "application/x-www-form-urlencoded"},
+                             data=b"name=bob", return_type="HEADERS")
+        assert headers["X-Filter-Name"] == "bob"
+        assert headers["X-Filter-Json"] == "null"
+        headers = self.visit("filter/body/echo", headers={"Content-Type": "application/json"},
+                             data=json.dumps({"name": "amy"}).encode(), return_type="HEADERS")
+        assert headers["X-Filter-Name"] == "None"
+        assert json.loads(headers["X-Filter-Json"]) == {"name": "amy"}
+
+    def test_filter_sets_request_attribute(self):
+        # Only the attributes set by the filter are not slots.
+        assert self.visit("filter/attr/echo", return_type="JSON") == {"user": "bob", "attrs": ["user"]}
+
+    def test_filter_reads_spooled_body(self):
+        import hashlib
+        content = json.dumps({"name": "amy"}).encode()
+        res = self.visit("filter/body/spooled", headers={"Content-Type": "application/json"},
+                         data=content, return_type="JSON")
+        assert res == {"size": len(content), "spooled": False, "md5": hashlib.md5(content).hexdigest()}
+
     def test_exception(self):
         try:
             self.visit("exception")
@@ -147,6 +237,111 @@ class ThreadingServerTest(unittest.TestCase):
             _logger.info(error_msg)
             assert error_msg == '500-Internal Server Error-some error occurs!'
 
+    def test_access_log(self):
+        self.visit("path_values/a/b/x?q=1", headers={"User-Agent": "access-log-test"})
+        self.visit("res/write/bytes")
+        try:
+            self.visit("exception")
+        except urllib.error.HTTPError as err:
+            assert err.code == 500
+        lines = {}
+        for _ in range(10):
+            # The lines are buffered until the buffer is full or the log is flushed.
+            server._server.server.access_log.flush()
+            lines = {}
+            for line in self.access_log_stream.getvalue().splitlines():
+                record = json.loads(line)
+                lines[record["path"]] = record
+            if "/exception" in lines:
+                break
+            sleep(0.1)
+        record = lines["/path_values/a/b/x?q=1"]
+        assert record["status"] == 200
+        assert record["route"] == "/path_values/{pval}/{path_val}/x"
+        assert record["user_agent"] == "access-log-test"
+        assert record["bytes_sent"] == len(b"<html><body>a, b</body></html>")
+        assert record["latency_ms"] >= 0
+        # Sampled out, but 5xx responses are always logged.
+        assert "/res/write/bytes" not in lines
+        assert lines["/exception"]["status"] == 500
+
+    def test_metrics(self):
+        self.visit("path_values/a/b/x")
+        ws = websocket.WebSocket()
+        ws.connect(f"ws://127.0.0.1:{self.PORT}/ws/metrics")
+        ws.send("hello")
+        ws.recv()
+        res = self.visit("metrics", return_type="RESPONSE")
+        assert res.headers["Content-Type"].startswith("text/plain; version=0.0.4")
+        lines = res.read().decode("utf-8").splitlines()
+        ws.close()
+        assert any([l.startswith('naja_atra_requests_total{route="/path_values/{pval}/{path_val}/x",method="GET",status="200"} ')
+                    for l in lines])
+        assert any([l.startswith('naja_atra_request_duration_seconds_bucket{route="/path_values/{pval}/{path_val}/x",method="GET",le="+Inf"} ')
+                    for l in lines])
+        assert "naja_atra_websocket_sessions 1" in lines
+        assert "naja_atra_requests_in_flight 1" in lines
+        assert any([l.startswith("naja_atra_open_connections ") for l in lines])
+
+    def test_request_profiler(self):
+        txt = self.visit("profile/async?n=100", headers={"X-Naja-Profile": "profile-secret;inline"})
+        assert "GET /profile/async => /profile/async" in txt
+        assert "profiled_work" in txt
+        assert self.visit("profile/async?n=100", headers={"X-Naja-Profile": "wrong;inline"}, return_type="JSON") == {"sum": 328350}
+        try:
+            self.visit("_profiler", headers={"X-Naja-Profile": "wrong"})
+            assert False, "The admin path should require the secret."
+        except urllib.error.HTTPError as err:
+            assert err.code == 403
+        admin = self.visit("_profiler?route=/profile/async&rate=1", headers={"X-Naja-Profile": "profile-secret"},
+                           data=b"", return_type="JSON")
+        assert admin["route_sample_rates"] == {"/profile/async": 1}
+        assert self.visit("profile/async", return_type="JSON") == {"sum": 332833500}
+        self.visit("_profiler?route=/profile/async&rate=0", headers={"X-Naja-Profile": "profile-secret"}, data=b"")
+        admin = self.visit("_profiler", headers={"X-Naja-Profile": "profile-secret"}, return_type="JSON")
+        assert admin["route_sample_rates"] == {}
+        assert len(admin["files"]) >= 1 and os.path.exists(admin["files"][-1])
+
+    def test_sampling_profiler(self):
+        assert self.visit("profile/busy") == "done"
+        secret = {"X-Naja-Profile": "sampling-secret"}
+        for headers in ({}, {"X-Naja-Profile": "wrong"}):
+            try:
+                self.visit("_sampling_profiler", headers=headers)
+                assert False, "The stacks should require the secret."
+            except urllib.error.HTTPError as err:
+                assert err.code == 403
+        collapsed = self.visit("_sampling_profiler?format=collapsed", headers=secret)
+        assert "profile_busy_ctrl (my_controllers.py:" in collapsed
+        assert all([line.rsplit(" ", 1)[1].isdigit() for line in collapsed.splitlines()])
+        tasks = self.visit("_sampling_profiler?format=collapsed&view=tasks", headers=secret)
+        if self.COROUTINE:
+            # The class name is in the frame name only from Python 3.11, which has `co_qualname`.
+            assert "start_async (coroutine_http_server.py:" in tasks
+        else:
+            assert tasks == ""
+        speedscope = self.visit("_sampling_profiler?reset=true", headers=secret, return_type="JSON")
+        profile = speedscope["profiles"][0]
+        assert profile["type"] == "sampled" and len(profile["samples"]) == len(profile["weights"])
+        assert any([f["name"].startswith("profile_busy_ctrl ") for f in speedscope["shared"]["frames"]])
+
+    def test_server_timing(self):
+        headers = self.visit("timing?name=t", return_type="HEADERS")
+        server_timing = {}
+        for item in headers["Server-Timing"].split(","):
+            phase, dur = item.strip().split(";dur=")
+            server_timing[phase] = float(dur)
+        assert list(server_timing.keys()) == ["parse", "route", "filters", "bind", "controller"]
+        assert server_timing["controller"] >= 10
+        from tests.ctrls.my_controllers import request_timings
+        for _ in range(10):
+            if "/timing" in request_timings:
+                break
+            sleep(0.1)
+        durations = request_timings.pop("/timing")
+        assert list(durations.keys()) == ["parse", "route", "filters", "bind", "controller", "write"]
+        assert all([d >= 0 for d in durations.values()])
+
     def test_res_write_bytes(self):
         body = self.visit("res/write/bytes")
         assert body == 'abcdefg'
@@ -218,6 +413,33 @@ class ThreadingServerTest(unittest.TestCase):
         assert txt == "binary-message-received, and this is some message for the long size."
         assert bs.decode() == bs2.decode() == msg0 + msg1 + msg2
 
+    def test_ws_frames_in_one_packet(self):
+        ws = websocket.WebSocket()
+        ws.connect(f"ws://127.0.0.1:{self.PORT}/ws/test-ws")
+        msgs = ["first", "", "third" * 30, "fourth" * 20000]
+        ws.sock.sendall(b"".join([websocket.ABNF.create_frame(m, websocket.ABNF.OPCODE_TEXT).format() for m in msgs]))
+        for m in msgs:
+            assert ws.recv() == f"test-ws-{m}"
+        ws.close()
+
+    def test_ws_large_message(self):
+        ws = websocket.WebSocket()
+        ws.connect(f"ws://127.0.0.1:{self.PORT}/ws/test-ws")
+        msg = "中文-large-" * 30000
+        ws.send(msg)
+        assert ws.recv() == f"test-ws-{msg}"
+        ws.close()
+
+    def test_ws_bytes(self):
+        ws = websocket.WebSocket()
+        ws.connect(f"ws://127.0.0.1:{self.PORT}/ws/test-ws")
+        ws.send_binary(b"Hello Websocket Bytes!")
+        txt: str = ws.recv()
+        bs: bytes = ws.recv()
+        ws.close()
+        assert txt == "binary-message-received, and this is some message for the long size."
+        assert bs == b"Hello Websocket Bytes!"
+
     def test_ws_regexp(self):
         ws = websocket.WebSocket()
         path_val = "wstest"
@@ -237,6 +459,208 @@ class ThreadingServerTest(unittest.TestCase):
         body = self.visit("param/narrowing?a=c")
         assert body == 'a!=b'
 
+    def test_params_narrowing_by_value(self):
+        assert self.visit("param/version?v=1") == "v1"
+        assert self.visit("param/version?v=2") == "v2"
+        assert self.visit("param/version?v=3") == "default"
+        assert self.visit("param/version") == "default"
+
+    def test_params_narrowing_by_form_body(self):
+        body = self.visit("param/narrowing", headers={"Content-Type": "application/x-www-form-urlencoded"},
+                          data=b"a=b")
+        assert body == 'a=b'
+
+    def test_multipart_upload(self):
+        import hashlib
+        content = os.urandom(1024 * 1024 * 2 + 17)
+        boundary = "----naja-atra-test-boundary"
+        body = b"".join([
+            f"--{boundary}\r\n".encode(),
+            'Content-Disposition: form-data; name="note"\r\n\r\n'.encode(),
+            "备注".encode("utf-8"),
+            f"\r\n--{boundary}\r\n".encode(),
+            'Content-Disposition: form-data; name="file"; filename="a.bin"\r\n'.encode(),
+            b"Content-Type: application/octet-stream\r\n\r\n",
+            content,
+            f"\r\n--{boundary}--\r\n".encode()
+        ])
+        res = self.visit("upload/digest", headers={"Content-Type": f"multipart/form-data; boundary={boundary}"},
+                         data=body, return_type="JSON")
+        assert res == {"filename": "a.bin", "size": len(content),
+                       "md5": hashlib.md5(content).hexdigest(), "note": "备注"}
+
+    def test_spooled_body(self):
+        import hashlib
+        for size in (1024, 1024 * 1024 * 6):
+            content = os.urandom(size)
+            res = self.visit("body/spooled", headers={"Content-Type": "application/octet-stream"},
+                             data=content, return_type="JSON")
+            assert res == {"size": size, "spooled": size > 1024 * 1024, "md5": hashlib.md5(content).hexdigest()}
+
+    def test_body_budget(self):
+        conn = http.client.HTTPConnection("127.0.0.1", self.PORT)
+        try:
+            conn.putrequest("POST", "/post_txt")
+            conn.putheader("Content-Type", "application/octet-stream")
+            conn.putheader("Content-Length", str(1024 * 1024 * 5))
+            conn.endheaders()
+            assert conn.getresponse().status == 413
+        finally:
+            conn.close()
+
+    def test_multipart_body_budget(self):
+        boundary = "----naja-atra-test-boundary"
+        body = b"".join([
+            f"--{boundary}\r\n".encode(),
+            b'Content-Disposition: form-data; name="note"\r\n\r\n',
+            b"x" * (1024 * 1024 * 5),
+            f"\r\n--{boundary}--\r\n".encode()
+        ])
+        try:
+            self.visit("upload/digest", headers={"Content-Type": f"multipart/form-data; boundary={boundary}"}, data=body)
+            assert False, "should not reach here"
+        except urllib.error.HTTPError as err:
+            assert err.code == 413
+        # The budget is given back after the response is sent.
+        for _ in range(10):
+            if server._server.server.body_budget.in_flight == 0:
+                break
+            sleep(0.1)
+        assert server._server.server.body_budget.in_flight == 0
+
+    def test_expect_continue(self):
+        def send(content_length: int):
+            sock = socket.create_connection(("127.0.0.1", self.PORT))
+            sock.sendall(f"POST /body/limited HTTP/1.1\r\nHost: 127.0.0.1\r\nContent-Length: {content_length}\r\n"
+                         "Content-Type: application/octet-stream\r\nExpect: 100-continue\r\n\r\n".encode())
+            return sock
+
+        sock = send(1024)
+        try:
+            assert sock.recv(1024).startswith(b"HTTP/1.1 413")
+        finally:
+            sock.close()
+
+        sock = send(5)
+        try:
+            assert sock.recv(1024) == b"HTTP/1.1 100 Continue\r\n\r\n"
+            sock.sendall(b"hello")
+            res = b""
+            while not res.endswith(b"hello"):
+                data = sock.recv(1024)
+                assert data
+                res += data
+            assert res.startswith(b"HTTP/1.1 200")
+        finally:
+            sock.close()
+
+    def test_expect_continue_rejected_by_filter(self):
+        sock = socket.create_connection(("127.0.0.1", self.PORT))
+        try:
+            # A JSON body would be read as soon as anything loads the body.
+            sock.sendall(b"POST /filter/auth/echo HTTP/1.1\r\nHost: 127.0.0.1\r\nContent-Length: 5\r\n"
+                         b"Content-Type: application/json\r\nExpect: 100-continue\r\n\r\n")
+            res = sock.recv(1024)
+            assert res.startswith(b"HTTP/1.1 401")
+            assert b"100 Continue" not in res
+        finally:
+            sock.close()
+
+        sock = socket.create_connection(("127.0.0.1", self.PORT))
+        try:
+            sock.sendall(b"POST /filter/auth/echo HTTP/1.1\r\nHost: 127.0.0.1\r\nContent-Length: 5\r\n"
+                         b"Authorization: Bearer token\r\nContent-Type: application/octet-stream\r\n"
+                         b"Expect: 100-continue\r\n\r\n")
+            assert sock.recv(1024) == b"HTTP/1.1 100 Continue\r\n\r\n"
+            sock.sendall(b"hello")
+            res = b""
+            while not res.endswith(b"hello"):
+                data = sock.recv(1024)
+                assert data
+                res += data
+            assert res.startswith(b"HTTP/1.1 200")
+        finally:
+            sock.close()
+
+    def test_filter_rejection_connection(self):
+        def read_until_closed(sock: socket.socket) -> bytes:
+            res = b""
+            data = sock.recv(1024)
+            while data:
+                res += data
+                data = sock.recv(1024)
+            return res
+
+        # The body is never sent without 100 Continue, so the connection cannot be reused and is closed.
+        sock = socket.create_connection(("127.0.0.1", self.PORT))
+        try:
+            sock.settimeout(5)
+            sock.sendall(b"POST /filter/auth/echo HTTP/1.1\r\nHost: 127.0.0.1\r\nContent-Length: 5\r\n"
+                         b"Content-Type: application/json\r\nExpect: 100-continue\r\nConnection: keep-alive\r\n\r\n")
+            res = read_until_closed(sock)
+            assert res.startswith(b"HTTP/1.1 401")
+            assert b"100 Continue" not in res
+        finally:
+            sock.close()
+
+        # The body that is sent anyway is drained, and the next request of the connection is handled.
+        sock = socket.create_connection(("127.0.0.1", self.PORT))
+        try:
+            sock.settimeout(5)
+            sock.sendall(b"POST /filter/auth/echo HTTP/1.1\r\nHost: 127.0.0.1\r\nContent-Length: 5\r\n"
+                         b"Content-Type: application/json\r\nConnection: keep-alive\r\n\r\n12345"
+                         b"POST /filter/auth/echo HTTP/1.1\r\nHost: 127.0.0.1\r\nContent-Length: 5\r\n"
+                         b"Authorization: Bearer token\r\nContent-Type: application/octet-stream\r\n"
+                         b"Connection: close\r\n\r\nhello")
+            res = read_until_closed(sock)
+            assert res.startswith(b"HTTP/1.1 401")
+            assert res.count(b"HTTP/1.1 ") == 2
+            second = res[res.index(b"HTTP/1.1 ", 1):]
+            assert second.startswith(b"HTTP/1.1 200") and second.endswith(b"hello")
+        finally:
+            sock.close()
+
+    def test_write_backpressure(self):
+        sock = socket.create_connection(("127.0.0.1", self.PORT))
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 64 * 1024)
+            sock.sendall(b"GET /stream/large HTTP/1.1\r\nHost: 127.0.0.1\r\n\r\n")
+            sleep(0.5)
+            if self.COROUTINE:
+                # The client does not read, so the controller should wait instead of buffering the whole body.
+                assert 0 < server._server.server.write_buffer_size <= 2 * 1024 * 1024
+            received = 0
+            data = sock.recv(1024 * 1024)
+            while data:
+                received += len(data)
+                data = sock.recv(1024 * 1024)
+            assert received > 32 * 1024 * 1024
+        finally:
+            sock.close()
+
+    def test_unread_body_keep_alive(self):
+        conn = http.client.HTTPConnection("127.0.0.1", self.PORT)
+        try:
+            conn.request("POST", "/param/version?v=1", body=json.dumps({"a": "b"}),
+                         headers={"Content-Type": "application/json", "Connection": "keep-alive"})
+            assert conn.getresponse().read() == b"v1"
+            conn.request("GET", "/param/version?v=2", headers={"Connection": "keep-alive"})
+            assert conn.getresponse().read() == b"v2"
+        finally:
+            conn.close()
+
+    def test_keep_alive_max_request(self):
+        conn = http.client.HTTPConnection("127.0.0.1", self.PORT)
+        try:
+            for i in range(12):
+                conn.request("GET", "/param/version?v=2", headers={"Connection": "keep-alive"})
+                res = conn.getresponse()
+                assert res.read() == b"v2"
+                # The server closes the connection after 10 requests and says so in the last response.
+                assert (res.getheader("Connection") == "close") == (i == 9)
+        finally:
+            conn.close()
+
     def test_model_binding(self):
         name = "keijack"
         sex = "male"
@@ -247,9 +671,329 @@ class ThreadingServerTest(unittest.TestCase):
         assert res["sex"] == sex
         assert res["age"] == age
 
+    def test_binding_plan(self):
+        res = self.visit("binding/plan?name=kj&ids=1&ids=2", return_type="JSON")
+        assert res == {"name": "kj", "ids": [1, 2], "page": 1, "tags": []}
+        res = self.visit("binding/plan?name=kj&ids=3&page=2&tags=a&tags=b", return_type="JSON")
+        assert res == {"name": "kj", "ids": [3], "page": 2, "tags": ["a", "b"]}
+        for query in ("ids=1", "name=kj&ids=x"):
+            try:
+                self.visit(f"binding/plan?{query}")
+                assert False, "should not reach here"
+            except urllib.error.HTTPError as err:
+                assert err.code == 400
+
+    def test_structured_model_binding(self):
+        data = json.dumps({"item": "book", "count": "2", "tags": ["a", "b"],
+                           "address": {"city": "gz", "zip_code": "510000"}}).encode()
+        res: Dict = self.visit("model_binding/order", headers={"Content-Type": "application/json"},
+                               data=data, return_type="JSON")
+        assert res == {"item": "book", "count": 2, "tags": ["a", "b"], "city": "gz", "zip_code": 510000}
+
+        try:
+            self.visit("model_binding/order", headers={"Content-Type": "application/json"},
+                       data=json.dumps({"count": "x"}).encode())
+            assert False, "should not reach here"
+        except urllib.error.HTTPError as err:
+            assert err.code == 400
+            body = err.read().decode("utf-8")
+            assert "$.item" in body and "$.count" in body
+
 
 class CoroutineServerTest(ThreadingServerTest):
 
     PORT = 9091
 
     COROUTINE = True
+
+
+@dataclass
+class _BindingOrder:
+    item: str
+
+
+@dataclass
+class _BrokenOrder:
+    other: "NotDefined"  # noqa: F821
+
+
+class _CustomDefaultBinding(ModelBinding):
+    pass
+
+
+class ModelBindingPlanTest(unittest.TestCase):
+
+    def test_plan_cache(self):
+        from tests.ctrls.my_controllers import binding_plan_ctrl
+        root = os.path.dirname(os.path.abspath(__file__))
+        routing = RoutingServer(res_conf={"/public/*": f"{root}/static"})
+        ctrl = _ControllerFunction(url="/binding/plan", func=binding_plan_ctrl)
+        routing.map_controller(ctrl)
+        plan = routing.get_binding_plan(ctrl)
+        assert routing.get_binding_plan(ctrl) is plan
+        assert [b.arg_type for b in plan.args] == [str, List[int]]
+        assert [(b.arg, b.val) for b in plan.kwargs] == [("page", 1), ("tags", [])]
+
+        # The plan of the static resource controller is created when it is first requested.
+        static_ctrl, path_values, _ = routing.get_url_controller("public/a.txt", "GET")
+        assert path_values == {"__path_wildcard": "a.txt"}
+        static_plan = routing.get_binding_plan(static_ctrl)
+        assert routing.get_binding_plan(static_ctrl) is static_plan
+        assert routing.get_url_controller("public/b.txt", "GET")[0] is static_ctrl
+
+    def test_binding_type(self):
+        conf = ModelBindingConf()
+        assert conf.get_binding_type(_BindingOrder) is StructuredModelBinding
+        conf.default_model_binding_type = _CustomDefaultBinding
+        assert conf.get_binding_type(_BindingOrder) is _CustomDefaultBinding
+        conf.model_bingding_types[_BindingOrder] = StructuredModelBinding
+        assert conf.get_binding_type(_BindingOrder) is StructuredModelBinding
+
+        def ctrl(order: _BrokenOrder):
+            return order
+        plan = ModelBindingPlan(ctrl, ModelBindingConf())
+        assert plan.args[0].binding_type is DefaultModelBinding
+
+    def test_plan_bind(self):
+        from tests.ctrls.my_controllers import binding_plan_ctrl
+        plan = ModelBindingPlan(binding_plan_ctrl, ModelBindingConf())
+        req = Request()
+        req.parameters = {"name": ["kj"], "ids": ["1", "2"], "tags": ["a"]}
+        args, kwargs = asyncio.run(plan.bind(req, Response()))
+        assert args == ["kj", [1, 2]]
+        assert kwargs == {"page": 1, "tags": ["a"]}
+
+        req.parameters = {"ids": ["1"]}
+        with self.assertRaises(HttpError) as ctx:
+            asyncio.run(plan.bind(req, Response()))
+        assert ctx.exception.code == 400 and "Parameter[name]" in ctx.exception.explain
+
+
+class _UpperKeysCodec(JSONCodec):
+
+    name = "upper-keys"
+
+    def loads(self, data):
+        return {k.upper(): v for k, v in json.loads(data).items()}
+
+    def dumps_bytes(self, obj):
+        return json.dumps({k.upper(): v for k, v in obj.items()}).encode()
+
+
+class JSONCodecTest(unittest.TestCase):
+
+    def test_auto_select(self):
+        expected = "json"
+        for name in ("orjson", "ujson", "msgspec"):
+            try:
+                __import__(name)
+                expected = name
+                break
+            except ImportError:
+                continue
+        codec = get_json_codec()
+        assert codec.name == expected
+        assert get_json_codec() is codec
+        assert get_json_codec(expected) is codec
+        assert codec.loads(codec.dumps_bytes({"a": ["中文", 1]})) == {"a": ["中文", 1]}
+        # Values that the third party libraries cannot encode are encoded by the standard library.
+        assert codec.loads(codec.dumps({"big": 2 ** 70})) == {"big": 2 ** 70}
+
+    def test_stdlib_fallback(self):
+        def not_installed():
+            raise ImportError("not installed")
+        with mock.patch.dict(json_codec._codec_factories, {"missing": not_installed}, clear=True), \
+                mock.patch.object(json_codec, "_default_codec", None):
+            codec = get_json_codec()
+            assert isinstance(codec, StdlibJSONCodec)
+            assert codec.dumps({"a": "中文"}) == '{"a": "中文"}'
+            with self.assertRaises(ImportError):
+                get_json_codec("missing")
+            with self.assertRaises(ValueError):
+                get_json_codec("not-registered")
+
+    def test_select_by_name_or_instance(self):
+        assert isinstance(get_json_codec("json"), StdlibJSONCodec)
+        register_json_codec(_UpperKeysCodec.name, _UpperKeysCodec)
+        assert _UpperKeysCodec.name in json_codec_names()
+        app_conf = get_app_conf("json_codec_test")
+        assert app_conf.json_codec is get_json_codec()
+        app_conf.json_codec = _UpperKeysCodec.name
+        assert app_conf.json_codec is get_json_codec(_UpperKeysCodec.name)
+        assert app_conf.json_codec.loads('{"a": 1}') == {"A": 1}
+        codec = StdlibJSONCodec()
+        app_conf.json_codec = codec
+        assert app_conf.json_codec is codec
+
+    def test_decode_error(self):
+        for name in json_codec_names():
+            try:
+                codec = get_json_codec(name)
+            except ImportError:
+                continue
+            for data in (b'{"a": 1', b"\xff", "not json"):
+                with self.assertRaises(codec.decode_error):
+                    codec.loads(data)
+
+    def test_decode_response_body(self):
+        content_type, body = decode_response_body({"a": "中文"}, _UpperKeysCodec())
+        assert content_type.startswith("application/json")
+        assert body == b'{"A": "\\u4e2d\\u6587"}'
+        content_type, body = decode_response_body({"a": "中文"})
+        assert isinstance(body, bytes) and json.loads(body) == {"a": "中文"}
+        assert decode_response_body("<html></html>")[0].startswith("text/html")
+
+
+class LazyRequestTest(unittest.TestCase):
+
+    def test_parameters_decoded_on_first_access(self):
+        req = RequestWrapper()
+        req.query_string = "name=%E4%B8%AD%E6%96%87&tag=a&tag=b"
+        with mock.patch.object(http_utils, "decode_query_string", wraps=http_utils.decode_query_string) as decode:
+            view = _ParametersView(req)
+            assert decode.call_count == 0
+            assert "tag" in view and len(view) == 2
+            assert req.parameter == {"name": "中文", "tag": "a"}
+            assert req.parameters == {"name": ["中文"], "tag": ["a", "b"]}
+            assert decode.call_count == 1
+        req.parameters = {"x": ["1"]}
+        assert req.parameter == {"x": "1"}
+
+    def test_cookies_loaded_on_first_access(self):
+        req = RequestWrapper()
+        assert len(req.cookies) == 0
+        assert req.get_session() is None
+        req = RequestWrapper()
+        req.headers = HttpHeaders([("Cookie", "a=1; b=2")])
+        assert {k: v.value for k, v in req.cookies.items()} == {"a": "1", "b": "2"}
+        assert req.cookies is req.cookies
+
+    def test_headers_to_dict(self):
+        headers = HttpHeaders({"Content-Type": "text/plain", "Set-Cookie": "a=1"})
+        headers.add("set-cookie", "b=2")
+        assert headers["content-type"] == "text/plain" and headers.get_all("SET-COOKIE") == ["a=1", "b=2"]
+        dic = headers.to_dict()
+        assert type(dic) is dict
+        assert dic == {"Content-Type": "text/plain", "Set-Cookie": ["a=1", "b=2"]}
+        assert json.loads(json.dumps(dic)) == dic
+
+    def test_decode_query_string(self):
+        assert http_utils.decode_query_string("") == {}
+        assert http_utils.decode_query_string("a=1&&b=") == {"a": ["1"], "": [""], "b": [""]}
+        assert http_utils.decode_query_string("a=x%3Dy&a=2&c&%E4%B8%AD=1=2") == {"a": ["x=y", "2"], "c": [""], "中": ["1=2"]}
+
+
+class SamplingProfilerTest(unittest.TestCase):
+
+    def test_secret_required(self):
+        assert SamplingProfiler().path == ""
+        assert SamplingProfiler(secret="s").path == "/_sampling_profiler"
+        assert SamplingProfiler(secret="s", path="/_stacks").path == "/_stacks"
+        with self.assertRaises(AssertionError):
+            SamplingProfiler(path="/_stacks")
+        req = Request()
+        with self.assertRaises(HttpError) as ctx:
+            SamplingProfiler().response(req)
+        assert ctx.exception.code == 403
+
+
+class AccessLogTest(unittest.TestCase):
+
+    def test_stream_buffered(self):
+        stream = io.StringIO()
+        log = AccessLog(format="%(path)s", stream=stream, buffer_size=1024 * 1024, flush_interval=60)
+
+        def write():
+            for i in range(100):
+                log.log(path=f"/p/{i}", status=200)
+        threads = [Thread(target=write) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert stream.getvalue() == ""
+        log.flush()
+        assert len(stream.getvalue().splitlines()) == 400
+        log.log(path="/last", status=200)
+        with mock.patch("atexit.unregister") as unregister:
+            log.close()
+        unregister.assert_called_once_with(log.close)
+        assert stream.getvalue().splitlines()[-1] == "/last"
+        log.log(path="/closed", status=200)
+        assert "/closed" not in stream.getvalue()
+
+
+class LoggerTest(unittest.TestCase):
+
+    def test_level_change(self):
+        factory = LoggerFactory("INFO")
+        log = factory.get_logger("level_test")
+        assert not log.isEnabledFor(logging.DEBUG)
+        factory.log_level = "DEBUG"
+        assert log.isEnabledFor(logging.DEBUG)
+
+    def test_drop_and_flush(self):
+        factory = LoggerFactory()
+        stream = io.StringIO()
+        handler = logging.StreamHandler(stream)
+        blocking = Event()
+        handler.addFilter(lambda _: blocking.wait(5))
+        factory.set_handler(handler)
+        log = factory.get_logger("queue_test")
+        logger_thread = LazyCalledLoggerThread(capacity=2)
+        origin_thread = CachingLogger.logger_thread
+        CachingLogger.logger_thread = logger_thread
+        try:
+            for i in range(10):
+                log.info("record %d", i)
+        finally:
+            CachingLogger.logger_thread = origin_thread
+        blocking.set()
+        logger_thread.flush()
+        # The first record may be taken by the thread before the queue is filled up.
+        assert logger_thread.dropped_records in (7, 8)
+        assert stream.getvalue().count("\n") == 10 - logger_thread.dropped_records
+
+    def test_drop_from_many_threads(self):
+        logger_thread = LazyCalledLoggerThread(capacity=0)
+
+        def drop():
+            for _ in range(1000):
+                logger_thread.call_logger_handler(None, None)
+        threads = [Thread(target=drop) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        logger_thread.flush()
+        assert logger_thread.dropped_records == 8000
+
+    def test_block_in_logger_thread(self):
+        factory = LoggerFactory()
+        stream = io.StringIO()
+        log = factory.get_logger("block_test")
+
+        class RelogHandler(logging.StreamHandler):
+
+            def emit(self, record):
+                super().emit(record)
+                if record.getMessage() == "outer":
+                    # Logged in the logger thread, the third one finds the queue full.
+                    for i in range(5):
+                        log.info("inner %d", i)
+
+        factory.set_handler(RelogHandler(stream))
+        logger_thread = LazyCalledLoggerThread(capacity=2, overflow=LazyCalledLoggerThread.OVERFLOW_BLOCK)
+        origin_thread = CachingLogger.logger_thread
+        CachingLogger.logger_thread = logger_thread
+        try:
+            log.info("outer")
+            for _ in range(50):
+                if logger_thread.dropped_records:
+                    break
+                sleep(0.1)
+            assert logger_thread.dropped_records == 3
+            logger_thread.flush()
+        finally:
+            CachingLogger.logger_thread = origin_thread
+        assert stream.getvalue().count("\n") == 3